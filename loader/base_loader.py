@@ -10,10 +10,12 @@ https://docs.google.com/document/d/1QSa7Ubw-muyD_u0X_dq9WeKyK_dCJXi4Ex7S_pil1uk/
 
 Note: The TOPMed Google controlled access buckets are based on ACLs for user accounts
 Before running this loader, configure use of Google user account, run: gcloud auth login
+
+The cloud and DSS client libraries are imported where they are first needed rather than at the top
+of this module, because importing them takes much longer than a dry run or a small load.
 """
 import base64
 import binascii
-import json
 import logging
 import mimetypes
 import os
@@ -21,24 +23,15 @@ import time
 import uuid
 from io import open
 from tempfile import mkdtemp
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from urllib.parse import urlparse
 from warnings import warn
 
-import boto3
-import botocore
 import requests
-from boto3.s3.transfer import TransferConfig
-from google.oauth2.credentials import Credentials
-from cloud_blobstore import s3
-from dcplib import s3_multipart
-from dcplib.checksumming_io import ChecksummingBufferedReader
-from google.cloud.storage import Client
-from hca import HCAConfig
-from hca.dss import DSSClient
-from hca.util import SwaggerAPIException
-
-from util import tz_utc_now, monkey_patch_hca_config
+
+from loader.deadlines import DeadlineExceeded, Timeouts, current_deadline
+from loader.throttling import RateLimiter, install_s3_rate_limiter
+from util import lazy_property, serialization, single_flight, tz_utc_now
 
 logger = logging.getLogger(__name__)
 
@@ -73,9 +66,28 @@ class UnexpectedResponseError(Exception):
     """Thrown when DSS gives an unexpected response"""
 
 
+# The files loaded in this process are shared by the uploaders to the same DSS. The filename is part of
+# the keys because it is part of the file_info returned, the size because it is checked against that of the
+# cloud objects, and the GUID because it is part of the file reference uploaded.
+def _by_reference_key(uploader, filename, file_uuid, file_cloud_urls, size, guid, file_version=None):
+    return uploader.dss_endpoint, filename, file_uuid, file_version, frozenset(file_cloud_urls), size, guid
+
+
+def _by_value_key(uploader, filename, file_uuid, file_cloud_urls, size, file_version=None):
+    return uploader.dss_endpoint, filename, file_uuid, file_version, frozenset(file_cloud_urls), size
+
+
+def _already_present(file_info: tuple) -> tuple:
+    """The file_info for the callers that share another's load of the file, which is in the DSS by then"""
+    file_uuid, file_version, filename, _ = file_info
+    return file_uuid, file_version, filename, True
+
+
 class DssUploader:
     def __init__(self, dss_endpoint: str, staging_bucket: str, google_project_id: str, dry_run: bool,
-                 aws_meta_cred: str = None, gcp_meta_cred: str = None) -> None:
+                 aws_meta_cred: str = None, gcp_meta_cred: str = None,
+                 content_addressed_staging: bool = False, transfer_config=None, timeouts=None,
+                 rate_limiter=None) -> None:
         """
         Functions for uploading files to a given DSS.
 
@@ -92,60 +104,162 @@ class DssUploader:
                         Otherwise, actually perform the operations.
         :param aws_meta_cred: Optional credentials used to fetch metadata from a private bucket.
         :param gcp_meta_cred: Optional credentials used to fetch metadata from a private bucket.
+        :param content_addressed_staging: If True, stage local files under keys derived from their sha256
+                                          checksum, "sha256/{sha256}/{basename}", rather than their file UUID,
+                                          so that identical content is only ever uploaded to the staging bucket once.
+        :param transfer_config: A `loader.staging.StagingTransferConfig` tuning the upload of local files to the
+                                staging bucket. Defaults to the same settings as boto3's transfer manager.
+        :param timeouts: The `loader.deadlines.Timeouts` of the calls to S3, GCS and the DSS.
+        :param rate_limiter: A `loader.throttling.RateLimiter` of the requests to S3, GCS and the DSS.
         """
         os.environ['GOOGLE_CLOUD_PROJECT'] = google_project_id
         self.dss_endpoint = dss_endpoint
         self.staging_bucket = staging_bucket
         self.google_project_id = google_project_id
         self.dry_run = dry_run
-        self.s3_client = boto3.client("s3")
-        self.s3_blobstore = s3.S3BlobStore(self.s3_client)
-        self.gs_client = Client(project=self.google_project_id)
 
-        # optional clients for fetching protected metadata that the
+        # optional credentials for fetching protected metadata that the
         # main credentials may not have access to
         self.aws_meta_cred = aws_meta_cred
         self.gcp_meta_cred = gcp_meta_cred
-        self.s3_metadata_client = self.get_s3_metadata_client(self.aws_meta_cred)
-        self.gs_metadata_client = self.get_gs_metadata_client(self.gcp_meta_cred)
-
-        # Work around problems with DSSClient initialization when there is
-        # existing HCA configuration. The following issue has been submitted:
-        # Problems accessing an alternate DSS from user scripts or unit tests #170
-        # https://github.com/HumanCellAtlas/dcp-cli/issues/170
-        monkey_patch_hca_config()
-        HCAConfig._user_config_home = '/tmp/'
-        dss_config = HCAConfig(name='loader', save_on_exit=False, autosave=False)
+        self.content_addressed_staging = content_addressed_staging
+        self.transfer_config = transfer_config
+        self.timeouts = timeouts or Timeouts()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # The asynchronous DSS copies started but not yet seen to finish, by file UUID and version
+        self.pending_copies: Dict[tuple, dict] = dict()
+
+        # The clients below are created on first use, so that runs which never touch a
+        # given cloud (or the DSS, in the case of dry runs) don't pay for setting them up.
+
+    @lazy_property
+    def s3_client(self):
+        import boto3
+        return self._with_rate_limits(boto3.client("s3", config=self._botocore_config()))
+
+    @lazy_property
+    def s3_blobstore(self):
+        from cloud_blobstore import s3
+        return s3.S3BlobStore(self.s3_client)
+
+    @lazy_property
+    def gs_client(self):
+        from google.cloud.storage import Client
+        return self._with_timeouts(Client(project=self.google_project_id))
+
+    @lazy_property
+    def s3_metadata_credentials(self):
+        return self.get_s3_metadata_credentials(self.aws_meta_cred)
+
+    @lazy_property
+    def s3_metadata_client(self):
+        if self.s3_metadata_credentials is None:
+            return None
+        return self._with_rate_limits(self.s3_metadata_credentials.client('s3', config=self._botocore_config()))
+
+    @lazy_property
+    def gs_metadata_client(self):
+        return self.get_gs_metadata_client(self.gcp_meta_cred)
+
+    @lazy_property
+    def s3_router(self):
+        """Region-local clients for every bucket we access"""
+        from loader.s3_clients import S3ClientRouter
+        return S3ClientRouter(self.s3_metadata_credentials,
+                              connect_timeout=self.timeouts.connect, read_timeout=self.timeouts.read,
+                              rate_limiter=self.rate_limiter)
+
+    @lazy_property
+    def checksum_cache(self):
+        """Checksums of local files computed by previous runs"""
+        from loader.checksumming import ChecksumCache
+        return ChecksumCache()
+
+    @lazy_property
+    def dss_file_cache(self):
+        """File versions known to be in the DSS"""
+        from loader.dss_api import DssFileCache
+        return DssFileCache(self.dss_endpoint)
+
+    @lazy_property
+    def swagger_spec_path(self):
+        """The path to a locally cached copy of the DSS swagger spec"""
+        from loader.dss_api import SwaggerSpecCache
+        return SwaggerSpecCache().get(f'{self.dss_endpoint}/swagger.json')
+
+    @lazy_property
+    def dss_api(self):
+        """Requests for the DSS operations the loader performs"""
+        from loader.dss_api import DssApi
+        dss_api = DssApi.from_spec_file(self.swagger_spec_path, lambda: self.dss_client)
+        dss_api.timeouts = self.timeouts
+        dss_api.rate_limiter = self.rate_limiter
+        return dss_api
+
+    @lazy_property
+    def dss_client(self):
+        from hca import HCAConfig
+        from hca.dss import DSSClient
+
+        class LoaderHCAConfig(HCAConfig):
+            # Work around problems with DSSClient initialization when there is
+            # existing HCA configuration. The following issue has been submitted:
+            # Problems accessing an alternate DSS from user scripts or unit tests #170
+            # https://github.com/HumanCellAtlas/dcp-cli/issues/170
+            def __init__(self, *args, **kwargs):
+                HCAConfig.__bases__[0].__init__(self, *args, name='loader', **kwargs)
+
+        dss_config = LoaderHCAConfig(save_on_exit=False, autosave=False)
         dss_config['DSSClient'].swagger_url = f'{self.dss_endpoint}/swagger.json'
-        self.dss_client = DSSClient(config=dss_config)
+        # Use our cached copy of the spec rather than having the client download it.
+        dss_config.swagger_filename = self.swagger_spec_path
+        return DSSClient(config=dss_config)
+
+    def _botocore_config(self):
+        from botocore.config import Config
+        return Config(connect_timeout=self.timeouts.connect, read_timeout=self.timeouts.read)
+
+    def _with_rate_limits(self, s3_client):
+        install_s3_rate_limiter(s3_client, self.rate_limiter)
+        return s3_client
+
+    def _with_timeouts(self, gs_client):
+        """Apply our timeouts to the requests of a GCS client, which sets none of its own"""
+        from loader.deadlines import set_default_timeout
+        set_default_timeout(gs_client._http, self.timeouts)
+        return gs_client
 
     @staticmethod
-    def get_s3_metadata_client(aws_meta_cred, session='NIH-Test', duration=43199):
+    def get_s3_metadata_credentials(aws_meta_cred, session='NIH-Test', duration=43199):
         """
-        Access AWS credentials from a file and supply a client for them.
+        Access an AWS AssumedRole ARN from a file and supply a shared provider of credentials
+        for that role, which renews them in the background before they expire.
 
         :param aws_meta_cred: File containing an AWS ARN for an AssumedRole, e.g.:
                               'arn:aws:iam::************:role/ROLE_NAME_HERE'
-        :param duration: How long, in seconds, the AssumedRole will be valid for.
-        :return: An AWS s3 client object authorized with the above credentials or None.
+        :param duration: How long, in seconds, each set of AssumedRole credentials will be valid for.
+        :return: An AssumedRoleCredentialProvider or None.
         """
         if not aws_meta_cred:
             return None
 
-        sts_client = boto3.client('sts')
+        from loader.credentials import get_assumed_role_provider
         with open(aws_meta_cred, 'r') as f:
             role_arn = f.read().strip()
+        return get_assumed_role_provider(role_arn, session, duration)
 
-        # DurationSeconds can have a value from 900s to 43200s (as of 10.23.2018).
-        # 900s = 15 min; 43200s = 12 hours
-        # https://docs.aws.amazon.com/cli/latest/reference/sts/assume-role.html
-        assumed_role = sts_client.assume_role(RoleArn=role_arn, RoleSessionName=session, DurationSeconds=duration)
+    @staticmethod
+    def get_s3_metadata_client(aws_meta_cred, session='NIH-Test', duration=43199):
+        """
+        Access AWS credentials from a file and supply a client for them.
 
-        credentials = assumed_role['Credentials']
-        return boto3.client('s3',
-                            aws_access_key_id=credentials['AccessKeyId'],
-                            aws_secret_access_key=credentials['SecretAccessKey'],
-                            aws_session_token=credentials['SessionToken'])
+        :param aws_meta_cred: File containing an AWS ARN for an AssumedRole, e.g.:
+                              'arn:aws:iam::************:role/ROLE_NAME_HERE'
+        :param duration: How long, in seconds, each set of AssumedRole credentials will be valid for.
+        :return: An AWS s3 client object authorized with the above credentials or None.
+        """
+        credentials = DssUploader.get_s3_metadata_credentials(aws_meta_cred, session, duration)
+        return credentials.client('s3') if credentials else None
 
     def get_gs_metadata_client(self, gcp_meta_cred):
         """
@@ -160,8 +274,10 @@ class DssUploader:
         if not gcp_meta_cred:
             return None
 
+        from google.cloud.storage import Client
+        from google.oauth2.credentials import Credentials
         credentials = Credentials(token=None).from_authorized_user_file(gcp_meta_cred)
-        return Client(project=self.google_project_id, credentials=credentials)
+        return self._with_timeouts(Client(project=self.google_project_id, credentials=credentials))
 
     def handle_s3_client_error(self, err_code: str, bucket: str, key: str, attempt_refresh=True):
         """
@@ -180,7 +296,8 @@ class DssUploader:
                  CloudUrlNotFound)
         # refresh the metadata credentials if blocked and if they exist
         elif (err_code in (str(requests.codes.forbidden), str(requests.codes.unauthorized))) and self.aws_meta_cred and attempt_refresh:
-            self.s3_metadata_client = self.get_s3_metadata_client(self.aws_meta_cred)
+            # The credentials are shared by all threads, so concurrent failures only cause a single refresh.
+            self.s3_metadata_credentials.refresh()
             return self.get_s3_file_head_response(bucket, key, attempt_refresh=False)
         else:
             warn(f'Could not find \"s3://{bucket}/{key}\" Error: {err_code}'
@@ -197,9 +314,11 @@ class DssUploader:
         :param attempt_refresh: Ensures attempting to refresh the metadata credentials happens only once per file.
         :return: Returns a head response containing a dictionary of metadata values, or an empty dict in the case of an error.
         """
-        client = self.s3_metadata_client if self.s3_metadata_client else self.s3_client
+        import botocore.exceptions
+        from loader.s3_clients import DEFAULT_CREDENTIALS, METADATA_CREDENTIALS
+        credentials = METADATA_CREDENTIALS if self.s3_metadata_credentials else DEFAULT_CREDENTIALS
         try:
-            return client.head_object(Bucket=bucket, Key=key, RequestPayer="requester")
+            return self.s3_router.head_object(bucket, key, credentials)
         except botocore.exceptions.ClientError as e:
             return self.handle_s3_client_error(e.response['Error']['Code'], bucket, key, attempt_refresh)
 
@@ -235,7 +354,7 @@ class DssUploader:
         metadata = dict()
         client = self.gs_metadata_client if self.gs_metadata_client else self.gs_client
         gs_bucket = client.bucket(bucket, self.google_project_id)
-        blob_obj = gs_bucket.get_blob(key)
+        blob_obj = self._get_gs_blob(gs_bucket, key)
         if blob_obj is not None:
             metadata['size'] = blob_obj.size
             metadata['content-type'] = blob_obj.content_type
@@ -249,6 +368,24 @@ class DssUploader:
                  CloudUrlNotFound)
             return metadata
 
+    def _get_gs_blob(self, gs_bucket, key: str):
+        """Get a blob within the rate limits of its bucket and key, adapting them if GCS throttles the request"""
+        from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+        self.rate_limiter.acquire('gs', gs_bucket.name, key)
+        try:
+            blob = gs_bucket.get_blob(key)
+        except (TooManyRequests, ServiceUnavailable):
+            self.rate_limiter.throttled('gs', gs_bucket.name, key)
+            raise
+        self.rate_limiter.succeeded('gs', gs_bucket.name, key)
+        return blob
+
+    # The same data file often appears in several bundles. Its first occurrence is loaded, the others
+    # wait for (if concurrent) or reuse the result, and report the file as already present. A bundle
+    # running out of time, or being canceled, doesn't fail the others, one of which then loads the file
+    # instead, and each waits no longer than its own deadline.
+    @single_flight(_by_reference_key, private_errors=(DeadlineExceeded,), deadline_func=current_deadline,
+                   shared_result=_already_present)
     def upload_cloud_file_by_reference(self,
                                        filename: str,
                                        file_uuid: str,
@@ -362,8 +499,8 @@ class DssUploader:
             return consolidated_metadata
 
         if self.dry_run:
-            logger.info(f'DRY RUN: upload_cloud_file_by_reference: '
-                        f'{filename} {file_uuid} {str(file_cloud_urls)} {size} {guid}')
+            logger.info('DRY RUN: upload_cloud_file_by_reference: %s %s %s %s %s',
+                        filename, file_uuid, file_cloud_urls, size, guid)
 
         file_reference = _create_file_reference(file_cloud_urls, size, guid)
         return self.upload_dict_as_file(file_reference,
@@ -372,6 +509,123 @@ class DssUploader:
                                         file_version=file_version,
                                         content_type="application/json; dss-type=fileref")
 
+    @single_flight(_by_value_key, private_errors=(DeadlineExceeded,), deadline_func=current_deadline,
+                   shared_result=_already_present)
+    def upload_cloud_file_by_value(self,
+                                   filename: str,
+                                   file_uuid: str,
+                                   file_cloud_urls: set,
+                                   size: int,
+                                   file_version: str = None) -> tuple:
+        """
+        Loads the given cloud file into the DSS by value, i.e. copies its content into the DSS.
+
+        The file is first copied into the staging bucket, server-side if there is an S3 replica, or else by
+        streaming it from GCS, and tagged with its checksums. Checksums are derived from the source's
+        metadata where possible, and otherwise computed by streaming the file. The staged copy is then
+        loaded into the DSS.
+
+        :param filename: The name of the file in the bucket.
+        :param file_uuid: An RFC4122-compliant UUID to be used to identify the file
+        :param file_cloud_urls: A set of 'gs://' and 's3://' bucket links.
+                                e.g. {'gs://broad-public-datasets/g.bam', 's3://ucsc-topmed-datasets/a.bam'}
+        :param size: size of the file in bytes, as provided by the input data to be loaded.
+        :param file_version: a RFC3339 compliant datetime string
+        :return: file_uuid: str, file_version: str, filename: str, already_present: bool
+        :raises InconsistentFileSizeValues: If the input file size doesn't match the size of the cloud file
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from botocore.exceptions import ClientError
+        from dcplib import s3_multipart
+
+        from loader.checksumming import HASH_FUNCTIONS
+        from loader.cloud_copy import checksum_s3_object, checksums_from_tags, copy_s3_object, stream_gs_object
+
+        urls = dict()
+        for cloud_url in file_cloud_urls:
+            url = urlparse(cloud_url)
+            if not (url.netloc and url.path[1:]):
+                raise FileURLError(f'Invalid URL {cloud_url}')
+            if url.scheme not in ('s3', 'gs'):
+                raise FileURLError(f'Unsupported cloud URL scheme: {cloud_url}')
+            urls[url.scheme] = (url.netloc, url.path[1:])
+        key_name = f'{file_uuid}/{filename}'
+        if self.dry_run:
+            logger.info('DRY RUN: upload_cloud_file_by_value: %s %s %s %s', filename, file_uuid, file_cloud_urls, size)
+            return self._upload_tagged_cloud_file_to_dss_by_copy(self.staging_bucket, key_name, file_uuid,
+                                                                 file_version=file_version)
+
+        chunk_size = s3_multipart.get_s3_multipart_chunk_size(int(size))
+        # Files that fit in one part are copied whole, as their S3 ETag assumes
+        multipart_threshold = max(s3_multipart.MULTIPART_THRESHOLD, chunk_size + 1)
+        staging_client = self.s3_router.client(self.staging_bucket)
+        checksums: Dict[str, str] = dict()
+        if 'gs' in urls:
+            checksums.update({k: v for k, v in self.get_gs_file_metadata(*urls['gs']).items() if k == 'crc32c'})
+
+        if 's3' in urls:
+            source_bucket, source_key = urls['s3']
+            source_args = self.s3_router.request_payer_args(source_bucket)
+            source_client = self.s3_router.client(source_bucket)
+            head = source_client.head_object(Bucket=source_bucket, Key=source_key, **source_args)
+            if head['ContentLength'] != int(size):
+                raise InconsistentFileSizeValues(f'Input file size does not match actual S3 file size: '
+                                                 f'input size: {size}, S3 actual size: {head["ContentLength"]}')
+            try:
+                tag_set = source_client.get_object_tagging(Bucket=source_bucket, Key=source_key)['TagSet']
+            except ClientError:
+                tag_set = []
+            # The source's S3 ETag may be for different parts, the copy's is recomputed below
+            checksums.update({k: v for k, v in checksums_from_tags(tag_set).items() if k != 's3_etag'})
+            missing = [name for name in HASH_FUNCTIONS if name not in checksums and name != 's3_etag']
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                if missing:
+                    streamed = executor.submit(checksum_s3_object, source_client, source_bucket, source_key,
+                                               chunk_size, missing, source_args)
+                copy_s3_object(staging_client, source_bucket, source_key, int(size), self.staging_bucket, key_name,
+                               chunk_size=chunk_size, multipart_threshold=multipart_threshold,
+                               source_args=source_args, extra_args=dict(ContentType=head['ContentType']))
+                if missing:
+                    checksums.update(streamed.result())
+            logger.debug('Copied s3://%s/%s server-side, streamed %s', source_bucket, source_key, missing or 'nothing')
+            checksums['s3_etag'] = staging_client.head_object(Bucket=self.staging_bucket,
+                                                              Key=key_name)['ETag'].strip('"')
+        else:
+            gs_bucket, gs_key = urls['gs']
+            client = self.gs_metadata_client if self.gs_metadata_client else self.gs_client
+            blob = self._get_gs_blob(client.bucket(gs_bucket, self.google_project_id), gs_key)
+            if blob is None:
+                raise FileURLError(f'Could not find "gs://{gs_bucket}/{gs_key}"')
+            if blob.size != int(size):
+                raise InconsistentFileSizeValues(f'Input file size does not match actual GS actual file size: '
+                                                 f'input size: {size}, GS actual size: {blob.size}')
+            missing = [name for name in HASH_FUNCTIONS if name not in checksums]
+            content_type = blob.content_type or 'application/octet-stream'
+            checksums.update(stream_gs_object(blob, int(size), staging_client, self.staging_bucket, key_name,
+                                              chunk_size=chunk_size, multipart_threshold=multipart_threshold,
+                                              hash_functions=missing, extra_args=dict(ContentType=content_type)))
+
+        staging_client.put_object_tagging(Bucket=self.staging_bucket,
+                                          Key=key_name,
+                                          Tagging=dict(TagSet=[dict(Key=k, Value=v)
+                                                               for k, v in self._checksum_tags(checksums).items()]))
+        return self._upload_tagged_cloud_file_to_dss_by_copy(self.staging_bucket, key_name, file_uuid,
+                                                             file_version=file_version)
+
+    def get_dss_file_version(self, file_uuid: str, file_version: str) -> Optional[str]:
+        """
+        Check whether the DSS already has the given version of a file.
+
+        :return: The version of the file as formatted by the DSS, or None if the DSS doesn't have it.
+        """
+        dss_version = self.dss_file_cache.get(file_uuid, file_version)
+        if dss_version is None:
+            dss_version = self.dss_api.file_version(uuid=file_uuid, replica="aws", version=file_version)
+            if dss_version is not None:
+                self.dss_file_cache.put(file_uuid, file_version, dss_version)
+        return dss_version
+
     def upload_dict_as_file(self, value: dict,
                             filename: str,
                             file_uuid: str,
@@ -389,8 +643,8 @@ class DssUploader:
         """
         tempdir = mkdtemp()
         file_path = "/".join([tempdir, filename])
-        with open(file_path, "w") as fh:
-            fh.write(json.dumps(value, indent=4))
+        with open(file_path, "wb") as fh:
+            fh.write(serialization.indented_dumps(value))
         result = self.upload_local_file(file_path,
                                         file_uuid,
                                         file_version=file_version,
@@ -436,10 +690,10 @@ class DssUploader:
             logger.info("DRY RUN: DSS put bundle: " + str(kwargs))
             return f"{bundle_uuid}.{kwargs['version']}"
 
-        response = self.dss_client.put_bundle(**kwargs)
+        response = self.dss_api.put_bundle(**kwargs)
         version = response['version']
         bundle_fqid = f"{bundle_uuid}.{version}"
-        logger.info(f"Loaded bundle: {bundle_fqid}")
+        logger.info("Loaded bundle: %s", bundle_fqid)
         return bundle_fqid
 
     @staticmethod
@@ -471,42 +725,90 @@ class DssUploader:
                 return type_
             return "application/octet-stream"
 
-        file_size = os.path.getsize(path)
-        multipart_chunksize = s3_multipart.get_s3_multipart_chunk_size(file_size)
-        tx_cfg = TransferConfig(multipart_threshold=s3_multipart.MULTIPART_THRESHOLD,
-                                multipart_chunksize=multipart_chunksize)
-        s3 = boto3.resource("s3")
-
-        destination_bucket = s3.Bucket(self.staging_bucket)
-        with open(path, "rb") as file_handle, ChecksummingBufferedReader(file_handle, multipart_chunksize) as fh:
-            key_name = "{}/{}".format(file_uuid, os.path.basename(fh.raw.name))
-            destination_bucket.upload_fileobj(
-                fh,
-                key_name,
-                Config=tx_cfg,
-                ExtraArgs={
-                    'ContentType': content_type if content_type is not None else _mime_type(fh.raw.name)
-                }
-            )
-            sums = fh.get_checksums()
-            metadata = {
-                "hca-dss-s3_etag": sums["s3_etag"],
-                "hca-dss-sha1": sums["sha1"],
-                "hca-dss-sha256": sums["sha256"],
-                "hca-dss-crc32c": sums["crc32c"],
-            }
-
-            s3.meta.client.put_object_tagging(Bucket=destination_bucket.name,
-                                              Key=key_name,
-                                              Tagging=dict(TagSet=_encode_tags(metadata))
-                                              )
+        from concurrent.futures import ThreadPoolExecutor
+        from dcplib import s3_multipart
+
+        from loader.staging import MappedFile, StagingTransferConfig, checksum_mapped_file, upload_mapped_file
+
+        transfer_config = self.transfer_config or StagingTransferConfig()
+        stat = os.stat(path)
+        multipart_chunksize = transfer_config.chunk_size(stat.st_size)
+
+        # The S3 ETag among the checksums depends on the part size
+        sums = self.checksum_cache.get(path, stat, multipart_chunksize)
+        if sums is None and self.content_addressed_staging:
+            # The key depends on the content, so it must be checksummed before it is uploaded
+            with MappedFile(path) as mapped_file:
+                sums = checksum_mapped_file(mapped_file, multipart_chunksize)
+            self.checksum_cache.put(path, stat, sums, multipart_chunksize)
+        if self.content_addressed_staging:
+            key_name = "sha256/{}/{}".format(sums["sha256"], os.path.basename(path))
+        else:
+            key_name = "{}/{}".format(file_uuid, os.path.basename(path))
+        if self.dry_run:
+            logger.info('DRY RUN: stage %s as s3://%s/%s', path, self.staging_bucket, key_name)
+            return file_uuid, key_name
+
+        s3_client = self.s3_router.client(self.staging_bucket)
+        if sums is not None and self._is_staged(s3_client, key_name, self._checksum_tags(sums)):
+            logger.info('%s is already staged as s3://%s/%s, skipping upload', path, self.staging_bucket, key_name)
+            return file_uuid, key_name
+
+        # Unless they are cached, the checksums are computed while the file is uploaded,
+        # both from the same memory map
+        with MappedFile(path) as mapped_file, ThreadPoolExecutor(max_workers=1) as executor:
+            if sums is None:
+                checksums = executor.submit(checksum_mapped_file, mapped_file, multipart_chunksize)
+            upload_mapped_file(s3_client,
+                               mapped_file,
+                               self.staging_bucket,
+                               key_name,
+                               chunk_size=multipart_chunksize,
+                               # Files that fit in one part are uploaded whole, as their S3 ETag assumes
+                               multipart_threshold=max(s3_multipart.MULTIPART_THRESHOLD, multipart_chunksize + 1),
+                               extra_args={
+                                   'ContentType': content_type if content_type is not None else _mime_type(path)
+                               },
+                               max_concurrency=transfer_config.max_concurrency,
+                               budget=transfer_config.budget)
+            if sums is None:
+                sums = checksums.result()
+                self.checksum_cache.put(path, stat, sums, multipart_chunksize)
+
+        s3_client.put_object_tagging(Bucket=self.staging_bucket,
+                                     Key=key_name,
+                                     Tagging=dict(TagSet=_encode_tags(self._checksum_tags(sums)))
+                                     )
         return file_uuid, key_name
 
+    @staticmethod
+    def _checksum_tags(checksums: dict) -> dict:
+        return {
+            "hca-dss-s3_etag": checksums["s3_etag"],
+            "hca-dss-sha1": checksums["sha1"],
+            "hca-dss-sha256": checksums["sha256"],
+            "hca-dss-crc32c": checksums["crc32c"],
+        }
+
+    def _is_staged(self, s3_client, key: str, tags: dict) -> bool:
+        """Whether the staging bucket holds the given key, with its content matching the checksum tags"""
+        from botocore.exceptions import ClientError
+        try:
+            head = s3_client.head_object(Bucket=self.staging_bucket, Key=key)
+            if head['ETag'].strip('"') != tags['hca-dss-s3_etag']:
+                return False
+            tag_set = s3_client.get_object_tagging(Bucket=self.staging_bucket, Key=key)['TagSet']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return tags.items() <= {tag['Key']: tag['Value'] for tag in tag_set}.items()
+
     def _upload_tagged_cloud_file_to_dss_by_copy(self, source_bucket: str,
                                                  source_key: str,
                                                  file_uuid: str,
                                                  file_version: str = None,
-                                                 timeout_seconds: int = 1200):
+                                                 timeout_seconds: int = None):
         """
         Uploads a tagged file contained in a cloud bucket to the DSS by copy.
         This is typically used to update a tagged file from a staging bucket into the DSS.
@@ -515,9 +817,14 @@ class DssUploader:
         :param source_key: S3 file to upload.  e.g. 'output.txt' or 'data/output.txt'
         :param file_uuid: An RFC4122-compliant UUID to be used to identify the file.
         :param file_version: a RFC3339 compliant datetime string
-        :param timeout_seconds:  Amount of time to continue attempting an async copy.
+        :param timeout_seconds:  Amount of time to continue attempting an async copy. Defaults to the
+                                 async copy timeout of this uploader, and is cut short by the deadline of
+                                 the bundle being loaded.
         :return: file_uuid: str, file_version: str, filename: str, file_present: bool
         """
+        from hca.util import SwaggerAPIException
+        from loader.dss_api import UPLOAD_BACKOFF_FACTOR
+
         source_url = f"s3://{source_bucket}/{source_key}"
         filename = self.get_filename_from_key(source_key)
 
@@ -528,7 +835,7 @@ class DssUploader:
             return file_uuid, file_version, filename, False
 
         copy_start_time = time.time()
-        response = self.dss_client.put_file._request(request_parameters)
+        response = self.dss_api.put_file(**request_parameters)
 
         # the version we get back here is formatted in the way DSS likes
         # and we need this format update when doing load bundle
@@ -545,13 +852,16 @@ class DssUploader:
                         source_url, file_version, (time.time() - copy_start_time))
         elif response.status_code == requests.codes.accepted:
             logger.info("File %s: Starting async copy -> %s", source_url, file_version)
+            self.pending_copies[file_uuid, file_version] = dict(uuid=file_uuid, version=request_parameters['version'],
+                                                                dss_version=file_version, source_url=source_url)
 
-            timeout = time.time() + timeout_seconds
+            deadline = current_deadline()
+            timeout = time.time() + (self.timeouts.async_copy if timeout_seconds is None else timeout_seconds)
             wait = 1.0
             # TODO: busy wait could hopefully be replaced with asyncio
             while time.time() < timeout:
                 try:
-                    self.dss_client.head_file(uuid=file_uuid, replica="aws", version=file_version)
+                    self.dss_api.head_file(uuid=file_uuid, replica="aws", version=file_version)
                     logger.info("File %s: Finished async copy -> %s (approximately %d seconds)",
                                 source_url, file_version, (time.time() - copy_start_time))
                     break
@@ -559,15 +869,18 @@ class DssUploader:
                     if e.code != requests.codes.not_found:
                         msg = "File {}: Unexpected server response during registration"
                         raise RuntimeError(msg.format(source_url))
-                    time.sleep(wait)
-                    wait = min(10.0, wait * self.dss_client.UPLOAD_BACKOFF_FACTOR)
+                    deadline.sleep(wait)
+                    wait = min(10.0, wait * UPLOAD_BACKOFF_FACTOR)
             else:
                 # timed out. :(
                 raise RuntimeError("File {}: registration FAILED".format(source_url))
+            del self.pending_copies[file_uuid, file_version]
             logger.debug("Successfully uploaded file")
         else:
             raise UnexpectedResponseError(f'Received unexpected response code {response.status_code}')
 
+        if request_parameters['version'] is not None:
+            self.dss_file_cache.put(file_uuid, request_parameters['version'], file_version)
         return file_uuid, file_version, filename, already_present
 
 
@@ -576,13 +889,14 @@ class MetadataFileUploader:
         self.dss_uploader = dss_uploader
 
     def load_cloud_file(self, bucket: str, key: str, filename: str, schema_url: str) -> tuple:
-        metadata_string = self.dss_uploader.s3_blobstore.get(bucket, key).decode("utf-8")
-        metadata = json.loads(metadata_string)
+        from loader.inputs import open_input
+        # Streamed, and decompressed if the key ends in .gz or .zst
+        with open_input(f's3://{bucket}/{key}', self.dss_uploader.s3_client) as fh:
+            metadata = serialization.loads(fh.read())
         return self.load_dict(metadata, filename, schema_url)
 
     def load_local_file(self, local_filename: str, filename: str, schema_url: str) -> tuple:
-        with open(local_filename, "r") as fh:
-            metadata = json.load(fh)
+        metadata = serialization.load_file(local_filename)
         return self.load_dict(metadata, filename, schema_url)
 
     def load_dict(self, metadata: dict, filename: str, schema_url: str, file_version=None) -> tuple:
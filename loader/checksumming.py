@@ -0,0 +1,274 @@
+"""
+Computation of the checksums the DSS requires of staged files: sha1, sha256, crc32c and the S3 ETag.
+
+dcplib's ChecksummingBufferedReader updates each checksum in turn in the thread that reads the
+file, which limits throughput to that of a single core. Here each checksum is computed in a thread
+of its own, fed with the same large chunks of the file. hashlib releases the GIL while hashing
+large buffers, as do the accelerated crc32c implementations, so the checksums are computed in
+parallel with each other and with whatever the reading thread does with the data, e.g. upload it.
+The results are identical to those of ChecksummingBufferedReader.
+
+`ChecksumCache` remembers the checksums of local files across runs, so that re-staging an
+unchanged file doesn't require reading it again.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import sqlite3
+import threading
+import typing
+
+from util import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+KiB = 1024
+MiB = KiB * KiB
+
+# Files are read in chunks of (at most) this size, so each chunk is handed off to the hashing threads in one piece
+READ_CHUNK_SIZE = 8 * MiB
+
+HASH_FUNCTIONS = ('crc32c', 'sha1', 'sha256', 's3_etag')
+
+
+def _crc32c_function() -> typing.Callable[[bytes, int], int]:
+    """Return the fastest available function of (data, crc) computing the crc32c checksum"""
+    try:
+        import crc32c
+        # crc32c >= 2.0 provides crc32c(), older versions only crc32()
+        return getattr(crc32c, 'crc32c', None) or crc32c.crc32
+    except (ImportError, RuntimeError) as e:
+        logger.debug(f'crc32c package not available: {e}')
+    try:
+        import google_crc32c
+        return lambda data, crc: google_crc32c.extend(crc, bytes(data))
+    except ImportError as e:
+        logger.debug(f'google_crc32c package not available: {e}')
+    logger.warning('No accelerated crc32c implementation available, checksumming may be slow.')
+    import crcmod.predefined
+    return crcmod.predefined.mkCrcFun('crc-32c')
+
+
+class CRC32C:
+    """A crc32c digest with the same interface as the hashlib digests"""
+    _crc32c = None
+
+    def __init__(self) -> None:
+        if CRC32C._crc32c is None:
+            CRC32C._crc32c = staticmethod(_crc32c_function())
+        self._value = 0
+
+    def update(self, data) -> None:
+        self._value = self._crc32c(data, self._value)
+
+    def hexdigest(self) -> str:
+        return format(self._value, '08x')
+
+
+class S3Etag:
+    """
+    A digest of the ETag S3 assigns to an object uploaded in parts of the given size, with the same
+    interface as the hashlib digests.
+    """
+    def __init__(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self._part_digests: typing.List[bytes] = []
+        self._part_hasher = hashlib.md5()
+        self._part_bytes = 0
+
+    def update(self, data) -> None:
+        data = memoryview(data)
+        while len(data):
+            if self._part_bytes == self.chunk_size:
+                self._part_digests.append(self._part_hasher.digest())
+                self._part_hasher = hashlib.md5()
+                self._part_bytes = 0
+            head = data[:self.chunk_size - self._part_bytes]
+            self._part_hasher.update(head)
+            self._part_bytes += len(head)
+            data = data[len(head):]
+
+    def hexdigest(self) -> str:
+        if not self._part_digests:
+            return self._part_hasher.hexdigest()
+        part_digests = self._part_digests + ([self._part_hasher.digest()] if self._part_bytes else [])
+        if len(part_digests) == 1:
+            return part_digests[0].hex()
+        return '{}-{}'.format(hashlib.md5(b''.join(part_digests)).hexdigest(), len(part_digests))
+
+
+def _new_hasher(name: str, s3_etag_chunk_size: int):
+    if name == 'crc32c':
+        return CRC32C()
+    elif name == 's3_etag':
+        return S3Etag(s3_etag_chunk_size)
+    else:
+        return hashlib.new(name)
+
+
+class _Chunk:
+    """Data handed to the hashing threads, with a callback once all of them are done with it"""
+    def __init__(self, data, consumers: int, on_done: typing.Optional[typing.Callable]) -> None:
+        self.data = data
+        self._consumers = consumers
+        self._on_done = on_done
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            self._consumers -= 1
+            done = self._consumers == 0
+        if done and self._on_done is not None:
+            self._on_done()
+
+
+class ParallelChecksummer:
+    def __init__(self, s3_etag_chunk_size: int, hash_functions: typing.Sequence[str] = HASH_FUNCTIONS,
+                 max_pending_chunks: int = 4) -> None:
+        """
+        Computes several checksums of a stream of data, each in a thread of its own.
+
+        :param s3_etag_chunk_size: The multipart chunk size the S3 ETag is computed for.
+        :param hash_functions: The checksums to compute.
+        :param max_pending_chunks: How many chunks each hashing thread may lag behind before `update` blocks.
+        """
+        self._queues: typing.Dict[str, queue.Queue] = dict()
+        self._threads: typing.List[threading.Thread] = []
+        self._hashers = dict()
+        self._errors: typing.List[BaseException] = []
+        for name in hash_functions:
+            self._hashers[name] = _new_hasher(name, s3_etag_chunk_size)
+            self._queues[name] = queue.Queue(maxsize=max_pending_chunks)
+            thread = threading.Thread(target=self._hash, args=(name,), name=f'checksum-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._checksums: typing.Optional[dict] = None
+
+    def _hash(self, name: str):
+        hasher, chunks = self._hashers[name], self._queues[name]
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            try:
+                if not self._errors:
+                    hasher.update(chunk.data)
+            except BaseException as e:
+                self._errors.append(e)
+            finally:
+                chunk.release()
+
+    def update(self, data, on_done: typing.Callable = None) -> None:
+        """
+        Add data to the checksums. The data must not be modified until `on_done` is called,
+        which happens once every checksum has been updated with it.
+        """
+        chunk = _Chunk(data, len(self._queues), on_done)
+        for chunks in self._queues.values():
+            chunks.put(chunk)
+
+    def get_checksums(self) -> typing.Dict[str, str]:
+        """Wait for the pending data to be checksummed and return the hex digests"""
+        if self._checksums is None:
+            self.close()
+            if self._errors:
+                raise self._errors[0]
+            self._checksums = {name: hasher.hexdigest() for name, hasher in self._hashers.items()}
+        return self._checksums
+
+    def close(self) -> None:
+        for chunks in self._queues.values():
+            chunks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._queues.clear()
+        self._threads.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+def aligned_read_size(s3_etag_chunk_size: int, read_size: int = READ_CHUNK_SIZE) -> int:
+    """The largest read size up to `read_size` that evenly divides the S3 ETag chunk size"""
+    return math.gcd(s3_etag_chunk_size, read_size)
+
+
+class ChecksumCache:
+    def __init__(self, path: str = None) -> None:
+        """
+        An on-disk cache of the checksums of local files, shared by all loader processes.
+
+        Entries are keyed by the absolute path, size, modification time and inode of a file, so that
+        a file that was changed or replaced since it was checksummed misses the cache. The part size
+        the S3 ETag was computed for is stored with the checksums, and a different one misses too.
+
+        :param path: The SQLite database to store the checksums in. Defaults to one in the loader's cache directory.
+        """
+        self.path = path or os.path.join(CACHE_DIR, 'checksums.sqlite')
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('CREATE TABLE IF NOT EXISTS checksums ('
+                               'path TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, checksums TEXT, '
+                               'PRIMARY KEY (path, size, mtime_ns, inode))')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _key(path: str, stat: os.stat_result) -> tuple:
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, path: str, stat: os.stat_result = None,
+            part_size: int = None) -> typing.Optional[typing.Dict[str, str]]:
+        """
+        Return the cached checksums of the file, or None if it isn't cached, has changed since, or its
+        checksums were computed for another part size.
+        """
+        key = self._key(path, stat or os.stat(path))
+        try:
+            with self._lock:
+                row = self._connect().execute('SELECT checksums FROM checksums '
+                                              'WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                                              key).fetchone()
+        except (OSError, sqlite3.Error):
+            logger.warning(f'Could not read the checksum cache {self.path}', exc_info=True)
+            return None
+        if row is None:
+            return None
+        checksums = json.loads(row[0])
+        # Entries written before part sizes were recorded have none, and miss when one is asked for
+        if checksums.pop('part_size', None) != part_size:
+            return None
+        return checksums
+
+    def put(self, path: str, stat: os.stat_result, checksums: typing.Dict[str, str], part_size: int = None) -> None:
+        """
+        Cache the checksums of the file as of `stat`, which should be taken before the checksums
+        are computed. If the file has changed since, nothing is cached.
+
+        :param part_size: The part size the S3 ETag among the checksums was computed for.
+        """
+        if self._key(path, os.stat(path)) != self._key(path, stat):
+            logger.warning(f'{path} changed while it was checksummed, not caching its checksums')
+            return
+        try:
+            with self._lock:
+                connection = self._connect()
+                # Older entries for the path describe previous versions of the file
+                connection.execute('DELETE FROM checksums WHERE path = ?', (os.path.abspath(path),))
+                connection.execute('INSERT INTO checksums VALUES (?, ?, ?, ?, ?)',
+                                   self._key(path, stat) + (json.dumps(dict(checksums, part_size=part_size)),))
+                connection.commit()
+        except (OSError, sqlite3.Error):
+            logger.warning(f'Could not write to the checksum cache {self.path}', exc_info=True)
@@ -0,0 +1,132 @@
+"""
+Copying of cloud objects into the staging bucket, for loading them into the DSS by value.
+
+S3 objects are copied server-side, in parts of the size the DSS uses for S3 ETags, which are copied
+in parallel with `upload_part_copy`. Their bytes never pass through the loader host, and the S3 ETag
+of the copy is the `s3_etag` checksum the DSS requires. The other checksums are taken from the
+source object's `hca-dss-*` tags, or from the GCS crc32c of a replica, and only those that can't be
+derived this way are computed by streaming the source object through the hashers.
+
+There is no server-side copy from GCS to S3, so objects that are only in GCS are streamed, in
+ranges that are uploaded as parts of a multipart upload and hashed at the same time.
+"""
+import logging
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from loader.checksumming import HASH_FUNCTIONS, READ_CHUNK_SIZE, ParallelChecksummer
+from loader.deadlines import current_deadline
+from loader.staging import DEFAULT_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+TAG_PREFIX = 'hca-dss-'
+
+
+def checksums_from_tags(tag_set: typing.List[dict]) -> typing.Dict[str, str]:
+    """The DSS checksums recorded in an S3 object's `hca-dss-*` tags"""
+    tags = {tag['Key']: tag['Value'] for tag in tag_set}
+    return {name: tags[TAG_PREFIX + name] for name in HASH_FUNCTIONS if TAG_PREFIX + name in tags}
+
+
+def _multipart_upload(s3_client, bucket: str, key: str, extra_args: dict,
+                      upload_parts: typing.Callable[[str], typing.List[dict]]) -> None:
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)['UploadId']
+    try:
+        parts = upload_parts(upload_id)
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                            MultipartUpload=dict(Parts=parts))
+    except BaseException:
+        logger.warning(f'Aborting multipart upload of s3://{bucket}/{key}')
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def copy_s3_object(s3_client, source_bucket: str, source_key: str, size: int, bucket: str, key: str,
+                   chunk_size: int, multipart_threshold: int, source_args: dict = None, extra_args: dict = None,
+                   max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+    """
+    Copy an S3 object server-side, in parallel parts of `chunk_size` if it is at least `multipart_threshold`
+    in size.
+
+    :param source_args: Extra arguments for reading the source, e.g. dict(RequestPayer='requester').
+    :param extra_args: Extra arguments for creating the copy, e.g. dict(ContentType='application/octet-stream').
+    """
+    source_args = source_args or {}
+    extra_args = extra_args or {}
+    copy_source = dict(Bucket=source_bucket, Key=source_key)
+    if size < multipart_threshold:
+        s3_client.copy_object(Bucket=bucket, Key=key, CopySource=copy_source,
+                              MetadataDirective='REPLACE', **source_args, **extra_args)
+        return
+
+    def _upload_parts(upload_id: str) -> typing.List[dict]:
+        def _copy_part(part_number: int, offset: int) -> dict:
+            last_byte = min(offset + chunk_size, size) - 1
+            response = s3_client.upload_part_copy(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                  PartNumber=part_number, CopySource=copy_source,
+                                                  CopySourceRange=f'bytes={offset}-{last_byte}', **source_args)
+            return dict(ETag=response['CopyPartResult']['ETag'], PartNumber=part_number)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(_copy_part, part_number, offset)
+                       for part_number, offset in enumerate(range(0, size, chunk_size), start=1)]
+            return [future.result() for future in futures]
+
+    _multipart_upload(s3_client, bucket, key, extra_args, _upload_parts)
+
+
+def checksum_s3_object(s3_client, bucket: str, key: str, s3_etag_chunk_size: int,
+                       hash_functions: typing.Sequence[str], source_args: dict = None) -> typing.Dict[str, str]:
+    """Compute the given checksums of an S3 object by streaming it"""
+    body = s3_client.get_object(Bucket=bucket, Key=key, **(source_args or {}))['Body']
+    with ParallelChecksummer(s3_etag_chunk_size, hash_functions) as checksummer:
+        for chunk in iter(lambda: body.read(READ_CHUNK_SIZE), b''):
+            current_deadline().check()
+            checksummer.update(chunk)
+        return checksummer.get_checksums()
+
+
+def stream_gs_object(blob, size: int, s3_client, bucket: str, key: str, chunk_size: int, multipart_threshold: int,
+                     hash_functions: typing.Sequence[str], extra_args: dict = None,
+                     max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> typing.Dict[str, str]:
+    """
+    Copy a GCS blob to S3 through the loader host, computing the given checksums on the way.
+
+    The blob is downloaded in ranges of `chunk_size`, in order, each of which is hashed and uploaded as
+    a part while the next one is downloaded. At most `max_concurrency` parts are held in memory.
+    """
+    extra_args = extra_args or {}
+    with ParallelChecksummer(chunk_size, hash_functions) as checksummer:
+        if size < multipart_threshold:
+            data = blob.download_as_string(start=0, end=size - 1) if size else b''
+            checksummer.update(data)
+            s3_client.put_object(Bucket=bucket, Key=key, Body=data, **extra_args)
+            return checksummer.get_checksums()
+
+        def _upload_parts(upload_id: str) -> typing.List[dict]:
+            parts_in_memory = threading.BoundedSemaphore(max_concurrency)
+
+            def _upload_part(part_number: int, data: bytes) -> dict:
+                try:
+                    response = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                     PartNumber=part_number, Body=data)
+                    return dict(ETag=response['ETag'], PartNumber=part_number)
+                finally:
+                    parts_in_memory.release()
+
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = []
+                for part_number, offset in enumerate(range(0, size, chunk_size), start=1):
+                    parts_in_memory.acquire()
+                    if any(future.done() and future.exception() for future in futures):
+                        break  # the failure is raised below
+                    current_deadline().check()
+                    data = blob.download_as_string(start=offset, end=min(offset + chunk_size, size) - 1)
+                    checksummer.update(data)
+                    futures.append(executor.submit(_upload_part, part_number, data))
+                return [future.result() for future in futures]
+
+        _multipart_upload(s3_client, bucket, key, extra_args, _upload_parts)
+        return checksummer.get_checksums()
@@ -0,0 +1,222 @@
+"""
+Refreshable AWS credentials for assumed roles.
+
+The optional AWS metadata credentials (see `--aws-metadata-cred`) are obtained by assuming
+a role, and assumed role credentials expire after at most 12 hours. Rather than every worker
+thread reacting to an expired token on its own, a single provider per role is shared by all
+`DssUploader` instances in a process. Its credentials are renewed in the background before they
+expire, a lock ensures only one `sts:AssumeRole` call is made per refresh, and the assumed role
+credentials are cached on disk (under a file lock) so that concurrent loader processes reuse them
+instead of each assuming the role.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, CredentialResolver, Credentials, RefreshableCredentials
+
+from util import CACHE_DIR, atomic_write, file_lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(CACHE_DIR, 'sts')
+
+# RefreshableCredentials start refreshing this many seconds before expiry
+ADVISORY_REFRESH_TIMEOUT = 15 * 60
+
+
+def _seconds_remaining(metadata: dict) -> float:
+    """The seconds until the given assumed role credentials expire"""
+    expiry_time = datetime.datetime.strptime(metadata['expiry_time'][:19], '%Y-%m-%dT%H:%M:%S')
+    return (expiry_time - datetime.datetime.utcnow()).total_seconds()
+
+
+class _CurrentCredentials(Credentials):
+    """
+    Credentials that always sign with the provider's current RefreshableCredentials, so that clients
+    created before a forced refresh pick up its result.
+    """
+    def __init__(self, provider: 'AssumedRoleCredentialProvider') -> None:
+        self._provider = provider
+        self.method = provider.METHOD
+
+    def get_frozen_credentials(self):
+        return self._provider.credentials.get_frozen_credentials()
+
+    @property
+    def access_key(self):
+        return self.get_frozen_credentials().access_key
+
+    @property
+    def secret_key(self):
+        return self.get_frozen_credentials().secret_key
+
+    @property
+    def token(self):
+        return self.get_frozen_credentials().token
+
+
+class AssumedRoleCredentialProvider(CredentialProvider):
+    METHOD = 'sts-assume-role'
+
+    def __init__(self, role_arn: str, session_name: str, duration: int, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+        """
+        Assumes an AWS role and keeps the resulting credentials fresh.
+
+        :param role_arn: The ARN of the role to assume, e.g. 'arn:aws:iam::************:role/ROLE_NAME_HERE'
+        :param session_name: The RoleSessionName used when assuming the role.
+        :param duration: How long, in seconds, each set of assumed role credentials will be valid for.
+        :param cache_dir: Directory used to share assumed role credentials between processes.
+                          If None, credentials are only shared within this process.
+        """
+        super().__init__()
+        self.role_arn = role_arn
+        self.session_name = session_name
+        self.duration = duration
+        self.cache_dir = cache_dir
+        # When the credentials were last fetched, either by botocore or by a forced refresh
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+        # Serializes fetches, which botocore makes under its own lock and forced refreshes under ours
+        self._fetch_lock = threading.Lock()
+        self._credentials: typing.Optional[RefreshableCredentials] = None
+        self._metadata: typing.Optional[dict] = None
+        self._refresher: typing.Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def credentials(self) -> RefreshableCredentials:
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._create_credentials()
+            return self._credentials
+
+    def _create_credentials(self) -> RefreshableCredentials:
+        return RefreshableCredentials.create_from_metadata(metadata=self._fetch_credentials(),
+                                                           refresh_using=self._fetch_credentials,
+                                                           method=self.METHOD)
+
+    def load(self) -> Credentials:
+        """The credentials for a botocore session, see `botocore.credentials.CredentialProvider`"""
+        return _CurrentCredentials(self)
+
+    def client(self, service_name: str, **kwargs):
+        """Create a boto3 client that signs its requests with this provider's credentials."""
+        botocore_session = botocore.session.get_session()
+        botocore_session.register_component('credential_provider', CredentialResolver(providers=[self]))
+        return boto3.Session(botocore_session=botocore_session).client(service_name, **kwargs)
+
+    def refresh(self, min_age: float = 60) -> bool:
+        """
+        Force a refresh of the credentials, e.g. after they were rejected by AWS before their
+        advertised expiry, unless they were already refreshed less than `min_age` seconds ago,
+        so that many threads hitting the same authorization error only trigger a single refresh.
+
+        :return: True if this call performed the refresh.
+        """
+        with self._lock:
+            if time.time() - self.refreshed_at < min_age:
+                return False
+            self._credentials = self._create_credentials()
+        logger.info(f'Refreshed credentials for assumed role {self.role_arn}')
+        return True
+
+    def start_background_refresh(self) -> None:
+        """Renew the credentials in a daemon thread shortly before they expire."""
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_periodically,
+                                               name='assumed-role-refresh',
+                                               daemon=True)
+            self._refresher.start()
+
+    def stop_background_refresh(self) -> None:
+        self._stopped.set()
+
+    def _refresh_periodically(self):
+        self.credentials.get_frozen_credentials()
+        while not self._stopped.is_set():
+            seconds_until_refresh = _seconds_remaining(self._metadata) - ADVISORY_REFRESH_TIMEOUT
+            if self._stopped.wait(max(seconds_until_refresh, 1)):
+                break
+            try:
+                # Accessing the credentials inside the advisory window refreshes them under the lock.
+                self.credentials.get_frozen_credentials()
+            except Exception:
+                logger.exception(f'Failed to refresh credentials for assumed role {self.role_arn}')
+                self._stopped.wait(60)
+
+    def _fetch_credentials(self) -> dict:
+        with self._fetch_lock:
+            self._metadata = self._fetch_shared_credentials()
+            self.refreshed_at = time.time()
+            return self._metadata
+
+    def _fetch_shared_credentials(self) -> dict:
+        if self.cache_dir is None:
+            return self._assume_role()
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # Credentials assumed for a different duration would expire sooner or later than the caller asked for
+        cache_key = hashlib.sha1(f'{self.role_arn}:{self.session_name}:{self.duration}'.encode()).hexdigest()
+        cache_path = os.path.join(self.cache_dir, f'{cache_key}.json')
+        # Hold an exclusive lock so that only one process assumes the role at a time.
+        with file_lock(cache_path + '.lock'):
+            cached = self._read_cache(cache_path)
+            # Credentials we already hold are being refreshed because they are expiring or were rejected.
+            held_token = self._metadata['token'] if self._metadata is not None else None
+            if cached is not None and cached.get('token') != held_token:
+                return cached
+            credentials = self._assume_role()
+            atomic_write(cache_path, json.dumps(credentials).encode(), mode=0o600)
+            return credentials
+
+    def _assume_role(self) -> dict:
+        logger.debug(f'Assuming role {self.role_arn}')
+        # DurationSeconds can have a value from 900s to 43200s (as of 10.23.2018).
+        # 900s = 15 min; 43200s = 12 hours
+        # https://docs.aws.amazon.com/cli/latest/reference/sts/assume-role.html
+        assumed_role = boto3.client('sts').assume_role(RoleArn=self.role_arn,
+                                                       RoleSessionName=self.session_name,
+                                                       DurationSeconds=self.duration)
+        credentials = assumed_role['Credentials']
+        return dict(access_key=credentials['AccessKeyId'],
+                    secret_key=credentials['SecretAccessKey'],
+                    token=credentials['SessionToken'],
+                    expiry_time=credentials['Expiration'].isoformat())
+
+    @staticmethod
+    def _read_cache(cache_path: str) -> typing.Optional[dict]:
+        try:
+            with open(cache_path) as fh:
+                cached = json.load(fh)
+            seconds_remaining = _seconds_remaining(cached)
+        except (OSError, ValueError, KeyError):
+            return None
+        # Credentials that are about to be refreshed anyway are no use to another process.
+        if seconds_remaining <= ADVISORY_REFRESH_TIMEOUT:
+            return None
+        return cached
+
+
+_providers: typing.Dict[tuple, AssumedRoleCredentialProvider] = dict()
+_providers_lock = threading.Lock()
+
+
+def get_assumed_role_provider(role_arn: str, session_name: str, duration: int) -> AssumedRoleCredentialProvider:
+    """Return the process-wide provider for the given role, creating and starting it if necessary."""
+    key = (role_arn, session_name, duration)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = AssumedRoleCredentialProvider(role_arn, session_name, duration)
+            provider.start_background_refresh()
+            _providers[key] = provider
+        return provider
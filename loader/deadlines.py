@@ -0,0 +1,133 @@
+"""
+Timeouts for the calls the loader makes, and deadlines for loading whole bundles.
+
+Every network call is bounded by a connect and a read timeout, so that a stalled connection
+fails the call rather than pinning a worker thread indefinitely. On top of that, each bundle may
+be given a deadline. The deadline of the bundle being loaded is kept per thread, and the loader
+checks it between steps, e.g. before each data file and while waiting for an asynchronous copy,
+and bounds the timeouts of DSS requests by the time remaining. A bundle that runs out of time is
+abandoned at the next such check, with `DeadlineExceeded`, which frees its worker.
+
+A deadline can also be canceled, e.g. on shutdown, which ends the work in progress the same way.
+"""
+import functools
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+
+
+class DeadlineExceeded(Exception):
+    """Thrown when work is abandoned because its deadline passed or it was canceled"""
+
+
+class Timeouts(typing.NamedTuple):
+    """Timeouts, in seconds, for the calls the loader makes"""
+    # Establishing a connection to S3, GCS or the DSS
+    connect: float = 20
+    # Waiting for the response to a request, or between bytes of it
+    read: float = 60
+    # Waiting for the DSS to finish an asynchronous copy of a data file
+    async_copy: float = 1200
+
+
+class Deadline:
+    def __init__(self, seconds: float = None, name: str = 'Work') -> None:
+        """
+        A point in time by which some work has to be finished.
+
+        :param seconds: The time from now until the deadline. If None, the deadline only passes if canceled.
+        :param name: Describes the work in the message of `DeadlineExceeded`.
+        """
+        self.seconds = seconds
+        self.name = name
+        self._expires = None if seconds is None else time.monotonic() + seconds
+        self._canceled = threading.Event()
+
+    def remaining(self) -> typing.Optional[float]:
+        """The seconds left until the deadline, or None if there is no limit"""
+        if self._canceled.is_set():
+            return 0.0
+        return None if self._expires is None else max(0.0, self._expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled.is_set()
+
+    def cancel(self) -> None:
+        self._canceled.set()
+
+    def check(self) -> None:
+        """Raise `DeadlineExceeded` if the deadline has passed or was canceled"""
+        if self._canceled.is_set():
+            raise DeadlineExceeded(f'{self.name} was canceled')
+        if self.expired:
+            raise DeadlineExceeded(f'{self.name} did not finish within {self.seconds} seconds')
+
+    def timeout(self, seconds: float) -> float:
+        """The given timeout, shortened to the time remaining"""
+        self.check()
+        remaining = self.remaining()
+        return seconds if remaining is None else min(seconds, remaining)
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep for the given time, waking up early and raising `DeadlineExceeded` if the deadline passes"""
+        self._canceled.wait(self.timeout(seconds))
+        self.check()
+
+
+_local = threading.local()
+
+# The deadline of work that has none
+NO_DEADLINE = Deadline()
+
+
+def current_deadline() -> Deadline:
+    """The deadline of the work this thread is doing"""
+    return getattr(_local, 'deadline', NO_DEADLINE)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline) -> typing.Iterator[Deadline]:
+    """Make the given deadline that of the work this thread does within the context"""
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def with_current_deadline(func: typing.Callable) -> typing.Callable:
+    """Wrap a function such that it runs within this thread's current deadline, e.g. when submitted to a pool"""
+    deadline = current_deadline()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with deadline_scope(deadline):
+            deadline.check()
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An adapter that applies a timeout to the requests of a `requests.Session` that don't specify one"""
+    def __init__(self, timeout: typing.Tuple[float, float], *args, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+def set_default_timeout(session, timeouts: Timeouts) -> None:
+    """Apply the connect and read timeouts to the requests of a session that don't specify their own"""
+    adapter = TimeoutHTTPAdapter((timeouts.connect, timeouts.read))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
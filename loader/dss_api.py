@@ -0,0 +1,251 @@
+"""
+A cached Swagger spec and a minimal request layer for the DSS.
+
+`hca.dss.DSSClient` downloads `{dss_endpoint}/swagger.json` and generates its methods from it
+every time a client is constructed. The loader only needs three DSS operations, so `DssApi`
+implements those directly, consulting the spec only for the API's base URL and for which
+operations require authentication. The spec itself is kept on disk by `SwaggerSpecCache`,
+keyed by endpoint and ETag, so that it is fetched once and then only revalidated.
+
+`DssFileCache` remembers which file versions are known to be in a DSS, so that files loaded by a
+previous run don't have to be checked again.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+import requests
+
+from loader.deadlines import current_deadline
+from loader.throttling import THROTTLING_ERROR_CODES
+from util import CACHE_DIR, atomic_write, file_lock, serialization
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(CACHE_DIR, 'swagger')
+
+# The same backoff factor DSSClient uses while waiting on asynchronous copies
+UPLOAD_BACKOFF_FACTOR = 1.618
+
+
+class InvalidSwaggerSpec(Exception):
+    """Thrown when the response for a Swagger spec is not one"""
+
+
+class SwaggerSpecCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, revalidate_after: float = 3600) -> None:
+        """
+        An on-disk cache of Swagger specs, shared by all loader processes.
+
+        :param cache_dir: Directory to store the specs in.
+        :param revalidate_after: Age, in seconds, after which a cached spec is revalidated with the server
+                                 (using its ETag) before being used.
+        """
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+
+    def get(self, swagger_url: str) -> str:
+        """
+        Return the path to an up-to-date copy of the spec at the given URL, fetching it if necessary.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        endpoint_key = hashlib.sha1(swagger_url.encode()).hexdigest()
+        etag_path = os.path.join(self.cache_dir, f'{endpoint_key}.etag')
+        # Only one process fetches the spec, the others wait and then use its copy.
+        with file_lock(os.path.join(self.cache_dir, f'{endpoint_key}.lock')):
+            etag, spec_path = self._read_etag(etag_path, endpoint_key)
+            if spec_path is not None and time.time() - os.path.getmtime(etag_path) < self.revalidate_after:
+                return spec_path
+            headers = {'If-None-Match': etag} if spec_path is not None else {}
+            try:
+                response = requests.get(swagger_url, headers=headers, timeout=20)
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                if spec_path is None:
+                    raise
+                logger.warning(f'Could not revalidate {swagger_url}, using the cached copy', exc_info=True)
+                return spec_path
+            if response.status_code == requests.codes.not_modified:
+                os.utime(etag_path)
+                return spec_path
+            try:
+                spec = serialization.loads(response.content)
+            except ValueError as e:
+                raise InvalidSwaggerSpec(f'The response from {swagger_url} is not JSON') from e
+            if not isinstance(spec, dict) or 'swagger' not in spec:
+                raise InvalidSwaggerSpec(f'The response from {swagger_url} is not a Swagger spec')
+            etag = response.headers.get('ETag') or hashlib.sha1(response.content).hexdigest()
+            spec_path = self._spec_path(endpoint_key, etag)
+            atomic_write(spec_path, response.content)
+            atomic_write(etag_path, etag.encode())
+            logger.debug(f'Cached {swagger_url} with ETag {etag}')
+            return spec_path
+
+    def _read_etag(self, etag_path: str, endpoint_key: str) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        try:
+            with open(etag_path) as fh:
+                etag = fh.read()
+        except OSError:
+            return None, None
+        spec_path = self._spec_path(endpoint_key, etag)
+        return (etag, spec_path) if os.path.exists(spec_path) else (None, None)
+
+    def _spec_path(self, endpoint_key: str, etag: str) -> str:
+        return os.path.join(self.cache_dir, f'{endpoint_key}-{hashlib.sha1(etag.encode()).hexdigest()}.json')
+
+
+class DssApi:
+    # The names of the operations, for scoping rate limits, e.g. "dss:put_file"
+    _operations = {('PUT', '/files/{uuid}'): 'put_file',
+                   ('HEAD', '/files/{uuid}'): 'head_file',
+                   ('PUT', '/bundles/{uuid}'): 'put_bundle'}
+
+    def __init__(self, swagger_spec: dict, dss_client_factory: typing.Callable) -> None:
+        """
+        Prebuilt requests for the DSS operations used by the loader.
+
+        Responses with a status code of 400 or above raise `hca.util.SwaggerAPIException`, just like
+        the corresponding `DSSClient` methods.
+
+        :param swagger_spec: The DSS Swagger spec, e.g. as loaded from `SwaggerSpecCache`.
+        :param dss_client_factory: Returns a `DSSClient`, which is only needed to authenticate requests
+                                   for operations that require it.
+        """
+        # Like the DSSClient, use the first of the schemes the spec lists, e.g. http for a local DSS
+        self.host = f"{swagger_spec['schemes'][0]}://{swagger_spec['host']}{swagger_spec['basePath']}"
+        self._dss_client_factory = dss_client_factory
+        self._secured = {(http_method.upper(), http_path): 'security' in method_data
+                         for http_path, path_data in swagger_spec['paths'].items()
+                         for http_method, method_data in path_data.items()}
+        self._session = None
+        # The `loader.deadlines.Timeouts` of requests, if not the DSSClient's
+        self.timeouts = None
+        # The `loader.throttling.RateLimiter` requests wait for, if any
+        self.rate_limiter = None
+
+    @classmethod
+    def from_spec_file(cls, spec_path: str, dss_client_factory: typing.Callable) -> 'DssApi':
+        return cls(serialization.load_file(spec_path), dss_client_factory)
+
+    def put_file(self, uuid: str, version: str, creator_uid: int, source_url: str) -> requests.Response:
+        return self._request('PUT', '/files/{uuid}', uuid,
+                             query=dict(version=version),
+                             body=dict(creator_uid=creator_uid, source_url=source_url))
+
+    def head_file(self, uuid: str, replica: str, version: str = None) -> requests.Response:
+        return self._request('HEAD', '/files/{uuid}', uuid, query=dict(replica=replica, version=version))
+
+    def file_version(self, uuid: str, replica: str, version: str = None) -> typing.Optional[str]:
+        """
+        Return the version of the given file in the DSS, formatted as the DSS formats versions,
+        or None if the DSS doesn't have it.
+        """
+        response = self._request('HEAD', '/files/{uuid}', uuid, query=dict(replica=replica, version=version),
+                                 allowed_errors=(requests.codes.not_found,))
+        if response.status_code == requests.codes.not_found:
+            return None
+        return response.headers.get('X-DSS-VERSION', version)
+
+    def put_bundle(self, uuid: str, version: str, replica: str, creator_uid: int, files: list) -> dict:
+        return self._request('PUT', '/bundles/{uuid}', uuid,
+                             query=dict(version=version, replica=replica),
+                             body=dict(creator_uid=creator_uid, files=files)).json()
+
+    def _request(self, http_method: str, http_path: str, uuid: str, query: dict, body: dict = None,
+                 allowed_errors: typing.Tuple[int, ...] = ()):
+        url = self.host + http_path.format(uuid=uuid)
+        query = {k: v for k, v in query.items() if v is not None}
+        logger.debug('%s %s %s %s', http_method, url, query, body)
+        session = self._get_session(self._secured.get((http_method, http_path), False))
+        operation = self._operations.get((http_method, http_path))
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire('dss', operation)
+        response = session.request(http_method, url, params=query, json=body, timeout=self._timeout())
+        if self.rate_limiter is not None:
+            if str(response.status_code) in THROTTLING_ERROR_CODES:
+                self.rate_limiter.throttled('dss', operation)
+            elif response.status_code < 400:
+                self.rate_limiter.succeeded('dss', operation)
+        if response.status_code >= 400 and response.status_code not in allowed_errors:
+            from hca.util import SwaggerAPIException
+            raise SwaggerAPIException(response=response)
+        return response
+
+    def _timeout(self):
+        """The timeout of a request, cut short by the deadline of the work it is for"""
+        if self.timeouts is None:
+            return self._dss_client_class().timeout_policy
+        deadline = current_deadline()
+        return deadline.timeout(self.timeouts.connect), deadline.timeout(self.timeouts.read)
+
+    def _get_session(self, authenticated: bool):
+        if authenticated:
+            return self._dss_client_factory().get_authenticated_session()
+        if self._session is None:
+            # Use the same retry policy as the DSSClient
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.headers.update({'User-Agent': 'DSSClient'})
+            adapter = HTTPAdapter(max_retries=self._dss_client_class().retry_policy)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    @staticmethod
+    def _dss_client_class():
+        from hca.dss import DSSClient
+        return DSSClient
+
+
+class DssFileCache:
+    def __init__(self, dss_endpoint: str, path: str = None) -> None:
+        """
+        An on-disk cache of the file versions known to be in a DSS, shared by all loader processes.
+
+        Only positive results are cached: files that are not in the DSS yet may be loaded at any time.
+
+        :param dss_endpoint: The DSS the cached files are in.
+        :param path: The SQLite database to store the versions in. Defaults to one in the loader's cache directory.
+        """
+        self.dss_endpoint = dss_endpoint
+        self.path = path or os.path.join(CACHE_DIR, 'dss_files.sqlite')
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                               'endpoint TEXT, uuid TEXT, version TEXT, dss_version TEXT, '
+                               'PRIMARY KEY (endpoint, uuid, version))')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(self, file_uuid: str, file_version: str) -> typing.Optional[str]:
+        """The version of the given file in the DSS, as formatted by the DSS, if it is known to be there"""
+        try:
+            with self._lock:
+                row = self._connect().execute('SELECT dss_version FROM files '
+                                              'WHERE endpoint = ? AND uuid = ? AND version = ?',
+                                              (self.dss_endpoint, file_uuid, file_version)).fetchone()
+        except (OSError, sqlite3.Error):
+            logger.warning(f'Could not read the DSS file cache {self.path}', exc_info=True)
+            return None
+        return None if row is None else row[0]
+
+    def put(self, file_uuid: str, file_version: str, dss_version: str) -> None:
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                   (self.dss_endpoint, file_uuid, file_version, dss_version))
+                connection.commit()
+        except (OSError, sqlite3.Error):
+            logger.warning(f'Could not write to the DSS file cache {self.path}', exc_info=True)
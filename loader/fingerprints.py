@@ -0,0 +1,89 @@
+"""
+Fingerprints of the bundles and files in a standard format manifest, for loading only what changed.
+
+A fingerprint is the sha256 of the canonical JSON of a bundle, or of one of its data objects. A
+`FingerprintIndex` maps each bundle's UUID to its fingerprint and those of its files, along with the
+DSS UUID, version and name each file was loaded as. Comparing a new manifest against the index of the
+previous one identifies the bundles that are unchanged, which need not be loaded again, and within
+changed bundles the files that are unchanged, whose DSS versions can be reused as they are.
+"""
+import hashlib
+import os
+import threading
+import typing
+
+from util import atomic_write
+from util.serialization import canonical_dumps, load_file
+
+INDEX_FORMAT_VERSION = 1
+
+
+def fingerprint(value) -> str:
+    """The sha256 of the canonical JSON of the given value"""
+    return hashlib.sha256(canonical_dumps(value)).hexdigest()
+
+
+def bundle_fingerprints(bundle: dict) -> typing.Tuple[str, typing.Dict[str, str]]:
+    """The fingerprint of a raw manifest bundle, and those of its data objects by file GUID"""
+    data_objects = bundle.get('data_objects') or {}
+    return fingerprint(bundle), {file_guid: fingerprint(file_info) for file_guid, file_info in data_objects.items()}
+
+
+class FingerprintIndex:
+    def __init__(self, bundles: typing.Dict[str, dict] = None) -> None:
+        """
+        :param bundles: Maps bundle UUIDs to entries of the form
+                        {"fingerprint": ..., "files": {file_guid: {"fingerprint": ..., "file_info": ...}}},
+                        where "file_info" is the uuid, version and name the file was loaded into the DSS as,
+                        if known.
+        """
+        self.bundles = bundles if bundles is not None else dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_manifest(cls, input_json: typing.Iterable[dict]) -> 'FingerprintIndex':
+        """Index a manifest, assuming all of its bundles were loaded"""
+        index = cls()
+        for bundle in input_json:
+            try:
+                bundle_uuid = bundle['data_bundle']['id']
+            except (KeyError, TypeError):
+                continue
+            index.add(bundle_uuid, *bundle_fingerprints(bundle))
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> 'FingerprintIndex':
+        index = load_file(path)
+        if index.get('format_version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f'Unsupported fingerprint index format in {path}: {index.get("format_version")}')
+        return cls(index['bundles'])
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            content = canonical_dumps(dict(format_version=INDEX_FORMAT_VERSION, bundles=self.bundles))
+        atomic_write(os.path.abspath(path), content)
+
+    def add(self, bundle_uuid: str, bundle_fingerprint: str, file_fingerprints: typing.Dict[str, str],
+            file_infos: typing.Dict[str, dict] = None) -> None:
+        """Record a bundle, and optionally the DSS uuid, version and name of its files, by file GUID"""
+        file_infos = file_infos or {}
+        entry = dict(fingerprint=bundle_fingerprint,
+                     files={file_guid: dict(fingerprint=file_fingerprint, file_info=file_infos.get(file_guid))
+                            for file_guid, file_fingerprint in file_fingerprints.items()})
+        with self._lock:
+            self.bundles[bundle_uuid] = entry
+
+    def copy_bundle(self, other: 'FingerprintIndex', bundle_uuid: str) -> None:
+        with self._lock:
+            self.bundles[bundle_uuid] = other.bundles[bundle_uuid]
+
+    def is_unchanged(self, bundle_uuid: str, bundle_fingerprint: str) -> bool:
+        return self.bundles.get(bundle_uuid, {}).get('fingerprint') == bundle_fingerprint
+
+    def file_info(self, bundle_uuid: str, file_guid: str, file_fingerprint: str) -> typing.Optional[dict]:
+        """The DSS uuid, version and name the given file was loaded as, if it is unchanged and they are known"""
+        entry = self.bundles.get(bundle_uuid, {}).get('files', {}).get(file_guid)
+        if entry is None or entry['fingerprint'] != file_fingerprint:
+            return None
+        return entry['file_info']
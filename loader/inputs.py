@@ -0,0 +1,284 @@
+"""
+Reading input manifests from local files, S3 or GCS, compressed with gzip or zstd or not.
+
+Inputs are streamed rather than downloaded or decompressed to disk first. A background thread reads
+the input, from the file or bucket, and decompresses it, a chunk at a time, while the bundles of the
+chunks already read are parsed, one by one, from the JSON array of the manifest.
+
+Reading zstd-compressed inputs requires the zstandard package.
+"""
+import io
+import json
+import queue
+import threading
+import typing
+import zlib
+from urllib.parse import urlparse
+
+# The size of the chunks inputs are read and parsed in, and the number of chunks read ahead of the parser
+READ_SIZE = 1024 * 1024
+PREFETCH_CHUNKS = 16
+
+_whitespace = ' \t\n\r'
+
+Write = typing.Callable[[bytes], None]
+
+
+class _Closed(Exception):
+    """Thrown in the reading thread when the reader of the chunks has stopped reading"""
+
+
+class _Prefetcher:
+    def __init__(self, produce: typing.Callable[[Write], None], name: str) -> None:
+        """
+        Runs a producer of chunks of data in a background thread, buffering up to PREFETCH_CHUNKS of them
+        for the reader.
+
+        :param produce: Writes the chunks with the function it is passed.
+        """
+        self._chunks: queue.Queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(produce,), name=f'read {name}', daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> None:
+        while True:
+            if self._closed.is_set():
+                raise _Closed()
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self, produce: typing.Callable[[Write], None]) -> None:
+        try:
+            produce(lambda data: self._put(bytes(data)) if data else None)
+        except _Closed:
+            return
+        except BaseException as e:
+            try:
+                self._put(e)
+            except _Closed:
+                pass
+            return
+        try:
+            self._put(b'')
+        except _Closed:
+            pass
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        while True:
+            item = self._chunks.get()
+            if isinstance(item, BaseException):
+                raise item
+            if not item:
+                return
+            yield item
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+class InputStream(io.RawIOBase):
+    def __init__(self, produce: typing.Callable[[Write], None], name: str) -> None:
+        """A readable binary stream of the chunks written by the given producer in a background thread"""
+        super().__init__()
+        self.name = name
+        self._prefetcher = _Prefetcher(produce, name)
+        self._chunks = iter(self._prefetcher)
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._chunk:
+            self._chunk = memoryview(next(self._chunks, b''))
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self) -> None:
+        self._prefetcher.close()
+        super().close()
+
+
+def _read_local(path: str) -> typing.Callable[[Write], None]:
+    def produce(write: Write) -> None:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(READ_SIZE), b''):
+                write(chunk)
+    return produce
+
+
+def _read_s3(bucket: str, key: str, s3_client) -> typing.Callable[[Write], None]:
+    def produce(write: Write) -> None:
+        client = s3_client
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        body = client.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            for chunk in iter(lambda: body.read(READ_SIZE), b''):
+                write(chunk)
+        finally:
+            body.close()
+    return produce
+
+
+def _read_gs(bucket: str, key: str, gs_client) -> typing.Callable[[Write], None]:
+    class Writer:
+        def __init__(self, write: Write) -> None:
+            self.write = write
+
+    def produce(write: Write) -> None:
+        client = gs_client
+        if client is None:
+            from google.cloud.storage import Client
+            client = Client()
+        # The content is written as it is received
+        client.bucket(bucket).blob(key).download_to_file(Writer(write))
+    return produce
+
+
+def _gzip_decompressor():
+    # Accept a gzip header, and nothing else
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _zstd_decompressor():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('Reading zstd-compressed inputs requires the zstandard package') from e
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _decompressed(produce: typing.Callable[[Write], None],
+                  new_decompressor: typing.Callable[[], typing.Any]) -> typing.Callable[[Write], None]:
+    """Decompress the chunks written by the given producer, which may be several concatenated members or frames"""
+    def produce_decompressed(write: Write) -> None:
+        decompressor = [new_decompressor()]
+
+        def write_compressed(data: bytes) -> None:
+            while data:
+                write(decompressor[0].decompress(data))
+                if not getattr(decompressor[0], 'eof', False):
+                    break
+                data = decompressor[0].unused_data
+                if data:
+                    decompressor[0] = new_decompressor()
+
+        produce(write_compressed)
+        flush = getattr(decompressor[0], 'flush', None)
+        if flush is not None:
+            write(flush())
+    return produce_decompressed
+
+
+def _producer(path: str, s3_client, gs_client) -> typing.Callable[[Write], None]:
+    """The producer of the decompressed content of the input at the given path or URL"""
+    url = urlparse(path)
+    if url.scheme == 's3':
+        produce = _read_s3(url.netloc, url.path.lstrip('/'), s3_client)
+    elif url.scheme == 'gs':
+        produce = _read_gs(url.netloc, url.path.lstrip('/'), gs_client)
+    else:
+        produce = _read_local(path)
+    if path.endswith('.gz'):
+        produce = _decompressed(produce, _gzip_decompressor)
+    elif path.endswith(('.zst', '.zstd')):
+        produce = _decompressed(produce, _zstd_decompressor)
+    return produce
+
+
+def open_input(path: str, s3_client=None, gs_client=None) -> io.BufferedReader:
+    """
+    Open a local file, or an object given by an s3:// or gs:// URL, for reading its content in the background,
+    decompressing it if its name ends in .gz or .zst.
+
+    :param s3_client: The client for reading from S3. A default one is created if needed and not given.
+    :param gs_client: The client for reading from GCS. A default one is created if needed and not given.
+    """
+    produce = _producer(path, s3_client, gs_client)
+    return io.BufferedReader(InputStream(produce, path), buffer_size=READ_SIZE)
+
+
+def read_input(path: str, s3_client=None, gs_client=None) -> bytes:
+    """
+    The whole content of a local file, or of an object given by an s3:// or gs:// URL, read with a single
+    request in the calling thread, and decompressed like `open_input` does. Meant for small inputs, like
+    metadata documents, of which many are read concurrently.
+    """
+    produce = _producer(path, s3_client, gs_client)
+    chunks: typing.List[bytes] = []
+    produce(lambda data: chunks.append(data) if data else None)
+    return b''.join(chunks)
+
+
+def iter_json_array(fh: typing.TextIO, name: str = 'input') -> typing.Iterator[typing.Any]:
+    """Parse the elements of the JSON array read from the given text stream, one at a time, as they are read"""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def read_more() -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = fh.read(READ_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def skip_whitespace() -> str:
+        """Advance to the next character that isn't whitespace, returning it, or '' at the end of the input"""
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return ''
+
+    if skip_whitespace() != '[':
+        raise ValueError(f'{name} is misformatted. Expected a JSON array of bundles.')
+    position += 1
+    if skip_whitespace() == ']':
+        return
+    while True:
+        skip_whitespace()
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The element may continue beyond what has been read so far
+            if read_more():
+                continue
+            raise
+        if end == len(buffer) and read_more():
+            # A number or literal at the end of what has been read so far may continue
+            continue
+        position = end
+        yield element
+        separator = skip_whitespace()
+        position += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'{name} is misformatted. Expected "," or "]" after element, got {separator!r}')
+
+
+def iter_bundles(path: str, s3_client=None, gs_client=None) -> typing.Iterator[dict]:
+    """The bundles of an input manifest, parsed as it is read, see `open_input`"""
+    with io.TextIOWrapper(open_input(path, s3_client, gs_client), encoding='utf-8') as fh:
+        yield from iter_json_array(fh, path)
+
+
+def read_bundles(path: str, s3_client=None, gs_client=None) -> typing.List[dict]:
+    """The bundles of an input manifest, see `open_input`"""
+    return list(iter_bundles(path, s3_client, gs_client))
@@ -0,0 +1,179 @@
+"""
+Loading of bundles of local files, such as the output directory of a sequencing run.
+
+The files under a root directory are grouped into bundles, either one bundle per directory or
+by a regular expression matched against each file's path. Optional sidecar files, named
+`bundle.json`, supply a bundle's UUID and its user metadata:
+
+    {"uuid": "...", "user_metadata": {...}}
+
+Bundle and file UUIDs that aren't given are derived from the files' paths, and file versions
+from their modification times, so that loading the same tree again is idempotent.
+
+Bundles are loaded concurrently, and so are the files of all bundles, in a pool of their own.
+The parts of each file are uploaded in parallel as well, within the concurrency and bandwidth
+budget of the DssUploader's `StagingTransferConfig`, which is shared by all files.
+"""
+import concurrent.futures
+import datetime
+import logging
+import os
+import pprint
+import re
+import typing
+import uuid
+
+from loader.base_loader import DssUploader, MetadataFileUploader
+from loader.logs import lazy
+from loader.standard_loader import DEFAULT_MAX_WORKERS, DEFAULT_POOL_SIZE, SCHEMA_URL
+from util import patch_connection_pools, serialization, tz_utc_now
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_NAME = 'bundle.json'
+
+# The number of files uploaded concurrently, across all bundles
+DEFAULT_MAX_FILE_WORKERS = 16
+
+# Namespace for the UUIDs derived from local paths
+LOCAL_FILE_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/DataBiosphere/cgp-dss-data-loader/local')
+
+
+class LocalBundle(typing.NamedTuple):
+    bundle_uuid: str
+    name: str  # the directory, or the group matched by the pattern, relative to the root
+    metadata_dict: typing.Optional[dict]
+    paths: typing.List[str]
+
+    def pprint(self):
+        return pprint.pformat(self, indent=4)
+
+
+def _read_sidecar(path: str) -> dict:
+    try:
+        return serialization.load_file(path)
+    except FileNotFoundError:
+        return dict()
+
+
+def find_bundles(root: str, pattern: str = None) -> typing.List[LocalBundle]:
+    """
+    Group the files under `root` into bundles.
+
+    :param root: The directory to walk.
+    :param pattern: A regular expression matched against the path of each file relative to `root`.
+                    Files are grouped by the named group "bundle", or else the first group, of the match.
+                    Files that don't match are skipped. The sidecar of a group named NAME is NAME.bundle.json
+                    in `root`. If no pattern is given, each directory's files form a bundle, described
+                    by the bundle.json in that directory.
+    """
+    root = os.path.abspath(root)
+    regex = re.compile(pattern) if pattern else None
+    groups: typing.Dict[str, typing.List[str]] = dict()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if filename == SIDECAR_NAME or filename.endswith('.' + SIDECAR_NAME) or not os.path.isfile(path):
+                continue
+            relative_path = os.path.relpath(path, root)
+            if regex is None:
+                name = os.path.relpath(dirpath, root)
+            else:
+                match = regex.search(relative_path)
+                if match is None:
+                    logger.debug(f'Skipping {relative_path}, which does not match {pattern}')
+                    continue
+                name = match.group('bundle') if 'bundle' in regex.groupindex else match.group(1)
+            groups.setdefault(name, []).append(path)
+
+    bundles = []
+    for name, paths in groups.items():
+        if regex is None:
+            sidecar = _read_sidecar(os.path.join(root, name, SIDECAR_NAME))
+        else:
+            sidecar = _read_sidecar(os.path.join(root, f'{name}.{SIDECAR_NAME}'))
+        bundle_uuid = sidecar.get('uuid') or str(uuid.uuid5(LOCAL_FILE_NAMESPACE, os.path.join(root, name)))
+        bundles.append(LocalBundle(bundle_uuid, name, sidecar.get('user_metadata'), paths))
+    return bundles
+
+
+class LocalBundleUploader:
+    def __init__(self, dss_uploader: DssUploader, metadata_file_uploader: MetadataFileUploader,
+                 max_workers: int = DEFAULT_MAX_WORKERS, max_file_workers: int = DEFAULT_MAX_FILE_WORKERS) -> None:
+        """
+        :param max_workers: The number of bundles loaded concurrently.
+        :param max_file_workers: The number of files uploaded concurrently, across all bundles.
+        """
+        self.dss_uploader = dss_uploader
+        self.metadata_file_uploader = metadata_file_uploader
+        self.max_workers = max_workers
+        self.max_file_workers = max_file_workers
+        self.bundles_loaded: typing.List[LocalBundle] = []
+        self.bundles_failed: typing.List[LocalBundle] = []
+
+    @staticmethod
+    def _get_file_version(path: str) -> str:
+        mtime = os.stat(path).st_mtime
+        return datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).isoformat()
+
+    def _load_file(self, bundle: LocalBundle, path: str) -> dict:
+        file_uuid = str(uuid.uuid5(uuid.UUID(bundle.bundle_uuid), os.path.abspath(path)))
+        file_uuid, file_version, filename, _ = self.dss_uploader.upload_local_file(
+            path, file_uuid, file_version=self._get_file_version(path))
+        return dict(uuid=file_uuid, version=file_version, name=filename, indexed=False)
+
+    def _load_bundle(self, bundle: LocalBundle, bundle_num: int, file_executor: concurrent.futures.Executor):
+        logger.info(f'Bundle {bundle_num}: Attempting to load {len(bundle.paths)} files from {bundle.name}. '
+                    f'UUID: {bundle.bundle_uuid}')
+        futures = [file_executor.submit(self._load_file, bundle, path) for path in bundle.paths]
+        file_info_list = []
+        if bundle.metadata_dict is not None:
+            metadata_file_uuid, metadata_file_version, metadata_filename, _ = \
+                self.metadata_file_uploader.load_dict(dict(bundle.metadata_dict),
+                                                      "metadata.json",
+                                                      bundle.metadata_dict.get('describedBy', SCHEMA_URL),
+                                                      file_version=tz_utc_now())
+            file_info_list.append(dict(uuid=metadata_file_uuid, version=metadata_file_version,
+                                       name=metadata_filename, indexed=True))
+        try:
+            file_info_list.extend(future.result() for future in futures)
+        finally:
+            for future in futures:
+                future.cancel()
+        self.dss_uploader.load_bundle(file_info_list, bundle.bundle_uuid)
+
+    def _load_bundle_concurrent(self, count: int, bundle: LocalBundle, file_executor: concurrent.futures.Executor):
+        try:
+            self._load_bundle(bundle, count, file_executor)
+        except Exception:
+            logger.exception(f'Bundle {count}: Error loading. ID: {bundle.bundle_uuid}')
+            logger.debug('Bundle %s details: \n%s', count, lazy(bundle.pprint))
+            self.bundles_failed.append(bundle)
+            return
+        self.bundles_loaded.append(bundle)
+        logger.info(f'Bundle {count}: Successfully loaded. ID: {bundle.bundle_uuid}')
+
+    def load_all_bundles(self, bundles: typing.List[LocalBundle]) -> bool:
+        logger.info(f'Going to load {len(bundles)} bundle{"" if len(bundles) == 1 else "s"} '
+                    f'with {sum(len(bundle.paths) for bundle in bundles)} files')
+        patch_connection_pools(maxsize=DEFAULT_POOL_SIZE)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_file_workers) as file_executor, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self._load_bundle_concurrent, count, bundle, file_executor)
+                           for count, bundle in enumerate(bundles)]
+                concurrent.futures.wait(futures)
+        except KeyboardInterrupt:
+            logger.exception('Loading canceled with keyboard interrupt')
+        bundles_unattempted = len(bundles) - len(self.bundles_loaded) - len(self.bundles_failed)
+        if bundles_unattempted:
+            logger.warning(f'Did not yet attempt to load {bundles_unattempted} bundles')
+        if self.bundles_failed:
+            logger.error(f'Could not load {len(self.bundles_failed)} bundles')
+        success = not bundles_unattempted and not self.bundles_failed
+        if success:
+            logger.info(f'Successfully loaded all {len(self.bundles_loaded)} bundles!')
+        else:
+            logger.info(f'Successfully loaded {len(self.bundles_loaded)} bundles')
+        return success
@@ -0,0 +1,120 @@
+"""
+Logging that stays out of the way of the worker threads.
+
+In queue mode, the handlers of the root logger are replaced by a `QueueHandler`, and a single
+`QueueListener` thread formats the records and writes them. Workers only put records on the queue,
+so they neither wait for the handlers' locks nor for their output. Records are enqueued as they
+are, without merging their arguments into the message first, so log calls that pass their
+arguments separately, e.g. `logger.debug('Bundle %s: %s', count, lazy(bundle.pprint))`, are
+formatted by the listener, and not at all if no handler wants them. Those arguments must not be
+changed after the call.
+
+The IDs of the bundle and file a worker is loading can be set with `log_context`, and are added
+to the records it logs, as fields of the JSON lines written by `JsonFormatter`.
+"""
+import datetime
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import typing
+from contextlib import contextmanager
+
+from util import serialization
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# The fields of the log context, which are set on every record
+CONTEXT_FIELDS = ('bundle_uuid', 'bundle_num', 'file_uuid')
+
+
+class lazy:
+    def __init__(self, func: typing.Callable, *args, **kwargs) -> None:
+        """A log argument that is only computed, by calling the given function, if the record is formatted"""
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args, **self.kwargs))
+
+
+_local = threading.local()
+
+
+def _current_context() -> dict:
+    return getattr(_local, 'context', {})
+
+
+@contextmanager
+def log_context(**fields) -> typing.Iterator[None]:
+    """Add the given fields, e.g. bundle_uuid, to the records logged by this thread within the context"""
+    previous = _current_context()
+    _local.context = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+class ContextFilter(logging.Filter):
+    """Sets the fields of the log context of the logging thread on each record"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _current_context()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single lines of JSON, with the fields of the log context"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(time=datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+                     level=record.levelname,
+                     logger=record.name,
+                     thread=record.threadName,
+                     message=record.getMessage())
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return serialization.dumps(entry, default=str).decode('utf-8')
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves the formatting of records to the listener"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: int, json_lines: bool = False, use_queue: bool = True,
+                      stream: typing.TextIO = None) -> typing.Optional[logging.handlers.QueueListener]:
+    """
+    Configure the root logger to write to `stream`, stderr by default.
+
+    :param json_lines: Write JSON lines, rather than text.
+    :param use_queue: Write from a listener thread, which is returned, and should be stopped on exit to flush
+                      the records still queued.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+    root = logging.getLogger()
+    for existing_handler in list(root.handlers):
+        root.removeHandler(existing_handler)
+    root.setLevel(level)
+    if not use_queue:
+        handler.addFilter(ContextFilter())
+        root.addHandler(handler)
+        return None
+    records: queue.Queue = queue.Queue()
+    queue_handler = DeferredQueueHandler(records)
+    # The context is that of the logging thread, so it has to be captured before the record is queued
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,104 @@
+"""
+Loading several input manifests in one run.
+
+Rather than one process per manifest, each paying for fetching the DSS swagger spec, assuming roles and
+creating clients, and starting with cold caches, the bundles of all manifests are loaded by one uploader.
+They are interleaved, so that the manifests progress together through the shared workers, and the
+results are accounted for per manifest.
+"""
+import collections
+import glob
+import itertools
+import logging
+import os
+import typing
+from urllib.parse import urlparse
+
+from loader.inputs import read_bundles
+
+logger = logging.getLogger(__name__)
+
+
+def expand_inputs(specs: typing.Iterable[str]) -> typing.List[str]:
+    """
+    The paths of the input manifests given by the specs, in order and without duplicates.
+
+    A spec is a path or URL, see `loader.inputs.open_input`, a glob pattern of local paths such as
+    "release/*.json", or "@FILE" for a file listing paths, URLs or patterns, one per line. Blank lines, and
+    lines starting with "#", are ignored, and relative paths in it are relative to its directory.
+    """
+    paths = []
+    for spec in specs:
+        if spec.startswith('@'):
+            list_path = spec[1:]
+            with open(list_path) as fh:
+                lines = [line.strip() for line in fh]
+            list_dir = os.path.dirname(list_path)
+            paths.extend(_expand(line if urlparse(line).scheme else os.path.join(list_dir, line))
+                         for line in lines if line and not line.startswith('#'))
+        else:
+            paths.append(_expand(spec))
+    return list(collections.OrderedDict.fromkeys(itertools.chain.from_iterable(paths)))
+
+
+def _expand(spec: str) -> typing.List[str]:
+    if urlparse(spec).scheme or not glob.has_magic(spec):
+        return [spec]
+    paths = sorted(glob.glob(spec, recursive=True))
+    if not paths:
+        raise FileNotFoundError(f'No input files match {spec}')
+    return paths
+
+
+class Manifests:
+    def __init__(self, bundles: typing.Dict[str, typing.List[dict]]) -> None:
+        """
+        :param bundles: The bundles of each manifest, by the path of the manifest.
+        """
+        self.bundles = bundles
+
+    @classmethod
+    def load(cls, specs: typing.Iterable[str]) -> 'Manifests':
+        """Read the manifests given by the specs, see `expand_inputs`"""
+        bundles = collections.OrderedDict()
+        for path in expand_inputs(specs):
+            bundles[path] = read_bundles(path)
+        return cls(bundles)
+
+    def __len__(self) -> int:
+        return len(self.bundles)
+
+    def interleaved(self) -> typing.List[dict]:
+        """The bundles of all manifests, taking one from each manifest in turn"""
+        rounds = itertools.zip_longest(*self.bundles.values())
+        return [bundle for round_ in rounds for bundle in round_ if bundle is not None]
+
+    def report(self, bundles: typing.List[dict], results: typing.Iterable[typing.Any]) -> typing.Dict[str, bool]:
+        """
+        Log the outcome of loading each manifest.
+
+        :param bundles: The bundles that were to be loaded, e.g. the interleaved bundles of the manifests.
+        :param results: The `loader.standard_loader.BundleResult` of loading each of them.
+        :return: Whether all bundles of a manifest that were to be loaded were, by the path of the manifest.
+        """
+        manifest_of = {id(bundle): path for path, manifest_bundles in self.bundles.items()
+                       for bundle in manifest_bundles}
+        planned = collections.Counter(manifest_of[id(bundle)] for bundle in bundles)
+        outcomes: typing.Dict[str, typing.Counter[str]] = {path: collections.Counter() for path in self.bundles}
+        done: typing.Counter[str] = collections.Counter()
+        for result in results:
+            path = manifest_of[id(bundles[result.bundle_num])]
+            outcomes[path][result.status] += 1
+            done[path] += result.ok
+        success = dict()
+        for path, outcome in outcomes.items():
+            unattempted = planned[path] - sum(outcome.values())
+            ok = done[path]
+            success[path] = ok == planned[path]
+            counts = ', '.join(f'{count} {status}' for status, count in sorted(outcome.items()))
+            if unattempted:
+                counts += f'{", " if counts else ""}{unattempted} not attempted'
+            logger.log(logging.INFO if success[path] else logging.ERROR,
+                       f'{path}: {"Loaded" if success[path] else "Failed to load"} {ok} of {planned[path]} '
+                       f'bundles ({counts or "nothing to load"})')
+        return success
@@ -0,0 +1,186 @@
+"""
+Bulk loading of metadata documents, such as a backfill of a whole bucket prefix.
+
+The JSON documents under a bucket prefix, or in a local directory tree, are listed lazily, and each is
+fetched with a single streaming GET, parsed and uploaded to the DSS as a metadata file by a pool of
+workers. Documents are submitted to the pool as workers become free, so listing overlaps with loading,
+and neither the listing nor the documents are held in memory beyond those in flight. Progress and the
+throughput achieved are logged periodically, and reported at the end.
+"""
+import concurrent.futures
+import logging
+import os
+import time
+import typing
+from urllib.parse import urlparse
+
+from loader.base_loader import MetadataFileUploader
+from loader.inputs import read_input
+from loader.standard_loader import DEFAULT_POOL_SIZE, SCHEMA_URL
+from util import patch_connection_pools, serialization
+
+logger = logging.getLogger(__name__)
+
+# The number of documents fetched and uploaded concurrently
+DEFAULT_MAX_METADATA_WORKERS = 32
+
+# The seconds between progress reports
+DEFAULT_PROGRESS_INTERVAL = 60
+
+# The names of the documents that are loaded, see `loader.inputs.open_input` for the compressed ones
+METADATA_SUFFIXES = ('.json', '.json.gz', '.json.zst')
+
+
+def list_documents(source: str, s3_client=None, gs_client=None) -> typing.Iterator[str]:
+    """
+    The URLs of the metadata documents under an s3:// or gs:// prefix, or the paths of those in a local
+    directory tree, in lexicographic order, listed page by page as they are consumed.
+    """
+    url = urlparse(source)
+    if url.scheme == 's3':
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client('s3')
+        pages = s3_client.get_paginator('list_objects_v2').paginate(Bucket=url.netloc, Prefix=url.path.lstrip('/'))
+        keys = (obj['Key'] for page in pages for obj in page.get('Contents', ()))
+        return (f's3://{url.netloc}/{key}' for key in keys if key.endswith(METADATA_SUFFIXES))
+    elif url.scheme == 'gs':
+        if gs_client is None:
+            from google.cloud.storage import Client
+            gs_client = Client()
+        blobs = gs_client.list_blobs(url.netloc, prefix=url.path.lstrip('/'))
+        return (f'gs://{url.netloc}/{blob.name}' for blob in blobs if blob.name.endswith(METADATA_SUFFIXES))
+    else:
+        return _list_local_documents(source)
+
+
+def _list_local_documents(root: str) -> typing.Iterator[str]:
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith(METADATA_SUFFIXES):
+                yield os.path.join(dir_path, file_name)
+
+
+def _document_filename(source: str) -> str:
+    """The name of the metadata file in the DSS, without the suffix of any compression"""
+    filename = source.rstrip('/').rsplit('/', 1)[-1]
+    for suffix in ('.gz', '.zst'):
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+class MetadataResult(typing.NamedTuple):
+    """The outcome of loading one metadata document"""
+    source: str  # the URL or path of the document
+    file_uuid: typing.Optional[str]
+    file_version: typing.Optional[str]
+    size: int  # bytes of JSON read, 0 if it could not be read
+    error: typing.Optional[BaseException] = None
+
+
+class Throughput(typing.NamedTuple):
+    """The progress of a bulk load"""
+    documents: int
+    failed: int
+    bytes: int
+    seconds: float
+
+    @property
+    def documents_per_second(self) -> float:
+        return self.documents / self.seconds if self.seconds else 0.0
+
+    @property
+    def mib_per_second(self) -> float:
+        return self.bytes / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.documents - self.failed} of {self.documents} documents loaded, {self.failed} failed, '
+                f'{self.bytes / 1024 / 1024:.1f} MiB in {self.seconds:.1f}s '
+                f'({self.documents_per_second:.1f} documents/s, {self.mib_per_second:.2f} MiB/s)')
+
+
+class MetadataBulkLoader:
+    def __init__(self, metadata_file_uploader: MetadataFileUploader,
+                 max_workers: int = DEFAULT_MAX_METADATA_WORKERS, schema_url: str = SCHEMA_URL,
+                 progress_interval: float = DEFAULT_PROGRESS_INTERVAL) -> None:
+        """
+        :param max_workers: The number of documents fetched and uploaded concurrently.
+        :param schema_url: The schema of the documents that don't declare theirs as "describedBy".
+        :param progress_interval: The seconds between logging the progress of `load_all`.
+        """
+        self.metadata_file_uploader = metadata_file_uploader
+        self.dss_uploader = metadata_file_uploader.dss_uploader
+        self.max_workers = max_workers
+        self.schema_url = schema_url
+        self.progress_interval = progress_interval
+        self.documents_failed: typing.List[MetadataResult] = []
+        self.throughput = Throughput(0, 0, 0, 0.0)
+
+    def _clients(self, source: str) -> dict:
+        """The clients of the DssUploader for reading from the cloud of the given source, created on first use"""
+        scheme = urlparse(source).scheme
+        return dict(s3_client=self.dss_uploader.s3_client if scheme == 's3' else None,
+                    gs_client=self.dss_uploader.gs_client if scheme == 'gs' else None)
+
+    def list_documents(self, sources: typing.Iterable[str]) -> typing.Iterator[str]:
+        """The documents under each of the given prefixes or directories, see `list_documents`"""
+        for source in sources:
+            yield from list_documents(source, **self._clients(source))
+
+    def _load_document(self, source: str) -> MetadataResult:
+        size = 0
+        try:
+            content = read_input(source, **self._clients(source))
+            size = len(content)
+            metadata = serialization.loads(content)
+            file_uuid, file_version, _, _ = self.metadata_file_uploader.load_dict(
+                metadata, _document_filename(source), metadata.get('describedBy', self.schema_url))
+        except Exception as e:
+            logger.warning(f'Could not load metadata document {source}: {e}')
+            logger.debug(f'Error loading metadata document {source}', exc_info=True)
+            return MetadataResult(source, None, None, size, e)
+        logger.debug('Loaded metadata document %s as uuid:version %s:%s', source, file_uuid, file_version)
+        return MetadataResult(source, file_uuid, file_version, size)
+
+    def iter_load(self, sources: typing.Iterable[str]) -> typing.Iterator[MetadataResult]:
+        """Load the given documents concurrently, yielding the result of each as it finishes"""
+        patch_connection_pools(maxsize=max(DEFAULT_POOL_SIZE, self.max_workers))
+        sources = iter(sources)
+        in_flight: typing.Set[concurrent.futures.Future] = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for source in sources:
+                if len(in_flight) >= self.max_workers:
+                    done, in_flight = concurrent.futures.wait(in_flight,
+                                                              return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(executor.submit(self._load_document, source))
+            for future in concurrent.futures.as_completed(in_flight):
+                yield future.result()
+
+    def load_all(self, sources: typing.Iterable[str]) -> bool:
+        """Load the given documents, e.g. those of `list_documents`, returning whether all of them were loaded"""
+        start = last_report = time.monotonic()
+        documents, size = 0, 0
+        try:
+            for result in self.iter_load(sources):
+                documents += 1
+                size += result.size
+                if result.error is not None:
+                    self.documents_failed.append(result)
+                now = time.monotonic()
+                self.throughput = Throughput(documents, len(self.documents_failed), size, now - start)
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    logger.info(f'Progress: {self.throughput}')
+        except KeyboardInterrupt:
+            logger.exception('Loading canceled with keyboard interrupt')
+            return False
+        finally:
+            self.throughput = self.throughput._replace(seconds=time.monotonic() - start)
+            logger.info(f'Finished: {self.throughput}')
+        if self.documents_failed:
+            logger.error(f'Could not load {len(self.documents_failed)} metadata documents')
+        return not self.documents_failed
@@ -0,0 +1,249 @@
+"""
+A sampling profiler for finding where the time of a load goes.
+
+A background thread samples the stacks of all other threads every `interval` seconds, using
+`sys._current_frames`, so that no worker is instrumented or slowed down beyond holding the GIL for the
+duration of a sample. Each sample is attributed to the innermost function of the loader modules on the
+thread's stack, its stage, such as `DssUploader._upload_tagged_cloud_file_to_dss_by_copy` or
+`StandardFormatBundleUploader._load_bundle`. For each stage, the profile reports
+
+- the wall time, in thread seconds, that threads spent in it, including the libraries it called,
+- the CPU time the threads used meanwhile, from /proc/self/task on Linux, and not measured elsewhere,
+- the part of the wall time spent waiting on a lock, condition, queue or future, and
+- the inclusive wall time, which includes the stages it called.
+
+Wall time that is neither CPU nor waiting is mostly spent on network I/O, e.g. cloud HEADs, staging
+uploads and DSS requests. The stacks are also counted in the collapsed format of flamegraph.pl and
+speedscope, one line per distinct stack, with the name of the thread as the outermost frame.
+
+Optionally, tracemalloc traces allocations, and the largest allocation sites and their growth since the
+previous snapshot are recorded every `memory_interval` seconds.
+"""
+import collections
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+logger = logging.getLogger(__name__)
+
+# The seconds between samples of the threads' stacks
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# The seconds between tracemalloc snapshots
+DEFAULT_MEMORY_INTERVAL = 60
+
+# The modules whose functions the time is grouped by
+STAGE_MODULES = ('loader.base_loader', 'loader.standard_loader')
+
+# The modules whose functions block a thread until another one releases or notifies it
+WAITING_MODULES = ('threading', 'queue', 'concurrent.futures._base')
+
+# The allocation sites listed for each tracemalloc snapshot
+MEMORY_TOP_SITES = 10
+
+OUTSIDE_STAGES = '(outside loader stages)'
+
+_thread_number = re.compile(r'[-_0-9]+$')
+
+
+class StageTime(typing.NamedTuple):
+    """The time threads spent in a stage, in thread seconds"""
+    function: str
+    wall: float  # in the stage, but not in a stage it called
+    cpu: typing.Optional[float]  # None if the CPU time of threads isn't available
+    waiting: float  # of the wall time, waiting for a lock, condition, queue or future
+    inclusive: float  # including the stages it called
+
+
+class _ThreadCpuClock:
+    """The CPU time used by threads, where Linux provides it per thread"""
+    def __init__(self) -> None:
+        self.tick = 1 / os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else None
+        # Native thread IDs are only available from Python 3.8
+        get_native_id = getattr(threading, 'get_native_id', None)
+        self.available = get_native_id is not None and self.read(get_native_id()) is not None
+
+    def read(self, native_id: typing.Optional[int]) -> typing.Optional[float]:
+        """The seconds of user and system CPU time used by the thread, or None if it can't be read"""
+        if native_id is None or self.tick is None:
+            return None
+        try:
+            with open(f'/proc/self/task/{native_id}/stat') as fh:
+                stat = fh.read()
+        except OSError:
+            return None
+        # The fields following the parenthesized thread name, which may contain spaces, start with the state
+        fields = stat[stat.rfind(')') + 2:].split()
+        return (int(fields[11]) + int(fields[12])) * self.tick
+
+
+def _function_name(code) -> str:
+    # co_qualname, which includes the class, is only available from Python 3.11
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+class Profiler:
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, memory_interval: float = None,
+                 modules: typing.Sequence[str] = STAGE_MODULES) -> None:
+        """
+        :param interval: The seconds between samples of the threads' stacks.
+        :param memory_interval: The seconds between tracemalloc snapshots, or None to not trace allocations.
+        :param modules: The modules whose functions the time is grouped by.
+        """
+        self.interval = interval
+        self.memory_interval = memory_interval
+        self.modules = frozenset(modules)
+        self.samples = 0
+        self.seconds = 0.0
+        self.stacks: typing.Counter[str] = collections.Counter()
+        self.memory_reports: typing.List[str] = []
+        # function: [wall, cpu, waiting, inclusive]
+        self._stages: typing.Dict[str, typing.List[float]] = collections.defaultdict(lambda: [0.0, 0.0, 0.0, 0.0])
+        self._cpu_clock = _ThreadCpuClock()
+        self._cpu_times: typing.Dict[int, float] = {}
+        self._previous_snapshot = None
+        self._traces_memory = False
+        self._stop = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self.memory_interval is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._traces_memory = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        if self.memory_interval is not None:
+            self._snapshot_memory()
+        if self._traces_memory:
+            tracemalloc.stop()
+            self._traces_memory = False
+
+    def _run(self) -> None:
+        start = last_sample = last_snapshot = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last_sample)
+            last_sample = now
+            if self.memory_interval is not None and now - last_snapshot >= self.memory_interval:
+                last_snapshot = now
+                self._snapshot_memory()
+            self.seconds = now - start
+
+    def _sample(self, elapsed: float) -> None:
+        """Attribute the given seconds since the previous sample to what each thread is doing now"""
+        self.samples += 1
+        own_ident = threading.get_ident()
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            thread = threads.get(ident)
+            thread_name = _thread_number.sub('', thread.name) if thread is not None else 'thread'
+            waiting = frame.f_globals.get('__name__') in WAITING_MODULES
+            stack, stage, stages = [], None, set()
+            while frame is not None:
+                module = frame.f_globals.get('__name__', '?')
+                function = f'{module}.{_function_name(frame.f_code)}'
+                stack.append(function)
+                if module in self.modules:
+                    if stage is None:
+                        stage = function
+                    stages.add(function)
+                frame = frame.f_back
+            stack.append(thread_name.replace(' ', '_'))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+            times = self._stages[stage or OUTSIDE_STAGES]
+            times[0] += elapsed
+            times[1] += self._cpu_delta(ident, thread)
+            if waiting:
+                times[2] += elapsed
+            for function in stages:
+                self._stages[function][3] += elapsed
+
+    def _cpu_delta(self, ident: int, thread: typing.Optional[threading.Thread]) -> float:
+        """The CPU time the thread used since the previous sample"""
+        if not self._cpu_clock.available or thread is None:
+            return 0.0
+        cpu_time = self._cpu_clock.read(getattr(thread, 'native_id', None))
+        if cpu_time is None:
+            return 0.0
+        previous = self._cpu_times.get(ident, cpu_time)
+        self._cpu_times[ident] = cpu_time
+        return cpu_time - previous
+
+    def _snapshot_memory(self) -> None:
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'After {self.seconds:.1f}s: {current / 1024 / 1024:.1f} MiB traced, '
+                 f'{peak / 1024 / 1024:.1f} MiB at peak']
+        lines.extend(f'    {stat}' for stat in snapshot.statistics('lineno')[:MEMORY_TOP_SITES])
+        if self._previous_snapshot is not None:
+            lines.append('  Growth since the previous snapshot:')
+            growth = snapshot.compare_to(self._previous_snapshot, 'lineno')
+            lines.extend(f'    {stat}' for stat in growth[:MEMORY_TOP_SITES])
+        self._previous_snapshot = snapshot
+        self.memory_reports.append('\n'.join(lines))
+
+    def stage_times(self) -> typing.List[StageTime]:
+        """The time spent in each stage, the longest first"""
+        cpu_available = self._cpu_clock.available
+        stage_times = [StageTime(function, wall, cpu if cpu_available else None, waiting, inclusive)
+                       for function, (wall, cpu, waiting, inclusive) in self._stages.items()]
+        return sorted(stage_times, key=lambda stage_time: stage_time.wall, reverse=True)
+
+    def collapsed(self) -> typing.Iterator[str]:
+        """The sampled stacks in the collapsed format of flamegraph.pl, with the number of samples of each"""
+        for stack, count in sorted(self.stacks.items()):
+            yield f'{stack} {count}'
+
+    def summary(self) -> str:
+        stage_times = self.stage_times()
+        total = sum(stage_time.wall for stage_time in stage_times) or 1.0
+        lines = [f'{self.samples} samples of the threads every {self.interval * 1000:.0f} ms over '
+                 f'{self.seconds:.1f}s, {total:.1f} thread seconds in total',
+                 f'{"stage":<70} {"wall s":>9} {"wall %":>7} {"cpu s":>9} {"waiting s":>10} {"inclusive s":>12}']
+        for stage_time in stage_times:
+            cpu = '-' if stage_time.cpu is None else f'{stage_time.cpu:.2f}'
+            lines.append(f'{stage_time.function:<70} {stage_time.wall:>9.2f} {stage_time.wall / total:>7.1%} '
+                         f'{cpu:>9} {stage_time.waiting:>10.2f} {stage_time.inclusive:>12.2f}')
+        return '\n'.join(lines)
+
+    def save(self, prefix: str) -> typing.List[str]:
+        """
+        Write the collapsed stacks to PREFIX.collapsed, and the summary and any memory snapshots to
+        PREFIX.txt, returning the paths of the files written.
+        """
+        collapsed_path, summary_path = prefix + '.collapsed', prefix + '.txt'
+        with open(collapsed_path, 'w') as fh:
+            for line in self.collapsed():
+                fh.write(line + '\n')
+        with open(summary_path, 'w') as fh:
+            fh.write(self.summary() + '\n')
+            if self.memory_reports:
+                fh.write('\nAllocations traced by tracemalloc\n\n')
+                fh.write('\n\n'.join(self.memory_reports) + '\n')
+        return [collapsed_path, summary_path]
@@ -0,0 +1,131 @@
+"""
+Routing of S3 requests to region-local clients.
+
+Requests made with a client configured for a region other than the bucket's are redirected
+by S3, costing a round trip per request. `S3ClientRouter` discovers the region and the access
+mode (whether requests must be made as requester pays) of each bucket once, then hands out a
+pooled client for that region and set of credentials.
+"""
+import logging
+import threading
+import typing
+
+import boto3
+import botocore
+from botocore.config import Config
+
+from loader.credentials import AssumedRoleCredentialProvider
+from loader.throttling import RateLimiter, install_s3_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CREDENTIALS = 'default'
+METADATA_CREDENTIALS = 'metadata'
+
+# S3 reports buckets in us-east-1 without a location constraint
+DEFAULT_REGION = 'us-east-1'
+
+
+class BucketInfo(typing.NamedTuple):
+    """What we know about accessing a bucket with a given set of credentials"""
+    region: str
+    requester_pays: bool
+
+
+class S3ClientRouter:
+    def __init__(self, metadata_credentials: AssumedRoleCredentialProvider = None, max_pool_connections: int = 64,
+                 connect_timeout: float = None, read_timeout: float = None, rate_limiter: RateLimiter = None) -> None:
+        """
+        Hands out region-local S3 clients for buckets.
+
+        :param metadata_credentials: Optional credentials for accessing protected buckets, used by
+                                     requesting clients for `METADATA_CREDENTIALS`.
+        :param max_pool_connections: The size of each client's connection pool. This should be at least
+                                     the number of threads sharing the client.
+        :param connect_timeout: The clients' connect timeout in seconds. Defaults to botocore's.
+        :param read_timeout: The clients' read timeout in seconds. Defaults to botocore's.
+        :param rate_limiter: Limits the rate of the clients' requests, if given.
+        """
+        self.metadata_credentials = metadata_credentials
+        self.max_pool_connections = max_pool_connections
+        self.rate_limiter = rate_limiter
+        self.timeouts = {name: value for name, value in (('connect_timeout', connect_timeout),
+                                                         ('read_timeout', read_timeout)) if value is not None}
+        self._lock = threading.Lock()
+        self._bucket_locks: typing.Dict[tuple, threading.Lock] = dict()
+        self._buckets: typing.Dict[tuple, BucketInfo] = dict()
+        self._clients: typing.Dict[tuple, typing.Any] = dict()
+
+    def client(self, bucket: str, credentials: str = DEFAULT_CREDENTIALS):
+        """Return a client for the bucket's region that uses the given credentials."""
+        return self._client_for_region(self.bucket_info(bucket, credentials).region, credentials)
+
+    def request_payer_args(self, bucket: str, credentials: str = DEFAULT_CREDENTIALS) -> dict:
+        """Extra keyword arguments to pass to object requests for the given bucket."""
+        return dict(RequestPayer='requester') if self.bucket_info(bucket, credentials).requester_pays else dict()
+
+    def head_object(self, bucket: str, key: str, credentials: str = DEFAULT_CREDENTIALS) -> dict:
+        return self.client(bucket, credentials).head_object(Bucket=bucket, Key=key,
+                                                            **self.request_payer_args(bucket, credentials))
+
+    def bucket_info(self, bucket: str, credentials: str = DEFAULT_CREDENTIALS) -> BucketInfo:
+        """Discover, or look up the already discovered, region and access mode of a bucket."""
+        cache_key = (bucket, credentials)
+        try:
+            return self._buckets[cache_key]
+        except KeyError:
+            pass
+        with self._lock:
+            bucket_lock = self._bucket_locks.setdefault(cache_key, threading.Lock())
+        # Only one thread discovers a given bucket, the others wait for its result.
+        with bucket_lock:
+            if cache_key not in self._buckets:
+                self._buckets[cache_key] = self._discover(bucket, credentials)
+            return self._buckets[cache_key]
+
+    def _discover(self, bucket: str, credentials: str) -> BucketInfo:
+        client = self._client_for_region(None, credentials)
+        region = self._discover_region(client, bucket)
+        requester_pays = self._discover_requester_pays(self._client_for_region(region, credentials), bucket)
+        logger.debug(f'Bucket {bucket}: region {region}, requester pays: {requester_pays}')
+        return BucketInfo(region, requester_pays)
+
+    @staticmethod
+    def _discover_region(client, bucket: str) -> str:
+        # S3 reports the bucket's region even when access to the bucket is denied.
+        try:
+            response = client.head_bucket(Bucket=bucket)
+        except botocore.exceptions.ClientError as e:
+            response = e.response
+        headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        return headers.get('x-amz-bucket-region') or client.meta.region_name or DEFAULT_REGION
+
+    @staticmethod
+    def _discover_requester_pays(client, bucket: str) -> bool:
+        # Only the bucket owner may read the payment configuration. Everyone else has always
+        # sent requester pays requests, which also work for buckets that aren't requester pays.
+        try:
+            return client.get_bucket_request_payment(Bucket=bucket).get('Payer') == 'Requester'
+        except botocore.exceptions.ClientError:
+            return True
+
+    def _client_for_region(self, region: typing.Optional[str], credentials: str):
+        cache_key = (region, credentials)
+        with self._lock:
+            client = self._clients.get(cache_key)
+            if client is None:
+                client = self._create_client(region, credentials)
+                self._clients[cache_key] = client
+            return client
+
+    def _create_client(self, region: typing.Optional[str], credentials: str):
+        config = Config(region_name=region, max_pool_connections=self.max_pool_connections, **self.timeouts)
+        if credentials == DEFAULT_CREDENTIALS:
+            client = boto3.client('s3', config=config)
+        elif credentials == METADATA_CREDENTIALS and self.metadata_credentials is not None:
+            client = self.metadata_credentials.client('s3', config=config)
+        else:
+            raise ValueError(f'No credentials configured for {credentials}')
+        if self.rate_limiter is not None:
+            install_s3_rate_limiter(client, self.rate_limiter)
+        return client
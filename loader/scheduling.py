@@ -0,0 +1,117 @@
+"""
+The order in which bundles are loaded, and the sharing of their files among idle workers.
+
+Bundles vary widely in size, and loading them in input order lets a few large bundles near the end
+of a manifest hold up the whole run while the other workers are idle. The policies here order the
+bundles so that the largest start first, and the short ones fill in behind them, or interleave the
+bundles of different source buckets so that no single bucket is asked for all the work at once.
+
+Within a bundle, the files can be loaded by a pool shared by all bundles. A bundle's worker queues its
+files in that pool and then loads whichever of them no file worker has started yet, so that the files
+of a large bundle are spread over all the workers that are idle, while none waits on a queue it could
+have served itself.
+"""
+import concurrent.futures
+import itertools
+import threading
+import typing
+from urllib.parse import urlparse
+
+# Load bundles in the order of the input
+INPUT_ORDER = 'input'
+# Load the bundles with the most files first
+MOST_FILES_FIRST = 'files'
+# Load the bundles with the most bytes of data files first
+LARGEST_FIRST = 'size'
+# Take bundles from each source bucket in turn
+INTERLEAVE_BUCKETS = 'buckets'
+
+SCHEDULING_POLICIES = (INPUT_ORDER, MOST_FILES_FIRST, LARGEST_FIRST, INTERLEAVE_BUCKETS)
+
+
+def _bundle_size(bundle) -> int:
+    return sum(int(data_file.size) for data_file in bundle.data_files)
+
+
+def _bundle_bucket(bundle) -> str:
+    """The bucket of the first data file of a bundle, or '' if it has none"""
+    for data_file in bundle.data_files:
+        for url in data_file.cloud_urls:
+            parsed_url = urlparse(url)
+            return f'{parsed_url.scheme}://{parsed_url.netloc}'
+    return ''
+
+
+def schedule_bundles(bundles: typing.Sequence[typing.Any],
+                     policy: str = INPUT_ORDER) -> typing.List[typing.Tuple[int, typing.Any]]:
+    """
+    Order parsed bundles for loading according to the given policy.
+
+    :return: (position in the input, bundle) pairs, in the order the bundles should be submitted.
+             Bundles that compare equal under a policy keep their input order.
+    """
+    numbered = list(enumerate(bundles))
+    if policy == INPUT_ORDER:
+        return numbered
+    elif policy == MOST_FILES_FIRST:
+        return sorted(numbered, key=lambda item: -len(item[1].data_files))
+    elif policy == LARGEST_FIRST:
+        return sorted(numbered, key=lambda item: -_bundle_size(item[1]))
+    elif policy == INTERLEAVE_BUCKETS:
+        by_bucket: typing.Dict[str, list] = dict()
+        for item in numbered:
+            by_bucket.setdefault(_bundle_bucket(item[1]), []).append(item)
+        rounds = itertools.zip_longest(*by_bucket.values())
+        return [item for round_ in rounds for item in round_ if item is not None]
+    else:
+        raise ValueError(f'Unknown scheduling policy: {policy}. Expected one of {", ".join(SCHEDULING_POLICIES)}')
+
+
+class _ClaimableTask:
+    """A call that is made by whichever thread claims it first"""
+    def __init__(self, func: typing.Callable, args: tuple) -> None:
+        self.func = func
+        self.args = args
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def run(self) -> None:
+        with self._lock:
+            if self._claimed:
+                return
+            self._claimed = True
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            self.future.set_result(self.func(*self.args))
+        except BaseException as e:
+            self.future.set_exception(e)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if not self._claimed:
+                self._claimed = True
+                self.future.cancel()
+
+
+def map_stealable(executor: concurrent.futures.Executor, func: typing.Callable,
+                  *iterables: typing.Iterable) -> typing.List[typing.Any]:
+    """
+    Like `list(executor.map(func, *iterables))`, except that the calling thread makes every call that no
+    worker of the executor has started by the time it gets to it, rather than waiting for a worker to be
+    free. Once one call fails, the calls not yet started are canceled and the failure is raised.
+    """
+    tasks = [_ClaimableTask(func, args) for args in zip(*iterables)]
+    for task in tasks:
+        executor.submit(task.run)
+    try:
+        for task in tasks:
+            task.run()
+            if task.future.done() and task.future.exception() is not None:
+                break
+        # Wait for the calls made by workers, raising the first failure
+        return [task.future.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
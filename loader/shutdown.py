@@ -0,0 +1,147 @@
+"""
+Graceful shutdown of a load on SIGINT or SIGTERM, and checkpoints for resuming it.
+
+On the first signal, no more bundles are started, and those in flight are given a grace period to
+finish. When it runs out, or on a second signal, the deadlines of the bundles still in flight are
+canceled, which abandons them at the next step of loading them (see `loader.deadlines`). The loader
+then writes a `Checkpoint` of the bundles it did not finish, and of the asynchronous DSS copies it
+had started but not seen finish, and exits. A later run given the checkpoint loads only those bundles,
+and reuses the copies that have finished in the meantime.
+"""
+import json
+import logging
+import os
+import signal
+import threading
+import typing
+from contextlib import contextmanager
+
+from loader.deadlines import Deadline
+from util import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRACE_PERIOD = 60
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+
+class GracefulShutdown:
+    def __init__(self, grace_period: float = DEFAULT_GRACE_PERIOD) -> None:
+        """
+        Coordinates stopping a load on request, e.g. on a signal.
+
+        :param grace_period: The seconds the work in flight is given to finish once a shutdown is requested.
+        """
+        self.grace_period = grace_period
+        self.requested = threading.Event()
+        self._grace_period_over = threading.Event()
+        self._deadlines: typing.Set[Deadline] = set()
+        self._lock = threading.Lock()
+
+    def request(self) -> None:
+        """Stop admitting work, and cancel the work in flight after the grace period"""
+        if self.requested.is_set():
+            return
+        self.requested.set()
+        logger.warning(f'Shutting down: no more bundles will be started, those in flight have '
+                       f'{self.grace_period} seconds to finish')
+        timer = threading.Timer(self.grace_period, self.cancel)
+        timer.daemon = True
+        timer.start()
+
+    def cancel(self) -> None:
+        """Cancel the work in flight, and any started from now on"""
+        with self._lock:
+            if not self._grace_period_over.is_set():
+                logger.warning(f'Canceling {len(self._deadlines)} bundles in flight')
+            self._grace_period_over.set()
+            for deadline in self._deadlines:
+                deadline.cancel()
+
+    @contextmanager
+    def track(self, deadline: Deadline) -> typing.Iterator[Deadline]:
+        """Cancel the given deadline, for work in flight within the context, if the shutdown cancels work"""
+        with self._lock:
+            if self._grace_period_over.is_set():
+                deadline.cancel()
+            self._deadlines.add(deadline)
+        try:
+            yield deadline
+        finally:
+            with self._lock:
+                self._deadlines.discard(deadline)
+
+    def _handle_signal(self, signum, frame) -> None:
+        if self.requested.is_set():
+            logger.warning(f'Received {signal.Signals(signum).name} again, canceling the bundles in flight')
+            self.cancel()
+        else:
+            logger.warning(f'Received {signal.Signals(signum).name}')
+            self.request()
+
+    @contextmanager
+    def signals_handled(self, signals=(signal.SIGINT, signal.SIGTERM)) -> typing.Iterator['GracefulShutdown']:
+        """Request the shutdown on the given signals within the context. Signals can only be handled by the main
+        thread, so elsewhere this does nothing."""
+        if threading.current_thread() is not threading.main_thread():
+            yield self
+            return
+        previous_handlers = {signum: signal.signal(signum, self._handle_signal) for signum in signals}
+        try:
+            yield self
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+
+class Checkpoint(typing.NamedTuple):
+    """What remains to be done of an interrupted load"""
+    # The UUIDs of the bundles that were not loaded, including those that failed
+    unfinished_bundles: typing.List[str]
+    # The uuid, version and source_url of files the DSS was still copying
+    pending_copies: typing.List[dict]
+
+    @classmethod
+    def of(cls, input_json: typing.List[dict], done: typing.Set[str], pending_copies: typing.List[dict]) -> 'Checkpoint':
+        """The checkpoint of a load of the given input that finished the given bundles"""
+        bundle_uuids = (_bundle_uuid(bundle) for bundle in input_json)
+        return cls([bundle_uuid for bundle_uuid in bundle_uuids if bundle_uuid is not None and bundle_uuid not in done],
+                   pending_copies)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.unfinished_bundles and not self.pending_copies
+
+    @classmethod
+    def load(cls, path: str) -> typing.Optional['Checkpoint']:
+        """Read the checkpoint at the given path, if there is one"""
+        try:
+            with open(path) as fh:
+                checkpoint = json.load(fh)
+        except FileNotFoundError:
+            return None
+        if checkpoint.get('format_version') != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f'Unsupported checkpoint format in {path}: {checkpoint.get("format_version")}')
+        return cls(checkpoint['unfinished_bundles'], checkpoint['pending_copies'])
+
+    def save(self, path: str) -> None:
+        """Write the checkpoint, or remove the file if there is nothing left to do"""
+        if self.is_empty:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        content = json.dumps(dict(format_version=CHECKPOINT_FORMAT_VERSION, **self._asdict()), indent=4)
+        atomic_write(os.path.abspath(path), content.encode('utf-8'))
+
+    def unfinished(self, input_json: typing.List[dict]) -> typing.List[dict]:
+        """The bundles of the given input that remain to be loaded"""
+        unfinished_bundles = set(self.unfinished_bundles)
+        return [bundle for bundle in input_json if _bundle_uuid(bundle) in unfinished_bundles]
+
+
+def _bundle_uuid(bundle) -> typing.Optional[str]:
+    try:
+        return bundle['data_bundle']['id']
+    except (KeyError, TypeError):
+        return None
@@ -0,0 +1,251 @@
+"""
+Simulation of loads, for planning production runs without touching any cloud or DSS.
+
+A simulation replays the input through the same parsing and bundle loading code as a real load,
+using a `SimulatedDssUploader` that records each cloud and DSS operation instead of performing it.
+The duration of each operation is drawn from a `LatencyModel`, including retries of failed attempts.
+The recorded operations are then scheduled onto a given number of worker threads and connections,
+with each service serving a limited number of concurrent requests, to predict the total runtime of
+the load for each candidate setting.
+"""
+import heapq
+import json
+import logging
+import os
+import random
+import typing
+from urllib.parse import urlparse
+
+from loader.base_loader import DssUploader
+from loader.standard_loader import DEFAULT_POOL_SIZE, StandardFormatBundleUploader
+from util import serialization, tz_utc_now
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+
+class OperationModel(typing.NamedTuple):
+    """How long a single type of operation takes, and how often it fails"""
+    service: str
+    latency: float  # mean seconds per request
+    jitter: float = 0.25  # standard deviation as a fraction of the latency
+    error_rate: float = 0.0  # probability that an attempt fails and is retried
+    bandwidth: float = 0.0  # bytes per second, or 0 if the duration does not depend on size
+
+
+DEFAULT_OPERATIONS = {
+    's3_head': OperationModel('s3', latency=0.03),
+    'gs_get_blob': OperationModel('gcs', latency=0.08),
+    'staging_put': OperationModel('s3', latency=0.05, bandwidth=50 * MiB),
+    'staging_copy': OperationModel('s3', latency=0.1, bandwidth=250 * MiB),
+    'staging_tagging': OperationModel('s3', latency=0.03),
+    'dss_put_file': OperationModel('dss', latency=0.6, error_rate=0.01),
+    'dss_put_bundle': OperationModel('dss', latency=1.0, error_rate=0.01),
+}
+
+# How many concurrent requests each service serves before requests start to queue
+DEFAULT_CAPACITY = {'s3': 1000, 'gcs': 1000, 'dss': 20}
+
+
+class LatencyModel:
+    def __init__(self,
+                 operations: typing.Dict[str, OperationModel] = None,
+                 capacity: typing.Dict[str, int] = None,
+                 retry_backoff: float = 1.0,
+                 seed: int = 0) -> None:
+        """
+        :param operations: Models of each operation, by name. Defaults to `DEFAULT_OPERATIONS`.
+        :param capacity: The number of concurrent requests each service can serve. Defaults to `DEFAULT_CAPACITY`.
+        :param retry_backoff: Seconds waited after a failed attempt before retrying.
+        :param seed: Seed for the random durations and failures, so that simulations are repeatable.
+        """
+        self.operations = dict(DEFAULT_OPERATIONS)
+        self.operations.update(operations or {})
+        self.capacity = dict(DEFAULT_CAPACITY)
+        self.capacity.update(capacity or {})
+        self.retry_backoff = retry_backoff
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'LatencyModel':
+        """
+        Load a model from a JSON file such as:
+
+            {"operations": {"dss_put_file": {"service": "dss", "latency": 2.5, "error_rate": 0.05}},
+             "capacity": {"dss": 50},
+             "retry_backoff": 2.0}
+
+        Operations and services that aren't mentioned keep their default models.
+        """
+        with open(path) as fh:
+            model = json.load(fh)
+        operations = {name: OperationModel(**operation) for name, operation in model.get('operations', {}).items()}
+        return cls(operations, model.get('capacity'), model.get('retry_backoff', 1.0), model.get('seed', 0))
+
+    def sample(self, operation: str, size: int = 0) -> typing.Tuple[str, float]:
+        """Return the service used by and the total duration of the given operation, including retries."""
+        model = self.operations[operation]
+        duration = 0.0
+        while True:
+            attempt = max(0.0, self._random.gauss(model.latency, model.latency * model.jitter))
+            if model.bandwidth:
+                attempt += size / model.bandwidth
+            duration += attempt
+            if self._random.random() >= model.error_rate:
+                return model.service, duration
+            duration += self.retry_backoff
+
+
+class SimulatedDssUploader(DssUploader):
+    """
+    A DssUploader that records the operations it would perform, with their modeled durations,
+    rather than performing them.
+    """
+    def __init__(self, latency_model: LatencyModel, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.latency_model = latency_model
+        self.trace: typing.List[typing.Tuple[str, float]] = []
+
+    def _record(self, operation: str, size: int = 0):
+        self.trace.append(self.latency_model.sample(operation, size))
+
+    def get_s3_file_metadata(self, bucket: str, key: str) -> dict:
+        self._record('s3_head')
+        return dict()
+
+    def get_gs_file_metadata(self, bucket: str, key: str) -> dict:
+        self._record('gs_get_blob')
+        return dict()
+
+    def upload_dict_as_file(self, value: dict, filename: str, file_uuid: str, file_version: str = None,
+                            content_type: str = None):
+        self._record('staging_put', len(serialization.indented_dumps(value)))
+        self._record('staging_tagging')
+        return self._upload_tagged_cloud_file_to_dss_by_copy(self.staging_bucket, f'{file_uuid}/{filename}',
+                                                             file_uuid, file_version=file_version)
+
+    def upload_local_file(self, path: str, file_uuid: str, file_version: str = None, content_type: str = None):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        self._record('staging_put', size)
+        self._record('staging_tagging')
+        return self._upload_tagged_cloud_file_to_dss_by_copy(self.staging_bucket,
+                                                             f'{file_uuid}/{os.path.basename(path)}',
+                                                             file_uuid, file_version=file_version)
+
+    def get_dss_file_version(self, file_uuid: str, file_version: str):
+        # Simulations assume that none of the files are in the DSS yet
+        return None
+
+    def upload_cloud_file_by_value(self, filename: str, file_uuid: str, file_cloud_urls: set, size: int,
+                                   file_version: str = None):
+        size = int(size or 0)
+        # Like the real upload, a replica in S3 is copied into the staging bucket server-side, and one in
+        # GCS is streamed through this host
+        if any(urlparse(url).scheme == 's3' for url in file_cloud_urls):
+            self._record('s3_head')
+            self._record('staging_copy', size)
+        else:
+            self._record('gs_get_blob')
+            self._record('staging_put', size)
+        self._record('staging_tagging')
+        return self._upload_tagged_cloud_file_to_dss_by_copy(self.staging_bucket, f'{file_uuid}/{filename}',
+                                                             file_uuid, file_version=file_version)
+
+    def _upload_tagged_cloud_file_to_dss_by_copy(self, source_bucket: str, source_key: str, file_uuid: str,
+                                                 file_version: str = None, timeout_seconds: int = 1200):
+        self._record('dss_put_file')
+        return file_uuid, file_version or tz_utc_now(), self.get_filename_from_key(source_key), False
+
+    def load_bundle(self, file_info_list: list, bundle_uuid: str):
+        self._record('dss_put_bundle')
+        return f'{bundle_uuid}.{tz_utc_now()}'
+
+
+class SimulationResult(typing.NamedTuple):
+    workers: int
+    connections: int
+    runtime: float  # predicted seconds
+
+
+class LoadSimulator:
+    def __init__(self, dss_uploader: SimulatedDssUploader, bundle_uploader: StandardFormatBundleUploader) -> None:
+        self.dss_uploader = dss_uploader
+        self.bundle_uploader = bundle_uploader
+        self.traces: typing.List[typing.List[typing.Tuple[str, float]]] = []
+
+    def record(self, input_json: typing.List[dict]) -> None:
+        """Run the input through the loader, recording the operations each bundle would perform."""
+        self.bundle_uploader._parse_all_bundles(input_json)
+        for count, parsed_bundle in enumerate(self.bundle_uploader.bundles_parsed):
+            self.dss_uploader.trace = []
+            try:
+                self.bundle_uploader._load_bundle(*parsed_bundle, count)
+            except Exception:
+                logger.exception(f'Bundle {count}: Would fail to load. ID: {parsed_bundle.bundle_uuid}')
+                self.bundle_uploader.bundles_failed_parsed.append(parsed_bundle)
+            else:
+                self.bundle_uploader.bundles_loaded.append(parsed_bundle)
+            self.traces.append(self.dss_uploader.trace)
+
+    def runtime(self, workers: int, connections: int) -> float:
+        """
+        Predict the runtime of the recorded load with the given number of worker threads, each
+        service being limited to the given number of connections or its capacity, whichever is less.
+        """
+        capacity = self.dss_uploader.latency_model.capacity
+        free_at = {service: [0.0] * min(connections, capacity.get(service, connections)) for service in capacity}
+        pending = iter(self.traces)
+        # Events are (time, worker, trace, index of the trace's next operation)
+        events: typing.List[tuple] = [(0.0, worker, [], 0) for worker in range(workers)]
+        heapq.heapify(events)
+        end = 0.0
+        while events:
+            now, worker, trace, index = heapq.heappop(events)
+            end = max(end, now)
+            if index == len(trace):
+                trace = next(pending, None)
+                if trace is not None:
+                    heapq.heappush(events, (now, worker, trace, 0))
+                continue
+            service, duration = trace[index]
+            slots = free_at.setdefault(service, [0.0] * connections)
+            start = max(now, heapq.heappop(slots))
+            heapq.heappush(slots, start + duration)
+            heapq.heappush(events, (start + duration, worker, trace, index + 1))
+        return end
+
+    def evaluate(self,
+                 worker_options: typing.Sequence[int] = (1, 2, 5, 10, 20, 50, 100),
+                 connection_options: typing.Sequence[int] = (8, 16, 32, 64, 128)) -> typing.List[SimulationResult]:
+        return [SimulationResult(workers, connections, self.runtime(workers, connections))
+                for workers in worker_options for connections in connection_options]
+
+    @staticmethod
+    def recommend(results: typing.List[SimulationResult], tolerance: float = 0.05) -> SimulationResult:
+        """The cheapest setting whose runtime is within `tolerance` of the best runtime"""
+        best = min(result.runtime for result in results)
+        good_enough = [result for result in results if result.runtime <= best * (1 + tolerance)]
+        return min(good_enough, key=lambda result: (result.workers, result.connections))
+
+    def report(self, connections: int = DEFAULT_POOL_SIZE) -> str:
+        """
+        Tabulate the predicted runtimes, including that with the workers of the bundle uploader and the
+        given number of connections, the size of the connection pools of a real load.
+        """
+        workers = self.bundle_uploader.max_workers
+        results = self.evaluate()
+        recommended = self.recommend(results)
+        operations = sum(len(trace) for trace in self.traces)
+        lines = [f'Simulated {len(self.traces)} bundles with {operations} cloud and DSS operations',
+                 f'{"workers":>8} {"connections":>12} {"runtime (s)":>12}']
+        lines.extend(f'{result.workers:>8} {result.connections:>12} {result.runtime:>12.1f}' for result in results)
+        current = self.runtime(workers, connections)
+        lines.append(f'Predicted runtime with the current settings ({workers} workers, '
+                     f'{connections} connections): {current:.1f}s')
+        lines.append(f'Recommended: {recommended.workers} workers, {recommended.connections} connections '
+                     f'(predicted runtime {recommended.runtime:.1f}s)')
+        return '\n'.join(lines)
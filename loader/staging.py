@@ -0,0 +1,152 @@
+"""
+Upload of local files to the staging bucket from a memory map.
+
+The file is mapped into memory once and every consumer of its content works on `memoryview` slices
+of the map: the hashers computing the DSS checksums, and the parts of the (multipart) upload, which
+are sent in parallel. Nothing is copied into intermediate `bytes` objects, so a large BAM or CRAM
+file doesn't cost its chunk size in memory per part in flight, and the pages of the file are read
+from the page cache only once for both hashing and uploading.
+"""
+import logging
+import mmap
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from loader.checksumming import READ_CHUNK_SIZE, ParallelChecksummer, aligned_read_size
+from loader.throttling import TransferBudget
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 10  # the same as boto3's TransferConfig
+
+MiB = 1024 * 1024
+
+
+class StagingTransferConfig(typing.NamedTuple):
+    """How local files are uploaded to the staging bucket"""
+    # The most parts of a single file uploaded at once
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    # The smallest part size to use. Larger parts mean fewer requests for very large files.
+    # The part size is never smaller than dcplib's, which the DSS uses for its own S3 ETags.
+    min_chunk_size: int = 0
+    # Concurrency and bandwidth shared by all files being uploaded
+    budget: typing.Optional[TransferBudget] = None
+
+    def chunk_size(self, file_size: int) -> int:
+        from dcplib import s3_multipart
+        chunk_size = s3_multipart.get_s3_multipart_chunk_size(file_size)
+        return max(chunk_size, (self.min_chunk_size + MiB - 1) // MiB * MiB)
+
+
+class MemoryviewReader:
+    def __init__(self, view: memoryview) -> None:
+        """
+        A seekable, file-like view of a memoryview, suitable as the Body of an S3 request.
+
+        `read` returns memoryview slices rather than bytes, which botocore and http.client
+        hash and send without copying them.
+        """
+        self._view = view
+        self._position = 0
+
+    def read(self, size: int = -1) -> memoryview:
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        chunk = self._view[self._position:end]
+        self._position = end
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, min(offset, len(self._view)))
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def __len__(self) -> int:
+        return len(self._view) - self._position
+
+
+class MappedFile:
+    def __init__(self, path: str) -> None:
+        """
+        A read-only memory map of a local file, used as a context manager.
+
+        Slices of `view` must not be used after the context is exited.
+        """
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = None
+        self._mmap = None
+        self.view = memoryview(b'')
+
+    def __enter__(self) -> 'MappedFile':
+        # Empty files can't be mapped, their view remains empty
+        if self.size:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._mmap, 'madvise'):
+                self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+            self.view = memoryview(self._mmap)
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A slice is still referenced, e.g. by the traceback of a failed part upload.
+                # The map is unmapped once that is garbage collected.
+                logger.debug(f'Deferring unmapping {self.path}', exc_info=True)
+            self._file.close()
+
+
+def checksum_mapped_file(mapped_file: MappedFile, s3_etag_chunk_size: int,
+                         checksummer: ParallelChecksummer = None) -> typing.Dict[str, str]:
+    """Compute the DSS checksums of a mapped file, handing the hashers slices of the map."""
+    read_size = aligned_read_size(s3_etag_chunk_size, READ_CHUNK_SIZE)
+    with checksummer or ParallelChecksummer(s3_etag_chunk_size) as checksummer:
+        for offset in range(0, mapped_file.size, read_size):
+            checksummer.update(mapped_file.view[offset:offset + read_size])
+        return checksummer.get_checksums()
+
+
+def upload_mapped_file(s3_client, mapped_file: MappedFile, bucket: str, key: str, chunk_size: int,
+                       multipart_threshold: int, extra_args: dict = None,
+                       max_concurrency: int = DEFAULT_MAX_CONCURRENCY, budget: TransferBudget = None) -> None:
+    """
+    Upload a mapped file to S3, in parts of `chunk_size` sent in parallel if it is at least
+    `multipart_threshold` in size. The parts line up with those the S3 ETag checksum is computed for.
+    Each request waits for its share of the `budget`, if one is given.
+    """
+    extra_args = extra_args or {}
+    budget = budget or TransferBudget()
+    if mapped_file.size < multipart_threshold:
+        with budget.transfer(mapped_file.size):
+            s3_client.put_object(Bucket=bucket, Key=key, Body=MemoryviewReader(mapped_file.view), **extra_args)
+        return
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)['UploadId']
+
+    def _upload_part(part_number: int, offset: int) -> dict:
+        body = MemoryviewReader(mapped_file.view[offset:offset + chunk_size])
+        with budget.transfer(len(body)):
+            response = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                             PartNumber=part_number, Body=body)
+        return dict(ETag=response['ETag'], PartNumber=part_number)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(_upload_part, part_number, offset)
+                       for part_number, offset in enumerate(range(0, mapped_file.size, chunk_size), start=1)]
+            parts = [future.result() for future in futures]
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                            MultipartUpload=dict(Parts=parts))
+    except BaseException:
+        logger.warning(f'Aborting multipart upload of s3://{bucket}/{key}')
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
@@ -1,10 +1,17 @@
 import concurrent.futures
+import itertools
 import logging
 import pprint
 import re
+import time
 import typing
 
 from loader.base_loader import DssUploader, MetadataFileUploader
+from loader.deadlines import Deadline, DeadlineExceeded, current_deadline, deadline_scope, with_current_deadline
+from loader.fingerprints import FingerprintIndex, bundle_fingerprints
+from loader.logs import lazy, log_context
+from loader.scheduling import INPUT_ORDER, map_stealable, schedule_bundles
+from loader.shutdown import Checkpoint, GracefulShutdown
 from util import patch_connection_pools, tz_utc_now
 
 logger = logging.getLogger(__name__)
@@ -12,6 +19,24 @@ logger = logging.getLogger(__name__)
 SCHEMA_URL = ('https://raw.githubusercontent.com/DataBiosphere/metadata-schema/master/'
               'json_schema/cgp/gen3/2.0.0/cgp_gen3_metadata.json')
 
+# The number of bundles loaded concurrently, and the connection pool size they share
+DEFAULT_MAX_WORKERS = 5
+DEFAULT_POOL_SIZE = 64
+
+# The number of data files checked for concurrently before loading, to skip those already in the DSS
+DEFAULT_PRECHECK_WORKERS = 32
+
+# The number of bundles read from an iterable input at a time, to be parsed, prechecked and scheduled together
+DEFAULT_WINDOW = 1000
+
+# The outcomes of loading a bundle
+LOADED = 'loaded'
+UNCHANGED = 'unchanged'
+UNPARSED = 'unparsed'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+CANCELED = 'canceled'
+
 
 class ParseError(Exception):
     """To be thrown any time a bundle doesn't contain an expected field"""
@@ -36,6 +61,21 @@ class ParsedBundle(typing.NamedTuple):
         return pprint.pformat(self, indent=4)
 
 
+class BundleResult(typing.NamedTuple):
+    """The outcome of loading one bundle of the input"""
+    bundle_num: int  # position in the input
+    bundle_uuid: typing.Optional[str]  # None if the bundle could not be parsed
+    status: str  # LOADED, UNCHANGED, UNPARSED, FAILED, TIMED_OUT or CANCELED
+    fqid: typing.Optional[str]  # "{bundle_uuid}.{version}" of the bundle in the DSS, if it was loaded
+    file_versions: typing.Dict[str, str]  # The DSS versions of the bundle's files by file UUID, if it was loaded
+    seconds: float  # The time spent loading the bundle
+    error: typing.Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (LOADED, UNCHANGED)
+
+
 class StandardFormatBundleUploader:
     _uuid_regex = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')  # noqa
     # adapted from http://mattallan.org/posts/rfc3339-date-time-validation/
@@ -46,14 +86,55 @@ class StandardFormatBundleUploader:
                                 '(?P<secfrac>\.[0-9]+)?'  # noqa
                                 '(Z|(\+|-)(?P<offset_hour>[01][0-9]|2[0-3]):(?P<offset_minute>[0-5][0-9]))?$')  # noqa
 
-    def __init__(self, dss_uploader: DssUploader, metadata_file_uploader: MetadataFileUploader) -> None:
+    def __init__(self, dss_uploader: DssUploader, metadata_file_uploader: MetadataFileUploader,
+                 load_by_value: bool = False, previous_index: FingerprintIndex = None,
+                 precheck_files: bool = True, max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_file_workers: int = 0, schedule: str = INPUT_ORDER, bundle_timeout: float = None,
+                 shutdown: GracefulShutdown = None) -> None:
+        """
+        :param load_by_value: If True, copy the content of data files into the DSS rather than loading
+                              them by reference.
+        :param previous_index: The fingerprints of a previously loaded manifest. Bundles that are unchanged
+                               since are skipped, and files that are unchanged in changed bundles are reused.
+        :param precheck_files: If True, check which data files are already in the DSS before loading any bundles,
+                               and don't upload those again. This is skipped on dry runs.
+        :param max_workers: The number of bundles loaded concurrently.
+        :param max_file_workers: The number of data files loaded concurrently, across all bundles, in a pool
+                                 shared by the bundles. Each bundle's worker also loads those of its files that
+                                 no file worker has started. If 0, each bundle's files are loaded by its worker.
+        :param schedule: The order in which bundles are loaded concurrently, one of
+                         loader.scheduling.SCHEDULING_POLICIES.
+        :param bundle_timeout: The seconds within which each bundle has to be loaded. A bundle that takes longer is
+                               abandoned at the next step of loading it, and recorded as timed out. Unlimited if None.
+        :param shutdown: Stops the load when requested, e.g. on a signal. Bundles not yet started are not started,
+                         and those in flight are canceled after its grace period.
+        """
         self.dss_uploader = dss_uploader
         self.metadata_file_uploader = metadata_file_uploader
+        self.load_by_value = load_by_value
+        self.previous_index = previous_index or FingerprintIndex()
+        # The fingerprints of the bundles loaded (or skipped as unchanged) by this uploader
+        self.index = FingerprintIndex()
+        self._fingerprints: typing.Dict[str, typing.Tuple[str, typing.Dict[str, str]]] = dict()
+        self.precheck_files = precheck_files
+        self.max_workers = max_workers
+        self.max_file_workers = max_file_workers
+        self.schedule = schedule
+        self.bundle_timeout = bundle_timeout
+        self.shutdown = shutdown or GracefulShutdown()
+        # The asynchronous copies of an interrupted load that is being resumed
+        self.resumed_copies: typing.List[dict] = []
+        # The DSS versions of data files already in the DSS, by file UUID and input version
+        self.files_present: typing.Dict[typing.Tuple[str, str], str] = dict()
         # these will probably need to be made into queues for parallelization
         self.bundles_parsed: typing.List[ParsedBundle] = []
         self.bundles_failed_unparsed: typing.List[dict] = []
         self.bundles_loaded: typing.List[ParsedBundle] = []
         self.bundles_failed_parsed: typing.List[ParsedBundle] = []
+        self.bundles_unchanged: typing.List[ParsedBundle] = []
+        self.bundles_timed_out: typing.List[ParsedBundle] = []
+        # The results of load_all_bundles, in the order the bundles finished
+        self.bundle_results: typing.List[BundleResult] = []
 
     @classmethod
     def _get_file_uuid(cls, file_guid: str):
@@ -131,9 +212,52 @@ class StandardFormatBundleUploader:
 
         return ParsedBundle(bundle_uuid, metadata_dict, parsed_files)
 
-    def _load_bundle(self, bundle_uuid, metadata_dict, data_files, bundle_num):
-        """Do the actual loading for an already parsed bundle"""
-        logger.info(f'Bundle {bundle_num}: Attempting to load. UUID: {bundle_uuid}')
+    def _load_data_file(self, bundle_uuid, data_file, file_fingerprints, bundle_num):
+        """Load one data file of a bundle, unless it is unchanged or already in the DSS, returning its file info"""
+        filename, file_uuid, cloud_urls, file_size, file_guid, file_version = data_file
+        current_deadline().check()
+        previous_file_info = self.previous_index.file_info(bundle_uuid, file_guid,
+                                                           file_fingerprints.get(file_guid))
+        if previous_file_info is not None:
+            logger.debug('Bundle %s: Data file %s is unchanged, reusing uuid:version %s:%s',
+                         bundle_num, filename, previous_file_info['uuid'], previous_file_info['version'])
+            return previous_file_info
+        dss_version = self.files_present.get((file_uuid, file_version))
+        if dss_version is not None:
+            logger.debug('Bundle %s: Data file %s is already in the DSS as uuid:version %s:%s',
+                         bundle_num, filename, file_uuid, dss_version)
+            return dict(uuid=file_uuid, version=dss_version, name=filename)
+        logger.debug('Bundle %s: Attempting to upload data file: %s with uuid:version %s:%s...',
+                     bundle_num, filename, file_uuid, file_version)
+        if self.load_by_value:
+            file_uuid, file_version, filename, already_present = \
+                self.dss_uploader.upload_cloud_file_by_value(filename,
+                                                             file_uuid,
+                                                             cloud_urls,
+                                                             file_size,
+                                                             file_version=file_version)
+        else:
+            file_uuid, file_version, filename, already_present = \
+                self.dss_uploader.upload_cloud_file_by_reference(filename,
+                                                                 file_uuid,
+                                                                 cloud_urls,
+                                                                 file_size,
+                                                                 file_guid,
+                                                                 file_version=file_version)
+        if already_present:
+            logger.debug('Bundle %s: File %s already present. No upload necessary.', bundle_num, filename)
+        logger.debug('Bundle %s: ...Successfully uploaded data file: %s with uuid:version %s:%s',
+                     bundle_num, filename, file_uuid, file_version)
+        return dict(uuid=file_uuid, version=file_version, name=filename)
+
+    def _load_bundle(self, bundle_uuid, metadata_dict, data_files, bundle_num, file_executor=None):
+        """
+        Do the actual loading for an already parsed bundle
+
+        :param file_executor: The pool shared by all bundles for loading data files, if any.
+        :return: The fully qualified ID of the bundle in the DSS, and the DSS versions of its files by file UUID.
+        """
+        logger.info('Bundle %s: Attempting to load. UUID: %s', bundle_num, bundle_uuid)
         file_info_list = []
 
         # load metadata, ignore whether the file was already present
@@ -143,30 +267,50 @@ class StandardFormatBundleUploader:
                                                   SCHEMA_URL,
                                                   # just use current time since there is no better source :/
                                                   file_version=tz_utc_now())
-        logger.debug(f'Bundle {bundle_num}: Uploaded metadata file: {metadata_filename} with '
-                     f'uuid:version {metadata_file_uuid}:{metadata_file_version}')
+        logger.debug('Bundle %s: Uploaded metadata file: %s with uuid:version %s:%s',
+                     bundle_num, metadata_filename, metadata_file_uuid, metadata_file_version)
         file_info_list.append(dict(uuid=metadata_file_uuid, version=metadata_file_version,
                                    name=metadata_filename, indexed=True))
 
-        for data_file in data_files:
-            filename, file_uuid, cloud_urls, file_size, file_guid, file_version = data_file
-            logger.debug(f'Bundle {bundle_num}: Attempting to upload data file: {filename} '
-                         f'with uuid:version {file_uuid}:{file_version}...')
-            file_uuid, file_version, filename, already_present = \
-                self.dss_uploader.upload_cloud_file_by_reference(filename,
-                                                                 file_uuid,
-                                                                 cloud_urls,
-                                                                 file_size,
-                                                                 file_guid,
-                                                                 file_version=file_version)
-            if already_present:
-                logger.debug('Bundle {bundle_num}: File {filename} already present. No upload necessary.')
-            logger.debug(f'Bundle {bundle_num}: ...Successfully uploaded data file: {filename} '
-                         f'with uuid:version {file_uuid}:{file_version}')
-            file_info_list.append(dict(uuid=file_uuid, version=file_version, name=filename, indexed=False))
+        bundle_fingerprint, file_fingerprints = self._fingerprints.get(bundle_uuid, (None, {}))
+
+        def _load_data_file(data_file):
+            # Data files may be loaded by the threads of a pool, which have no log context of their own
+            with log_context(bundle_uuid=bundle_uuid, bundle_num=bundle_num, file_uuid=data_file.file_uuid):
+                return self._load_data_file(bundle_uuid, data_file, file_fingerprints, bundle_num)
+
+        if file_executor is None:
+            data_file_infos = [_load_data_file(data_file) for data_file in data_files]
+        else:
+            data_file_infos = map_stealable(file_executor, with_current_deadline(_load_data_file), data_files)
+        file_infos = {data_file.file_guid: file_info for data_file, file_info in zip(data_files, data_file_infos)}
+        file_info_list.extend(dict(file_info, indexed=False) for file_info in data_file_infos)
 
         # load bundle
-        self.dss_uploader.load_bundle(file_info_list, bundle_uuid)
+        current_deadline().check()
+        bundle_fqid = self.dss_uploader.load_bundle(file_info_list, bundle_uuid)
+        if bundle_fingerprint is not None:
+            self.index.add(bundle_uuid, bundle_fingerprint, file_fingerprints, file_infos)
+        return bundle_fqid, {file_info['uuid']: file_info['version'] for file_info in file_info_list}
+
+    def _parse_input_bundle(self, count: int, bundle: dict) -> typing.Optional[BundleResult]:
+        """Parse a raw json bundle for loading, returning its result if it is not to be loaded"""
+        try:
+            parsed_bundle = self._parse_bundle(bundle)
+        except ParseError as e:
+            logger.exception(f'Could not parse bundle {count}')
+            logger.debug('Bundle details: \n%s', lazy(pprint.pformat, bundle))
+            self.bundles_failed_unparsed.append(bundle)
+            return BundleResult(count, None, UNPARSED, None, {}, 0.0, e)
+        fingerprints = bundle_fingerprints(bundle)
+        if self.previous_index.is_unchanged(parsed_bundle.bundle_uuid, fingerprints[0]):
+            logger.debug(f'Bundle {count}: Unchanged since the previous load. ID: {parsed_bundle.bundle_uuid}')
+            self.index.copy_bundle(self.previous_index, parsed_bundle.bundle_uuid)
+            self.bundles_unchanged.append(parsed_bundle)
+            return BundleResult(count, parsed_bundle.bundle_uuid, UNCHANGED, None, {}, 0.0)
+        self._fingerprints[parsed_bundle.bundle_uuid] = fingerprints
+        self.bundles_parsed.append(parsed_bundle)
+        return None
 
     def _parse_all_bundles(self, input_json):
         """Parses all raw json bundles"""
@@ -174,65 +318,201 @@ class StandardFormatBundleUploader:
             raise ParseError(f"Json file is misformatted. Expected type: list, actually type {type(input_json)}")
 
         for count, bundle in enumerate(input_json):
+            self._parse_input_bundle(count, bundle)
+
+    def _check_files(self, files: typing.Set[typing.Tuple[str, str]]):
+        """Concurrently check which of the given data files are already in the DSS, by file UUID and version"""
+        def _check(file_uuid, file_version):
             try:
-                parsed_bundle = self._parse_bundle(bundle)
-                self.bundles_parsed.append(parsed_bundle)
-            except ParseError:
-                logger.exception(f'Could not parse bundle {count}')
-                logger.debug(f'Bundle details: \n{pprint.pformat(bundle)}')
-                self.bundles_failed_unparsed.append(bundle)
-
-    def _load_bundle_concurrent(self, count, parsed_bundle):
-        logger.info(f'Bundle {count}: Attempting to load ')
+                return self.dss_uploader.get_dss_file_version(file_uuid, file_version)
+            except Exception:
+                # The file is loaded as usual, which reports any persistent problem
+                logger.debug(f'Could not check for file {file_uuid}:{file_version} in the DSS', exc_info=True)
+                return None
+
+        logger.info(f'Checking which of {len(files)} data files are already in the DSS')
+        patch_connection_pools(maxsize=DEFAULT_POOL_SIZE)
+        present_before = len(self.files_present)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_PRECHECK_WORKERS) as executor:
+            futures = {executor.submit(_check, *file): file for file in files}
+            for future in concurrent.futures.as_completed(futures):
+                dss_version = future.result()
+                if dss_version is not None:
+                    self.files_present[futures[future]] = dss_version
+                if self.shutdown.requested.is_set():
+                    # Only the checks already running are waited for
+                    for pending in futures:
+                        pending.cancel()
+                    logger.warning('Stopped checking for data files in the DSS because of the shutdown')
+                    return
+        logger.info(f'{len(self.files_present) - present_before} of {len(files)} data files are already in the DSS')
+
+    def _iter_windows(self, bundles: typing.Iterable[dict], window: typing.Optional[int], scheduled: bool
+                      ) -> typing.Iterator[typing.Tuple[int, typing.Optional[ParsedBundle], typing.Optional[BundleResult]]]:
+        """
+        Read the input a window of bundles at a time, parsing the bundles of each window, checking for their data
+        files in the DSS and ordering them by the scheduling policy before yielding them.
+
+        :param window: The number of bundles per window, or None to read the whole input at once.
+        :param scheduled: If False, the bundles of each window are yielded in input order.
+        :return: For each bundle, its position in the input, and either the parsed bundle to be loaded, or the result
+                 of a bundle that is not to be loaded.
+        """
+        bundles = iter(bundles)
+        offset = 0
+        if self.resumed_copies and not self.precheck_files and not self.dss_uploader.dry_run:
+            self._check_files({(copy['uuid'], copy['version']) for copy in self.resumed_copies})
+        while True:
+            window_bundles = list(itertools.islice(bundles, window) if window else bundles)
+            if not window_bundles:
+                return
+            counts, parsed_bundles = [], []
+            for count, bundle in enumerate(window_bundles, offset):
+                # The bundles not yet parsed are left for the checkpoint
+                if self.shutdown.requested.is_set():
+                    return
+                result = self._parse_input_bundle(count, bundle)
+                if result is None:
+                    counts.append(count)
+                    parsed_bundles.append(self.bundles_parsed[-1])
+                else:
+                    yield count, None, result
+            offset += len(window_bundles)
+            if self.precheck_files and not self.dss_uploader.dry_run and parsed_bundles:
+                self._check_files({(data_file.file_uuid, data_file.file_version)
+                                   for parsed_bundle in parsed_bundles for data_file in parsed_bundle.data_files})
+                if self.shutdown.requested.is_set():
+                    return
+            for index, parsed_bundle in schedule_bundles(parsed_bundles, self.schedule if scheduled else INPUT_ORDER):
+                yield counts[index], parsed_bundle, None
+            if not window:
+                return
+
+    def _load_parsed_bundle(self, count, parsed_bundle, file_executor=None) -> BundleResult:
+        with log_context(bundle_uuid=parsed_bundle.bundle_uuid, bundle_num=count):
+            return self._load_parsed_bundle_in_context(count, parsed_bundle, file_executor)
+
+    def _load_parsed_bundle_in_context(self, count, parsed_bundle, file_executor) -> BundleResult:
+        logger.info('Bundle %s: Attempting to load ', count)
+        deadline = Deadline(self.bundle_timeout, f'Bundle {count}')
+        start = time.monotonic()
+
+        def result(status, fqid=None, file_versions=None, error=None):
+            return BundleResult(count, parsed_bundle.bundle_uuid, status, fqid, file_versions or {},
+                                time.monotonic() - start, error)
         try:
-            self._load_bundle(*parsed_bundle, count)
-        except Exception:
+            with self.shutdown.track(deadline), deadline_scope(deadline):
+                bundle_fqid, file_versions = self._load_bundle(*parsed_bundle, count, file_executor)
+        except DeadlineExceeded as e:
+            if deadline.canceled:
+                logger.warning(f'Bundle {count}: Canceled by shutdown. ID: {parsed_bundle.bundle_uuid}')
+                return result(CANCELED, error=e)
+            logger.error(f'Bundle {count}: Timed out: {e}. ID: {parsed_bundle.bundle_uuid}')
+            self.bundles_timed_out.append(parsed_bundle)
+            return result(TIMED_OUT, error=e)
+        except Exception as e:
             logger.exception(f'Bundle {count}: Error loading. ID: {parsed_bundle.bundle_uuid}')
-            logger.debug(f'Bundle {count} details: \n{parsed_bundle.pprint()}')
+            logger.debug('Bundle %s details: \n%s', count, lazy(parsed_bundle.pprint))
             self.bundles_failed_parsed.append(parsed_bundle)
-            return
+            return result(FAILED, error=e)
         self.bundles_loaded.append(parsed_bundle)
-        logger.info(f'Bundle {count}: Successfully loaded. ID: {parsed_bundle.bundle_uuid}')
-
-    def _load_parsed_bundles_concurrent(self):
-        """Loads already parsed bundles concurrently using threads"""
-        patch_connection_pools(maxsize=64)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(self._load_bundle_concurrent, count, parsed_bundle)
-                       for count, parsed_bundle in enumerate(self.bundles_parsed)]
-            concurrent.futures.wait(futures)
-
-    def _load_parsed_bundles(self):
-        """Loads already parsed bundles"""
-        for count, parsed_bundle in enumerate(self.bundles_parsed):
-            logger.info(f'Attempting to load bundle {count}')
-            try:
-                self._load_bundle(*parsed_bundle, count)
-            except Exception:
-                logger.exception(f'Error loading bundle {parsed_bundle.bundle_uuid}')
-                logger.debug(f'Bundle details: \n{parsed_bundle.pprint()}')
-                self.bundles_failed_parsed.append(parsed_bundle)
-                continue
-            self.bundles_loaded.append(parsed_bundle)
-            logger.info(f'Successfully loaded bundle {parsed_bundle.bundle_uuid}')
+        logger.info('Bundle %s: Successfully loaded. ID: %s', count, parsed_bundle.bundle_uuid)
+        return result(LOADED, bundle_fqid, file_versions)
+
+    def _iter_load_concurrent(self, planned_bundles) -> typing.Iterator[BundleResult]:
+        """Load planned bundles concurrently using threads, yielding their results as they finish"""
+        patch_connection_pools(maxsize=DEFAULT_POOL_SIZE)
+        file_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_file_workers) \
+            if self.max_file_workers else None
+        # Bundles are submitted as workers become free, rather than all at once, so that none are
+        # left queued in the executor when a shutdown is requested, and none are read from the input
+        # before they can be started.
+        in_flight: typing.Set[concurrent.futures.Future] = set()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while True:
+                    while len(in_flight) >= self.max_workers:
+                        done, in_flight = concurrent.futures.wait(in_flight,
+                                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+                    if self.shutdown.requested.is_set():
+                        break
+                    count, parsed_bundle, result = next(planned_bundles, (None, None, None))
+                    if count is None:
+                        break
+                    if result is not None:
+                        yield result
+                        continue
+                    in_flight.add(executor.submit(self._load_parsed_bundle, count, parsed_bundle, file_executor))
+                for future in concurrent.futures.as_completed(in_flight):
+                    yield future.result()
+        finally:
+            if file_executor is not None:
+                file_executor.shutdown()
+
+    def _iter_load_serial(self, planned_bundles) -> typing.Iterator[BundleResult]:
+        """Load planned bundles one at a time, yielding their results"""
+        for count, parsed_bundle, result in planned_bundles:
+            if result is None:
+                result = self._load_parsed_bundle(count, parsed_bundle)
+            yield result
+            if result.status == CANCELED or self.shutdown.requested.is_set():
+                break
+
+    def iter_load_bundles(self, bundles: typing.Iterable[dict], concurrently: bool = False,
+                          window: typing.Optional[int] = DEFAULT_WINDOW) -> typing.Iterator[BundleResult]:
+        """
+        Load the given bundles, yielding the result of each as soon as it is known, in the order they finish.
+
+        The input is read lazily, a window at a time, so it may be a generator, and results are available while
+        the rest of the input is still being loaded. Bundles that could not be parsed, or are unchanged since the
+        previous load, are reported without being loaded. Bundles that are not started, because a shutdown was
+        requested, or because the caller stopped iterating, are not reported. The results are also recorded in the
+        lists of this uploader, e.g. `bundles_loaded`.
+
+        :param concurrently: Load up to `max_workers` bundles at a time, in the order of the scheduling policy
+                             within each window.
+        :param window: The number of bundles read at a time, to be parsed, checked for in the DSS and scheduled
+                       together. If None, the whole input is read first.
+        """
+        planned_bundles = self._iter_windows(bundles, window, scheduled=concurrently)
+        if concurrently:
+            return self._iter_load_concurrent(planned_bundles)
+        else:
+            return self._iter_load_serial(planned_bundles)
+
+    def resume(self, checkpoint: Checkpoint, input_json: typing.List[dict]) -> typing.List[dict]:
+        """Resume an interrupted load, returning the bundles of the input that remain to be loaded"""
+        self.resumed_copies = checkpoint.pending_copies
+        unfinished = checkpoint.unfinished(input_json)
+        logger.info(f'Resuming an interrupted load of {len(unfinished)} bundles, with {len(self.resumed_copies)} '
+                    f'copies pending')
+        return unfinished
+
+    def checkpoint(self, input_json: typing.List[dict]) -> Checkpoint:
+        """The bundles of the input that were not loaded, e.g. because the load was interrupted, or failed"""
+        done = {parsed_bundle.bundle_uuid for parsed_bundle in self.bundles_loaded + self.bundles_unchanged}
+        return Checkpoint.of(input_json, done, list(self.dss_uploader.pending_copies.values()))
 
     def load_all_bundles(self, input_json: typing.List[dict], concurrently: bool = False) -> bool:
         success = True
         logger.info(f'Going to load {len(input_json)} bundle{"" if len(input_json) == 1 else "s"}')
         try:
-            self._parse_all_bundles(input_json)
-            if concurrently:
-                self._load_parsed_bundles_concurrent()
-            else:
-                self._load_parsed_bundles()
+            if type(input_json) is not list:
+                raise ParseError(f"Json file is misformatted. Expected type: list, actually type {type(input_json)}")
+            for result in self.iter_load_bundles(input_json, concurrently, window=None):
+                self.bundle_results.append(result)
         except KeyboardInterrupt:
-            # The bundle that was being processed during the interrupt isn't recorded anywhere
+            # The bundles that were being processed during the interrupt are only recorded by a checkpoint
             logger.exception('Loading canceled with keyboard interrupt')
         finally:
             bundles_unattempted = len(input_json) \
                 - len(self.bundles_failed_unparsed) \
                 - len(self.bundles_failed_parsed) \
-                - len(self.bundles_loaded)
+                - len(self.bundles_loaded) \
+                - len(self.bundles_unchanged) \
+                - len(self.bundles_timed_out)
             if bundles_unattempted:
                 logger.warning(f'Did not yet attempt to load {bundles_unattempted} bundles')
                 success = False
@@ -243,6 +523,11 @@ class StandardFormatBundleUploader:
                 logger.error(f'Could not load {len(self.bundles_failed_parsed)} bundles')
                 success = False
                 # TODO: ADD COMMAND LINE OPTION TO SAVE ERROR LOG TO FILE https://stackoverflow.com/a/11233293/7830612
+            if self.bundles_timed_out:
+                logger.error(f'Timed out loading {len(self.bundles_timed_out)} bundles')
+                success = False
+            if self.bundles_unchanged:
+                logger.info(f'Skipped {len(self.bundles_unchanged)} bundles unchanged since the previous load')
             if success:
                 logger.info(f'Successfully loaded all {len(self.bundles_loaded)} bundles!')
             else:
@@ -0,0 +1,226 @@
+"""
+Limits on the rate and concurrency of transfers and requests, shared by all the threads of a load.
+"""
+import logging
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        """
+        A token bucket, refilled continuously at `rate` tokens per second up to `capacity` tokens.
+
+        Acquiring more tokens than are available puts the bucket into debt, which the caller waits
+        out, so that requests larger than the capacity are still admitted at the average rate.
+
+        :param rate: Tokens added per second.
+        :param capacity: The most tokens that can accumulate, i.e. the largest burst. Defaults to one second's worth.
+        """
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Take the given number of tokens, waiting until the bucket has paid for them. Returns the time waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+
+class TransferBudget:
+    def __init__(self, max_concurrency: int = None, bandwidth: float = None) -> None:
+        """
+        A budget of concurrent transfers and bandwidth shared by all the files of a load, so that
+        uploading many files at once neither opens more connections than the pools hold nor
+        saturates more than the given share of the network.
+
+        :param max_concurrency: The most transfers, e.g. upload parts, in flight at once. Unlimited if None.
+        :param bandwidth: Bytes per second that may be transferred in total. Unlimited if None.
+        """
+        self.max_concurrency = max_concurrency
+        self.bandwidth = bandwidth
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._bytes = TokenBucket(bandwidth) if bandwidth else None
+
+    @contextmanager
+    def transfer(self, size: int) -> typing.Iterator[None]:
+        """Wait for a transfer slot and for `size` bytes of bandwidth, holding the slot for the duration."""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            if self._bytes is not None:
+                self._bytes.acquire(size)
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+# The error codes and HTTP statuses with which S3, GCS and the DSS ask clients to slow down
+THROTTLING_ERROR_CODES = frozenset({'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                                    'TooManyRequests', '429', '503'})
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = None,
+                 increase_per_second: float = None) -> None:
+        """
+        A token bucket whose rate adapts to the service it limits: it is halved when the service
+        throttles a request, and then grows back linearly while requests succeed, up to the
+        configured rate. This keeps requests at about the highest rate the service sustains.
+
+        :param rate: The highest rate, as configured.
+        :param min_rate: The rate is never halved below this. Defaults to 1/64 of the highest rate.
+        :param increase_per_second: How fast the rate grows back. Defaults to 5% of the highest rate per second.
+        """
+        super().__init__(rate, capacity)
+        self.max_rate = rate
+        self.min_rate = rate / 64 if min_rate is None else min_rate
+        self.increase_per_second = rate / 20 if increase_per_second is None else increase_per_second
+        self._decreased = float('-inf')
+        self._increased = time.monotonic()
+
+    def decrease(self) -> None:
+        """Halve the rate, at most once per second, since a burst of throttled requests reports a single overload"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased < 1:
+                return
+            self._refill(now)
+            self._decreased = self._increased = now
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def increase(self) -> None:
+        """Grow the rate by the time since it was last adjusted"""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate < self.max_rate:
+                self._refill(now)
+                self.rate = min(self.max_rate, self.rate + (now - self._increased) * self.increase_per_second)
+            self._increased = now
+
+
+class RateLimiter:
+    def __init__(self, limits: typing.Dict[str, float] = None) -> None:
+        """
+        Limits on the rate of requests to external services, each optionally scoped to a bucket and key prefix.
+
+        :param limits: Maps scopes to requests per second. A scope is a service, "s3", "gs" or "dss", optionally
+                       followed by a colon and a bucket, and then by a slash and a key prefix, e.g. "s3",
+                       "s3:my-bucket" or "s3:my-bucket/some/prefix". For the DSS, the operation takes the place of
+                       the bucket, e.g. "dss:put_file". A request waits for every limit in scope, of which there
+                       is at most one per service, bucket and (the longest matching) prefix.
+        """
+        self.limits = dict(limits or {})
+        self._buckets = {scope: AdaptiveTokenBucket(rate) for scope, rate in self.limits.items()}
+        self._prefixes: typing.Dict[str, typing.List[typing.Tuple[str, AdaptiveTokenBucket]]] = dict()
+        for scope, bucket in self._buckets.items():
+            resource, _, prefix = scope.partition('/')
+            if prefix:
+                self._prefixes.setdefault(resource, []).append((prefix, bucket))
+        for prefixes in self._prefixes.values():
+            prefixes.sort(key=lambda item: -len(item[0]))
+
+    @classmethod
+    def parse(cls, specs: typing.Iterable[str]) -> 'RateLimiter':
+        """Create a limiter from specifications of the form SCOPE=RATE, e.g. "s3:my-bucket=100" """
+        limits = dict()
+        for spec in specs:
+            scope, separator, rate = spec.rpartition('=')
+            try:
+                if not separator or not scope:
+                    raise ValueError
+                limits[scope] = float(rate)
+            except ValueError:
+                raise ValueError(f'Expected a rate limit of the form SCOPE=REQUESTS_PER_SECOND, not {spec}')
+            if limits[scope] <= 0:
+                raise ValueError(f'Rate limits must be positive: {spec}')
+        return cls(limits)
+
+    def _scoped(self, service: str, resource: str = None, key: str = None) -> typing.List[AdaptiveTokenBucket]:
+        """The limits in scope of a request, the most specific first"""
+        buckets = []
+        if resource is not None:
+            scope = f'{service}:{resource}'
+            if key is not None:
+                for prefix, bucket in self._prefixes.get(scope, ()):
+                    if key.startswith(prefix):
+                        buckets.append(bucket)
+                        break
+            if scope in self._buckets:
+                buckets.append(self._buckets[scope])
+        if service in self._buckets:
+            buckets.append(self._buckets[service])
+        return buckets
+
+    def acquire(self, service: str, resource: str = None, key: str = None) -> float:
+        """Wait until a request is within the limits in its scope. Returns the time waited."""
+        if not self._buckets:
+            return 0.0
+        return sum(bucket.acquire() for bucket in self._scoped(service, resource, key))
+
+    def throttled(self, service: str, resource: str = None, key: str = None) -> None:
+        """Lower the most specific limit in scope of a request that the service throttled"""
+        buckets = self._scoped(service, resource, key) if self._buckets else []
+        if buckets:
+            logger.debug(f'Throttled by {service} {resource or ""} {key or ""}, lowering the rate limit '
+                         f'from {buckets[0].rate:.1f} requests per second')
+            buckets[0].decrease()
+
+    def succeeded(self, service: str, resource: str = None, key: str = None) -> None:
+        """Let the limits in scope of a successful request recover"""
+        if self._buckets:
+            for bucket in self._scoped(service, resource, key):
+                bucket.increase()
+
+
+def install_s3_rate_limiter(s3_client, rate_limiter: RateLimiter) -> None:
+    """Make every request of a boto3 S3 client wait for the rate limits of its bucket and key, and adapt them
+    to the SlowDown responses it gets"""
+    if not rate_limiter.limits:
+        return
+
+    def _scope(params: dict) -> tuple:
+        return 's3', params.get('Bucket'), params.get('Key')
+
+    def _before_call(params, context, **kwargs):
+        context['rate_limit_scope'] = _scope(params)
+        rate_limiter.acquire(*context['rate_limit_scope'])
+
+    def _needs_retry(response, request_dict, **kwargs):
+        scope = request_dict.get('context', {}).get('rate_limit_scope')
+        if scope is None or response is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES or str(http_response.status_code) in THROTTLING_ERROR_CODES:
+            rate_limiter.throttled(*scope)
+            # Wait for the lowered limit before the retry
+            rate_limiter.acquire(*scope)
+        elif http_response.status_code < 400:
+            rate_limiter.succeeded(*scope)
+        return None
+
+    s3_client.meta.events.register('provide-client-params.s3', _before_call)
+    s3_client.meta.events.register('needs-retry.s3', _needs_retry)
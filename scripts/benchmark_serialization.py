@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the JSON backends of util.serialization, on a sample input manifest.
+
+Times decoding the sample, and encoding, canonically encoding and fingerprinting each of its data objects,
+as the loader does for every file it loads, with each backend that is installed, e.g.
+
+    python scripts/benchmark_serialization.py --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from loader.fingerprints import fingerprint  # noqa: E402
+from util import serialization  # noqa: E402
+
+DEFAULT_SAMPLE = os.path.join(pkg_root, 'tests', 'test_data', 'topmed-public.json')
+
+
+def _best_of(repeat: int, function) -> float:
+    """The fastest of several runs of the given function, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(content: bytes, repeat: int) -> dict:
+    """The seconds taken by each operation on the given sample, with the backend in use"""
+    data_objects = serialization.loads(content)['data_objects']
+    return {
+        'loads': _best_of(repeat, lambda: serialization.loads(content)),
+        'dumps': _best_of(repeat, lambda: [serialization.dumps(value) for value in data_objects]),
+        'canonical_dumps': _best_of(repeat, lambda: [serialization.canonical_dumps(value) for value in data_objects]),
+        'indented_dumps': _best_of(repeat, lambda: [serialization.indented_dumps(value) for value in data_objects]),
+        'fingerprint': _best_of(repeat, lambda: [fingerprint(value) for value in data_objects]),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sample', nargs='?', default=DEFAULT_SAMPLE,
+                        help='A JSON document with a list of "data_objects", topmed-public.json of the tests by default')
+    parser.add_argument('--repeat', type=int, default=10, help='The runs of each operation, of which the fastest counts')
+    options = parser.parse_args(argv)
+
+    with open(options.sample, 'rb') as fh:
+        content = fh.read()
+    print(f'{options.sample}: {len(content) / 1024 / 1024:.2f} MiB, '
+          f'{len(serialization.loads(content)["data_objects"])} data objects, best of {options.repeat}')
+
+    results = {}
+    for name in serialization.BACKENDS:
+        try:
+            serialization.use_backend(name)
+        except ImportError:
+            print(f'{name} is not installed')
+            continue
+        results[name] = benchmark(content, options.repeat)
+
+    names = list(results)
+    compared = len(names) > 1
+    header = f'{"":16}' + ''.join(f'{name:>12}' for name in names)
+    print(header + f'{"speedup":>12}' if compared else header)
+    for operation in results[serialization.STDLIB]:
+        line = f'{operation:16}' + ''.join(f'{results[name][operation] * 1000:>10.2f}ms' for name in names)
+        if compared:
+            line += f'{results[serialization.STDLIB][operation] / results[names[0]][operation]:>11.1f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
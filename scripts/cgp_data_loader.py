@@ -7,18 +7,27 @@ Script to load files and bundles into the HCA DSS.
 import logging
 import os
 import sys
+import time
 import argparse
+from contextlib import contextmanager
 
+_start_time = time.perf_counter()
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
 from loader import base_loader
-from loader.standard_loader import StandardFormatBundleUploader
-from util import load_json_from_file, suppress_verbose_logging
+from loader.standard_loader import DEFAULT_MAX_WORKERS, StandardFormatBundleUploader
+from util import StepTimer, suppress_verbose_logging
 
+_import_time = time.perf_counter() - _start_time
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    """Add the arguments shared by all modes of the loader, returning the dry run group"""
+    from loader.deadlines import Timeouts
+    from loader.profiling import DEFAULT_SAMPLE_INTERVAL
+    default_timeouts = Timeouts()
 
-def main(argv=sys.argv[1:]):
-    parser = argparse.ArgumentParser(description=__doc__)
     dry_run_group = parser.add_mutually_exclusive_group(required=True)
     dry_run_group.add_argument("--dry-run", dest="dry_run", action="store_true",
                                help="Output actions that would otherwise be performed.")
@@ -31,12 +40,157 @@ def main(argv=sys.argv[1:]):
     parser.add_argument("-l", "--log", dest="log_level",
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         default="INFO", help="Set the logging level")
-    parser.add_argument('--serial', action='store_true', default=False,
-                        help='Upload bundles serially. This can be useful for debugging')
-    parser.add_argument('input_json', metavar='INPUT_JSON',
-                        help="Path to the standard JSON format input file")
+    parser.add_argument('--log-format', dest='log_format', choices=['text', 'json'], default='text',
+                        help='Log text, or JSON lines with the IDs of the bundle and file being loaded as fields.')
+    parser.add_argument('--no-log-queue', dest='log_queue', action='store_false', default=True,
+                        help='Write log records from the threads that log them, rather than from a single thread '
+                             'they hand the records to.')
     parser.add_argument('-p', '--project-id', dest='project_id', default='platform-dev-178517',
                         help='Specify the Google project ID for access to GCP requester pays buckets.')
+    parser.add_argument('--content-addressed-staging', dest='content_addressed_staging', action='store_true',
+                        default=False,
+                        help='Stage local files under keys derived from their sha256 checksum, so that content '
+                             'already in the staging bucket, with the checksum tags the DSS requires, is not '
+                             'uploaded again.')
+    parser.add_argument('--connect-timeout', dest='connect_timeout', type=float, default=default_timeouts.connect,
+                        help='Seconds to wait for a connection to S3, GCS or the DSS.')
+    parser.add_argument('--read-timeout', dest='read_timeout', type=float, default=default_timeouts.read,
+                        help='Seconds to wait for a response from S3, GCS or the DSS, or between bytes of it.')
+    parser.add_argument('--async-copy-timeout', dest='async_copy_timeout', type=float,
+                        default=default_timeouts.async_copy,
+                        help='Seconds to wait for the DSS to finish an asynchronous copy of a file.')
+    parser.add_argument('--rate-limit', dest='rate_limits', metavar='SCOPE=RATE', action='append', default=[],
+                        type=rate_limit,
+                        help='Limit the requests to a service to RATE per second. SCOPE is "s3", "gs" or "dss", '
+                             'optionally followed by ":BUCKET" and then "/PREFIX" to limit the requests for the keys '
+                             'of a bucket with that prefix, e.g. "s3:my-bucket/data/=3500", or for the DSS by '
+                             '":OPERATION", i.e. put_file, head_file or put_bundle. The limits are lowered while '
+                             'the service asks for requests to slow down. Can be given more than once.')
+    parser.add_argument('--profile', metavar='PREFIX', nargs='?', const='dssload-profile', default=None,
+                        help='Sample the stacks of all threads during the load, and write them to PREFIX.collapsed '
+                             'for flame graphs, and the wall, CPU and waiting time of each function of '
+                             'loader.base_loader and loader.standard_loader to PREFIX.txt. PREFIX is '
+                             '"dssload-profile" by default.')
+    parser.add_argument('--profile-interval', dest='profile_interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        help='Seconds between samples of the stacks with --profile.')
+    parser.add_argument('--profile-memory-interval', dest='profile_memory_interval', type=float, default=None,
+                        help='With --profile, also trace allocations with tracemalloc, and record the largest '
+                             'allocation sites every this many seconds. Tracing slows down the load.')
+    return dry_run_group
+
+
+def rate_limit(spec: str) -> str:
+    from loader.throttling import RateLimiter
+    try:
+        RateLimiter.parse([spec])
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+
+def get_timeouts(options):
+    from loader.deadlines import Timeouts
+    return Timeouts(connect=options.connect_timeout, read=options.read_timeout,
+                    async_copy=options.async_copy_timeout)
+
+
+def get_rate_limiter(options):
+    from loader.throttling import RateLimiter
+    return RateLimiter.parse(options.rate_limits)
+
+
+def configure_logging(options):
+    import atexit
+    from loader import logs
+    listener = logs.configure_logging(logging.getLevelName(options.log_level),
+                                      json_lines=options.log_format == 'json',
+                                      use_queue=options.log_queue)
+    if listener is not None:
+        atexit.register(listener.stop)
+    suppress_verbose_logging()
+
+
+@contextmanager
+def profiled(options):
+    """Profile the load if --profile was given, writing the profile when it ends"""
+    if options.profile is None:
+        yield
+        return
+    from loader.profiling import Profiler
+    profiler = Profiler(options.profile_interval, options.profile_memory_interval)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        paths = profiler.save(options.profile)
+        logging.info(f'Profile, written to {" and ".join(paths)}:\n{profiler.summary()}')
+
+
+def main(argv=sys.argv[1:]):
+    if argv[:1] == ['local']:
+        return main_local(argv[1:])
+    if argv[:1] == ['metadata']:
+        return main_metadata(argv[1:])
+    from loader.scheduling import INPUT_ORDER, SCHEDULING_POLICIES
+    from loader.shutdown import DEFAULT_GRACE_PERIOD, Checkpoint, GracefulShutdown
+
+    timer = StepTimer(start=_start_time)
+    timer.steps.append(('import loader modules', _import_time))
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     epilog='Run "dssload local --help" for loading bundles of local files, and '
+                                            '"dssload metadata --help" for loading metadata documents in bulk.')
+    dry_run_group = add_common_arguments(parser)
+    dry_run_group.add_argument("--simulate", action="store_true", default=False,
+                               help="Replay the input through the loader against modeled cloud and DSS latencies "
+                                    "and error rates, without accessing either, and report the predicted runtime "
+                                    "and the best number of workers and connections.")
+    parser.add_argument('--serial', action='store_true', default=False,
+                        help='Upload bundles serially. This can be useful for debugging')
+    parser.add_argument('--load-by-value', dest='load_by_value', action='store_true', default=False,
+                        help='Copy the content of data files into the DSS rather than loading them by reference. '
+                             'Files with an S3 URL are copied into the staging bucket server-side, other files '
+                             'are streamed from GCS through this host.')
+    parser.add_argument('--max-workers', dest='max_workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='The number of bundles loaded concurrently.')
+    parser.add_argument('--max-file-workers', dest='max_file_workers', type=int, default=0,
+                        help='The number of data files loaded concurrently, across all bundles. Files of large '
+                             'bundles are then spread over the workers that are idle. By default, each bundle\'s '
+                             'files are loaded one after the other by the bundle\'s worker.')
+    parser.add_argument('--schedule', choices=SCHEDULING_POLICIES, default=INPUT_ORDER,
+                        help='The order in which bundles are loaded: "input" in the order of the input file, '
+                             '"files" the bundles with the most files first, "size" the bundles with the most '
+                             'data first, or "buckets" taking bundles from each source bucket in turn. Starting '
+                             'large bundles first keeps them from holding up the end of a load.')
+    parser.add_argument('--bundle-timeout', dest='bundle_timeout', type=float, default=None,
+                        help='Seconds within which each bundle has to be loaded. Bundles that take longer are '
+                             'abandoned, which frees their worker for the next bundle, and reported as timed out. '
+                             'Unlimited by default.')
+    parser.add_argument('--grace-period', dest='grace_period', type=float, default=DEFAULT_GRACE_PERIOD,
+                        help='Seconds the bundles in flight are given to finish after a SIGINT or SIGTERM, '
+                             'before they are canceled. No more bundles are started after the signal. A second '
+                             'signal cancels them right away.')
+    parser.add_argument('--checkpoint', default=None,
+                        help='A file recording the bundles that were not loaded, e.g. because the load was '
+                             'interrupted, and the DSS copies that were still pending. If it exists, only those '
+                             'bundles of the input are loaded. It is removed once all bundles are loaded.')
+    parser.add_argument('input_json', metavar='INPUT_JSON', nargs='+',
+                        help='Path to a standard JSON format input file, an s3:// or gs:// URL of one, a glob '
+                             'pattern such as "release/*.json", or "@FILE" for a file listing such paths, URLs or '
+                             'patterns, one per line. Inputs ending in .gz or .zst are decompressed as they are '
+                             'read. Reading zstd requires the zstandard package. The bundles of '
+                             'all inputs are loaded together, taking one from each input in turn, and the outcome '
+                             'is reported for each input.')
+    parser.add_argument('--no-precheck', dest='precheck_files', action='store_false', default=True,
+                        help='Do not check which data files are already in the DSS before loading. The check '
+                             'saves staging and copying files that are, but costs a request per file that is not.')
+    parser.add_argument('--previous-manifest', dest='previous_manifest', default=None,
+                        help='A previously loaded input file. Bundles that are unchanged since are not loaded again.')
+    parser.add_argument('--fingerprint-index', dest='fingerprint_index', default=None,
+                        help='A file of fingerprints of the bundles and files loaded. If it exists, and no '
+                             '--previous-manifest is given, bundles that are unchanged since it was written are not '
+                             'loaded again, and unchanged files in changed bundles are reused. It is updated with '
+                             'the bundles loaded by this run.')
     parser.add_argument('--aws-metadata-cred', dest='aws_metadata_cred', default=None,
                         help='The loader by default needs no additional credentials to '
                              'access public AWS references, but when attempting to access '
@@ -51,23 +205,36 @@ def main(argv=sys.argv[1:]):
                              'metadata it may be blocked.  This field supplies a '
                              'path to a file containing additional credentials '
                              'needed to access the referenced files directly.')
+    parser.add_argument('--simulation-model', dest='simulation_model', default=None,
+                        help='A JSON file with the latencies, error rates and capacities to use with --simulate. '
+                             'See loader.simulation.LatencyModel.from_file for the format.')
+    parser.add_argument('--timing', action='store_true', default=False,
+                        help='Report how long each step of starting up the loader took.')
 
-    options = parser.parse_args(argv)
+    with timer.step('parse arguments'):
+        options = parser.parse_args(argv)
 
     # The ACLs on the TOPMed Google buckets are based on user accounts.
     # Clear configured Google credentials, which are likely for service accounts.
     # os.environ.pop('GOOGLE_APPLICATION_CREDENTIALS', None)
     # os.environ.pop('GOOGLE_APPLICATION_SECRETS', None)
 
-    logging.basicConfig(level=logging.getLevelName(options.log_level),
-                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    logging.getLogger(__name__)
-    suppress_verbose_logging()
+    configure_logging(options)
 
-    dss_uploader = base_loader.DssUploader(options.dss_endpoint, options.staging_bucket,
-                                           options.project_id, options.dry_run,
-                                           options.aws_metadata_cred, options.gcp_metadata_cred)
-    metadata_file_uploader = base_loader.MetadataFileUploader(dss_uploader)
+    with timer.step('create uploaders'):
+        if options.simulate:
+            from loader.simulation import LatencyModel, SimulatedDssUploader
+            model = LatencyModel.from_file(options.simulation_model) if options.simulation_model else LatencyModel()
+            dss_uploader = SimulatedDssUploader(model, options.dss_endpoint, options.staging_bucket,
+                                                options.project_id, True)
+        else:
+            dss_uploader = base_loader.DssUploader(options.dss_endpoint, options.staging_bucket,
+                                                   options.project_id, options.dry_run,
+                                                   options.aws_metadata_cred, options.gcp_metadata_cred,
+                                                   options.content_addressed_staging,
+                                                   timeouts=get_timeouts(options),
+                                                   rate_limiter=get_rate_limiter(options))
+        metadata_file_uploader = base_loader.MetadataFileUploader(dss_uploader)
 
     if not sys.warnoptions:
         import warnings
@@ -76,9 +243,142 @@ def main(argv=sys.argv[1:]):
         # See: https://docs.python.org/3/library/warnings.html
         warnings.simplefilter('default', 'CloudUrlAccessWarning', append=True)
 
-    bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader)
+    with timer.step('load input json'):
+        from loader.fingerprints import FingerprintIndex
+        from loader.inputs import read_bundles
+        from loader.manifests import Manifests
+        manifests = Manifests.load(options.input_json)
+        input_json = manifests.interleaved()
+        if len(manifests) > 1:
+            logging.info(f'Loading {len(input_json)} bundles from {len(manifests)} input files')
+        if options.previous_manifest:
+            previous_index = FingerprintIndex.from_manifest(read_bundles(options.previous_manifest))
+        elif options.fingerprint_index and os.path.exists(options.fingerprint_index):
+            previous_index = FingerprintIndex.load(options.fingerprint_index)
+        else:
+            previous_index = None
+    bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader, options.load_by_value,
+                                                   previous_index, options.precheck_files,
+                                                   max_workers=options.max_workers,
+                                                   max_file_workers=options.max_file_workers,
+                                                   schedule=options.schedule,
+                                                   bundle_timeout=options.bundle_timeout,
+                                                   shutdown=GracefulShutdown(options.grace_period))
+    if options.checkpoint:
+        checkpoint = Checkpoint.load(options.checkpoint)
+        if checkpoint is not None:
+            input_json = bundle_uploader.resume(checkpoint, input_json)
+    logging.log(logging.INFO if options.timing else logging.DEBUG, f'Startup timing:\n{timer.report()}')
+    if options.simulate:
+        from loader.simulation import LoadSimulator
+        simulator = LoadSimulator(dss_uploader, bundle_uploader)
+        simulator.record(input_json)
+        logging.info(f'Simulation results:\n{simulator.report()}')
+        return not bundle_uploader.bundles_failed_unparsed and not bundle_uploader.bundles_failed_parsed
     logging.info(f'Uploading {"serially" if options.serial else "concurrently"}')
-    return bundle_uploader.load_all_bundles(load_json_from_file(options.input_json), not options.serial)
+    try:
+        with profiled(options), bundle_uploader.shutdown.signals_handled():
+            success = bundle_uploader.load_all_bundles(input_json, not options.serial)
+        if len(manifests) > 1:
+            manifests.report(input_json, bundle_uploader.bundle_results)
+        return success
+    finally:
+        if options.fingerprint_index and not options.dry_run:
+            bundle_uploader.index.save(options.fingerprint_index)
+        if options.checkpoint and not options.dry_run:
+            bundle_uploader.checkpoint(input_json).save(options.checkpoint)
+
+
+def main_local(argv):
+    """Load bundles of local files"""
+    from loader.local_loader import DEFAULT_MAX_FILE_WORKERS, LocalBundleUploader, find_bundles
+    from loader.staging import DEFAULT_MAX_CONCURRENCY, StagingTransferConfig
+    from loader.standard_loader import DEFAULT_POOL_SIZE
+    from loader.throttling import TransferBudget
+
+    parser = argparse.ArgumentParser(prog='dssload local',
+                                     description='Load the files in a directory tree into the DSS, '
+                                                 'grouped into bundles. See loader/local_loader.py.')
+    add_common_arguments(parser)
+    parser.add_argument('root', metavar='DIRECTORY',
+                        help='The directory containing the files to load')
+    parser.add_argument('--bundle-pattern', dest='bundle_pattern', default=None,
+                        help='A regular expression matched against the path of each file relative to DIRECTORY. '
+                             'Files are grouped into bundles by the group named "bundle", or else the first group, '
+                             'and files that do not match are skipped. By default, the files in each directory '
+                             'form a bundle.')
+    parser.add_argument('--max-workers', dest='max_workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='The number of bundles loaded concurrently.')
+    parser.add_argument('--max-file-workers', dest='max_file_workers', type=int, default=DEFAULT_MAX_FILE_WORKERS,
+                        help='The number of files uploaded concurrently, across all bundles.')
+    parser.add_argument('--part-concurrency', dest='part_concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help='The number of parts of a single file uploaded concurrently.')
+    parser.add_argument('--max-connections', dest='max_connections', type=int, default=DEFAULT_POOL_SIZE,
+                        help='The number of parts uploaded concurrently, across all files.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=0,
+                        help='The smallest part size for multipart uploads, in MiB. Parts are never smaller '
+                             'than the size the DSS uses for S3 ETags, 64 MiB for files of up to 640 GiB. '
+                             'Larger parts change the S3 ETag checksum, so only use them with a DSS that accepts '
+                             'S3 ETags of any part size.')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='The total upload bandwidth to use, in MiB/s. Unlimited by default.')
+    options = parser.parse_args(argv)
+    configure_logging(options)
+
+    mib = 1024 * 1024
+    budget = TransferBudget(max_concurrency=options.max_connections,
+                            bandwidth=options.bandwidth * mib if options.bandwidth else None)
+    transfer_config = StagingTransferConfig(max_concurrency=options.part_concurrency,
+                                            min_chunk_size=options.chunk_size * mib,
+                                            budget=budget)
+    dss_uploader = base_loader.DssUploader(options.dss_endpoint, options.staging_bucket,
+                                           options.project_id, options.dry_run,
+                                           content_addressed_staging=options.content_addressed_staging,
+                                           transfer_config=transfer_config,
+                                           timeouts=get_timeouts(options),
+                                           rate_limiter=get_rate_limiter(options))
+    metadata_file_uploader = base_loader.MetadataFileUploader(dss_uploader)
+    bundles = find_bundles(options.root, options.bundle_pattern)
+    bundle_uploader = LocalBundleUploader(dss_uploader, metadata_file_uploader,
+                                          max_workers=options.max_workers,
+                                          max_file_workers=options.max_file_workers)
+    with profiled(options):
+        return bundle_uploader.load_all_bundles(bundles)
+
+
+def main_metadata(argv):
+    """Load metadata documents in bulk"""
+    from loader.metadata_loader import DEFAULT_MAX_METADATA_WORKERS, DEFAULT_PROGRESS_INTERVAL, MetadataBulkLoader
+    from loader.standard_loader import SCHEMA_URL
+
+    parser = argparse.ArgumentParser(prog='dssload metadata',
+                                     description='Load the JSON metadata documents under bucket prefixes or in '
+                                                 'directories into the DSS as metadata files. See '
+                                                 'loader/metadata_loader.py.')
+    add_common_arguments(parser)
+    parser.add_argument('sources', metavar='SOURCE', nargs='+',
+                        help='An s3:// or gs:// prefix, or a local directory. The documents under it whose names '
+                             'end in .json, .json.gz or .json.zst are loaded.')
+    parser.add_argument('--max-workers', dest='max_workers', type=int, default=DEFAULT_MAX_METADATA_WORKERS,
+                        help='The number of documents fetched and uploaded concurrently.')
+    parser.add_argument('--schema-url', dest='schema_url', default=SCHEMA_URL,
+                        help='The schema of the documents that do not declare theirs as "describedBy".')
+    parser.add_argument('--progress-interval', dest='progress_interval', type=float,
+                        default=DEFAULT_PROGRESS_INTERVAL,
+                        help='Seconds between reports of the progress and throughput.')
+    options = parser.parse_args(argv)
+    configure_logging(options)
+
+    dss_uploader = base_loader.DssUploader(options.dss_endpoint, options.staging_bucket,
+                                           options.project_id, options.dry_run,
+                                           content_addressed_staging=options.content_addressed_staging,
+                                           timeouts=get_timeouts(options),
+                                           rate_limiter=get_rate_limiter(options))
+    metadata_file_uploader = base_loader.MetadataFileUploader(dss_uploader)
+    bulk_loader = MetadataBulkLoader(metadata_file_uploader, max_workers=options.max_workers,
+                                     schema_url=options.schema_url, progress_interval=options.progress_interval)
+    with profiled(options):
+        return bulk_loader.load_all(bulk_loader.list_documents(options.sources))
 
 
 if __name__ == '__main__':
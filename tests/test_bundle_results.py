@@ -0,0 +1,78 @@
+import logging
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.standard_loader import FAILED, LOADED, UNPARSED, StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestBundleResults(unittest.TestCase):
+    """Unittests for iterating over the results of loading bundles. The DSS is mocked."""
+
+    def setUp(self):
+        logging.getLogger('loader').setLevel(logging.CRITICAL)
+        self.input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:5]
+        self.failing_bundle = self.input_json[2]['data_bundle']['id']
+        self.dss_uploader = mock.MagicMock(dry_run=False)
+        self.dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, f'dss-{file_version}', filename, False)
+
+        def _load_bundle(file_info_list, bundle_uuid):
+            if bundle_uuid == self.failing_bundle:
+                raise RuntimeError('DSS unavailable')
+            return f'{bundle_uuid}.v1'
+
+        self.dss_uploader.load_bundle.side_effect = _load_bundle
+        self.metadata_file_uploader = mock.MagicMock()
+        self.metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+
+    def _results(self, bundles, **kwargs):
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       precheck_files=False, max_workers=2)
+        return bundle_uploader, list(bundle_uploader.iter_load_bundles(bundles, **kwargs))
+
+    def test_results(self):
+        for concurrently in (False, True):
+            with self.subTest(concurrently=concurrently):
+                bundles = iter(self.input_json + [dict(data_bundle=dict(id='not a bundle'))])
+                bundle_uploader, results = self._results(bundles, concurrently=concurrently, window=2)
+                by_num = {result.bundle_num: result for result in results}
+                self.assertEqual(sorted(by_num), list(range(6)))
+                self.assertEqual(by_num[5].status, UNPARSED)
+                self.assertEqual(by_num[2].status, FAILED)
+                self.assertIsInstance(by_num[2].error, RuntimeError)
+                for count, bundle in enumerate(self.input_json):
+                    if count == 2:
+                        continue
+                    result = by_num[count]
+                    self.assertTrue(result.ok)
+                    self.assertEqual(result.status, LOADED)
+                    self.assertEqual(result.fqid, f'{bundle["data_bundle"]["id"]}.v1')
+                    self.assertEqual(result.file_versions['m'], 'v')
+                    self.assertEqual(len(result.file_versions), len(bundle['data_objects']) + 1)
+                    self.assertTrue(all(version.startswith('dss-') for file_uuid, version
+                                        in result.file_versions.items() if file_uuid != 'm'))
+                    self.assertGreaterEqual(result.seconds, 0)
+                self.assertEqual(len(bundle_uploader.bundles_loaded), 4)
+
+    def test_input_read_lazily(self):
+        read = []
+
+        def _bundles():
+            for bundle in self.input_json:
+                read.append(bundle)
+                yield bundle
+
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       precheck_files=False)
+        results = bundle_uploader.iter_load_bundles(_bundles(), window=1)
+        self.assertEqual(next(results).bundle_num, 0)
+        self.assertEqual(len(read), 1)
+        results.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
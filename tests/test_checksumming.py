@@ -0,0 +1,79 @@
+import io
+import os
+import tempfile
+import unittest
+
+from dcplib.checksumming_io import ChecksummingBufferedReader
+
+from loader.checksumming import ChecksumCache, ParallelChecksummer
+
+KiB = 1024
+
+
+class TestChecksumming(unittest.TestCase):
+    """Unittests for checksumming.py, checking the checksums against those computed by dcplib."""
+
+    chunk_size = 64 * KiB
+    sizes = [0, 1, chunk_size - 1, chunk_size, chunk_size + 1, 3 * chunk_size, 5 * chunk_size + 123]
+
+    @staticmethod
+    def _dcplib_checksums(data: bytes, chunk_size: int) -> dict:
+        with ChecksummingBufferedReader(io.BytesIO(data), chunk_size) as fh:
+            while fh.read(chunk_size):
+                pass
+            return fh.get_checksums()
+
+    def test_parallel_checksummer_matches_dcplib(self):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                with ParallelChecksummer(self.chunk_size, max_pending_chunks=2) as checksummer:
+                    # Chunks that don't line up with the S3 ETag chunk size
+                    for offset in range(0, size, 7 * KiB + 3):
+                        checksummer.update(data[offset:offset + 7 * KiB + 3])
+                    self.assertEqual(checksummer.get_checksums(), self._dcplib_checksums(data, self.chunk_size))
+
+
+class TestChecksumCache(unittest.TestCase):
+    """Unittests for the checksum cache in checksumming.py."""
+
+    checksums = {'crc32c': '00000000', 'sha1': 'a', 'sha256': 'b', 's3_etag': 'c'}
+
+    def setUp(self):
+        self.cache = ChecksumCache(os.path.join(tempfile.mkdtemp(), 'checksums.sqlite'))
+        fh = tempfile.NamedTemporaryFile()
+        self.addCleanup(fh.close)
+        fh.write(b'content')
+        fh.flush()
+        self.path = fh.name
+
+    def test_hit(self):
+        self.assertIsNone(self.cache.get(self.path))
+        self.cache.put(self.path, os.stat(self.path), self.checksums)
+        self.assertEqual(self.cache.get(self.path), self.checksums)
+        # The cache is shared with other processes through the database
+        self.assertEqual(ChecksumCache(self.cache.path).get(self.path), self.checksums)
+
+    def test_changed_file_misses(self):
+        self.cache.put(self.path, os.stat(self.path), self.checksums)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNone(self.cache.get(self.path))
+
+    def test_other_part_size_misses(self):
+        """The S3 ETag computed for one part size doesn't apply to another"""
+        self.cache.put(self.path, os.stat(self.path), self.checksums, part_size=64 * KiB)
+        self.assertEqual(self.cache.get(self.path, part_size=64 * KiB), self.checksums)
+        self.assertIsNone(self.cache.get(self.path, part_size=128 * KiB))
+        self.assertIsNone(self.cache.get(self.path))
+
+    def test_file_changed_while_checksummed_not_cached(self):
+        stat = os.stat(self.path)
+        with open(self.path, 'ab') as fh:
+            fh.write(b' changed')
+        self.cache.put(self.path, stat, self.checksums)
+        self.assertIsNone(self.cache.get(self.path, stat))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import hashlib
+import io
+import os
+import unittest
+from unittest import mock
+
+from dcplib.checksumming_io import ChecksummingBufferedReader
+
+from loader.checksumming import HASH_FUNCTIONS
+from loader.cloud_copy import checksum_s3_object, checksums_from_tags, copy_s3_object, stream_gs_object
+
+KiB = 1024
+
+
+class FakeBlob:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def download_as_string(self, start: int, end: int) -> bytes:
+        return self.data[start:end + 1]
+
+
+class TestCloudCopy(unittest.TestCase):
+    """Unittests for cloud_copy.py. The S3 client is mocked so no cloud access is needed."""
+
+    chunk_size = 64 * KiB
+
+    def setUp(self):
+        self.s3 = mock.MagicMock()
+        self.s3.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        self.s3.upload_part_copy.side_effect = lambda PartNumber, **kwargs: {'CopyPartResult': {'ETag': PartNumber}}
+        self.parts = {}
+        self.s3.upload_part.side_effect = self._upload_part
+
+    def _upload_part(self, PartNumber, Body, **kwargs):
+        self.parts[PartNumber] = Body
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def _checksums(self, data: bytes) -> dict:
+        with ChecksummingBufferedReader(io.BytesIO(data), self.chunk_size) as fh:
+            while fh.read(self.chunk_size):
+                pass
+            return fh.get_checksums()
+
+    def test_parts_copied_by_range(self):
+        copy_s3_object(self.s3, 'source', 'key', 2 * self.chunk_size + 1, 'staging', 'copy', self.chunk_size,
+                       multipart_threshold=self.chunk_size + 1, source_args=dict(RequestPayer='requester'))
+        ranges = sorted(call[1]['CopySourceRange'] for call in self.s3.upload_part_copy.call_args_list)
+        self.assertEqual(ranges, ['bytes=0-65535', 'bytes=131072-131072', 'bytes=65536-131071'])
+        self.assertTrue(all(call[1]['RequestPayer'] == 'requester' for call in self.s3.upload_part_copy.call_args_list))
+        parts = self.s3.complete_multipart_upload.call_args[1]['MultipartUpload']['Parts']
+        self.assertEqual(parts, [dict(ETag=n, PartNumber=n) for n in (1, 2, 3)])
+
+    def test_small_object_copied_whole(self):
+        copy_s3_object(self.s3, 'source', 'key', self.chunk_size, 'staging', 'copy', self.chunk_size,
+                       multipart_threshold=self.chunk_size + 1)
+        self.s3.copy_object.assert_called_once()
+        self.s3.create_multipart_upload.assert_not_called()
+
+    def test_only_missing_checksums_streamed(self):
+        data = os.urandom(3 * self.chunk_size)
+        self.s3.get_object.return_value = {'Body': io.BytesIO(data)}
+        checksums = checksum_s3_object(self.s3, 'source', 'key', self.chunk_size, ['sha1', 'sha256'])
+        expected = self._checksums(data)
+        self.assertEqual(checksums, dict(sha1=expected['sha1'], sha256=expected['sha256']))
+
+    def test_gs_object_streamed_in_parts(self):
+        data = os.urandom(2 * self.chunk_size + 5)
+        checksums = stream_gs_object(FakeBlob(data), len(data), self.s3, 'staging', 'copy', self.chunk_size,
+                                     multipart_threshold=self.chunk_size + 1, hash_functions=HASH_FUNCTIONS,
+                                     max_concurrency=2)
+        self.assertEqual(checksums, self._checksums(data))
+        self.assertEqual(b''.join(self.parts[n] for n in sorted(self.parts)), data)
+
+    def test_checksums_from_tags(self):
+        tag_set = [dict(Key='hca-dss-sha1', Value='a'), dict(Key='hca-dss-crc32c', Value='b'), dict(Key='x', Value='c')]
+        self.assertEqual(checksums_from_tags(tag_set), dict(sha1='a', crc32c='b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
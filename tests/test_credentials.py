@@ -0,0 +1,80 @@
+import datetime
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from loader.credentials import AssumedRoleCredentialProvider
+
+
+class TestAssumedRoleCredentialProvider(unittest.TestCase):
+    """Unittests for credentials.py. The STS client is mocked so no AWS access is needed."""
+
+    def setUp(self):
+        self.assume_role_calls = 0
+        self.cache_dir = tempfile.mkdtemp()
+        patcher = mock.patch('loader.credentials.boto3.client')
+        self.addCleanup(patcher.stop)
+        patcher.start().return_value.assume_role.side_effect = self._assume_role
+
+    def _assume_role(self, **kwargs):
+        self.assume_role_calls += 1
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=kwargs['DurationSeconds'])
+        return {'Credentials': {'AccessKeyId': f'key-{self.assume_role_calls}',
+                                'SecretAccessKey': 'secret',
+                                'SessionToken': f'token-{self.assume_role_calls}',
+                                'Expiration': expiration}}
+
+    def _provider(self, duration=3600):
+        return AssumedRoleCredentialProvider('arn:aws:iam::123456789012:role/test', 'test', duration, self.cache_dir)
+
+    def test_concurrent_refreshes_assume_role_once(self):
+        provider = self._provider()
+        self.assertEqual(provider.credentials.get_frozen_credentials().access_key, 'key-1')
+        threads = [threading.Thread(target=provider.refresh, kwargs=dict(min_age=0.5)) for _ in range(10)]
+        provider.refreshed_at -= 1
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.assume_role_calls, 2)
+        self.assertEqual(provider.credentials.get_frozen_credentials().access_key, 'key-2')
+
+    def test_credentials_shared_between_processes(self):
+        """A second provider (as in another process) reuses the cached credentials."""
+        self._provider().credentials.get_frozen_credentials()
+        self.assertEqual(self._provider().credentials.get_frozen_credentials().token, 'token-1')
+        self.assertEqual(self.assume_role_calls, 1)
+
+    def test_credentials_cached_per_duration(self):
+        self._provider().credentials.get_frozen_credentials()
+        self.assertEqual(self._provider(duration=7200).credentials.get_frozen_credentials().token, 'token-2')
+        self.assertEqual(self.assume_role_calls, 2)
+
+    def test_client_signs_with_refreshed_credentials(self):
+        provider = self._provider()
+        client = provider.client('s3', region_name='us-east-1')
+        url = client.generate_presigned_url('get_object', Params=dict(Bucket='bucket', Key='key'))
+        self.assertIn('AWSAccessKeyId=key-1', url)
+        provider.refreshed_at -= 60
+        provider.refresh()
+        # The client created before the refresh signs with the new credentials
+        url = client.generate_presigned_url('get_object', Params=dict(Bucket='bucket', Key='key'))
+        self.assertIn('AWSAccessKeyId=key-2', url)
+
+    def test_rejected_credentials_are_not_reused_from_cache(self):
+        provider = self._provider()
+        provider.credentials.get_frozen_credentials()
+        provider.refreshed_at -= 60
+        provider.refresh()
+        self.assertEqual(provider.credentials.get_frozen_credentials().token, 'token-2')
+
+    def test_expiring_credentials_are_refreshed(self):
+        provider = self._provider(duration=900)
+        # 900 seconds is within the advisory refresh window, so every access triggers a refresh
+        provider.credentials.get_frozen_credentials()
+        self.assertGreater(self.assume_role_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
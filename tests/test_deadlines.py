@@ -0,0 +1,137 @@
+import concurrent.futures
+import logging
+import threading
+import time
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+from loader.deadlines import (NO_DEADLINE, Deadline, DeadlineExceeded, Timeouts, current_deadline, deadline_scope,
+                              with_current_deadline)
+from loader.base_loader import _by_reference_key
+from loader.dss_api import DssApi
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file, single_flight
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestDeadlines(unittest.TestCase):
+    """Unittests for per-call timeouts and per-bundle deadlines."""
+
+    def test_deadline(self):
+        deadline = Deadline(0.05, 'Test')
+        self.assertFalse(deadline.expired)
+        self.assertLessEqual(deadline.timeout(60), 0.05)
+        deadline.check()
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            deadline.sleep(10)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.timeout(60)
+
+    def test_unlimited_and_canceled(self):
+        deadline = Deadline()
+        self.assertIsNone(deadline.remaining())
+        self.assertEqual(deadline.timeout(60), 60)
+        threading.Timer(0.05, deadline.cancel).start()
+        with self.assertRaisesRegex(DeadlineExceeded, 'canceled'):
+            deadline.sleep(10)
+
+    def test_scope(self):
+        self.assertIs(current_deadline(), NO_DEADLINE)
+        deadline = Deadline(60)
+        with deadline_scope(deadline):
+            self.assertIs(current_deadline(), deadline)
+            task = with_current_deadline(current_deadline)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertIs(executor.submit(current_deadline).result(), NO_DEADLINE)
+                self.assertIs(executor.submit(task).result(), deadline)
+        self.assertIs(current_deadline(), NO_DEADLINE)
+
+    def test_dss_request_timeout(self):
+        api = DssApi(dict(schemes=['https'], host='dss.example.org', basePath='/v1', paths={}), mock.MagicMock())
+        api.timeouts = Timeouts(connect=5, read=30)
+        self.assertEqual(api._timeout(), (5, 30))
+        with deadline_scope(Deadline(10)):
+            connect, read = api._timeout()
+            self.assertEqual(connect, 5)
+            self.assertLessEqual(read, 10)
+
+    def test_bundle_timed_out(self):
+        logging.getLogger('loader').setLevel(logging.CRITICAL)
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:3]
+        hung_bundle = input_json[1]['data_bundle']['id']
+        dss_uploader = mock.MagicMock(dry_run=False)
+
+        def _upload(filename, file_uuid, *args, file_version):
+            if any(file_uuid in file_guid for file_guid in input_json[1]['data_objects']):
+                # Like waiting for an asynchronous copy that never finishes
+                current_deadline().sleep(60)
+            return file_uuid, file_version, filename, False
+
+        dss_uploader.upload_cloud_file_by_reference.side_effect = _upload
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader, precheck_files=False,
+                                                       bundle_timeout=0.1)
+        start = time.monotonic()
+        self.assertFalse(bundle_uploader.load_all_bundles(input_json, concurrently=True))
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual([bundle.bundle_uuid for bundle in bundle_uploader.bundles_timed_out], [hung_bundle])
+        self.assertEqual(len(bundle_uploader.bundles_loaded), 2)
+        self.assertEqual(bundle_uploader.bundles_failed_parsed, [])
+        self.assertNotIn(hung_bundle, [call[0][1] for call in dss_uploader.load_bundle.call_args_list])
+
+    def test_shared_file(self):
+        """Bundles sharing a data file each get it within their own deadline"""
+        class Uploader:
+            def __init__(self):
+                # Each of these uploaders loads to a DSS of its own, so they don't share files
+                self.dss_endpoint = str(uuid.uuid4())
+                self.calls = []
+
+            @single_flight(_by_reference_key, private_errors=(DeadlineExceeded,), deadline_func=current_deadline)
+            def upload_cloud_file_by_reference(self, filename, file_uuid, file_cloud_urls, size, guid,
+                                               file_version=None):
+                self.calls.append(current_deadline().seconds)
+                current_deadline().sleep(0.5)
+                return file_uuid, file_version, filename, False
+
+        def load_bundle(uploader, seconds, delay, filename='a.bam'):
+            time.sleep(delay)
+            with deadline_scope(Deadline(seconds, f'Bundle with {seconds}s')):
+                try:
+                    return uploader.upload_cloud_file_by_reference(filename, 'f', {'s3://b/a.bam'}, 1, 'g', 'v')
+                except DeadlineExceeded as e:
+                    return e
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            # The bundle that started the upload runs out of time, the other one takes over
+            uploader = Uploader()
+            short = executor.submit(load_bundle, uploader, 0.2, 0)
+            long = executor.submit(load_bundle, uploader, 100, 0.05)
+            self.assertRegex(str(short.result()), 'Bundle with 0.2s did not finish')
+            self.assertEqual(long.result(), ('f', 'v', 'a.bam', False))
+            self.assertEqual(uploader.calls, [0.2, 100])
+
+            # A waiting bundle gives up at its own deadline, without failing the upload
+            uploader = Uploader()
+            long = executor.submit(load_bundle, uploader, 100, 0)
+            short = executor.submit(load_bundle, uploader, 0.2, 0.05)
+            start = time.monotonic()
+            self.assertIsInstance(short.result(), DeadlineExceeded)
+            self.assertLess(time.monotonic() - start, 0.45)
+            self.assertEqual(long.result(), ('f', 'v', 'a.bam', False))
+            self.assertEqual(uploader.calls, [100])
+
+            # Under another name, the file info is the caller's
+            self.assertEqual(load_bundle(uploader, 100, 0, 'b.bam'), ('f', 'v', 'b.bam', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
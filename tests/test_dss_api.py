@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from loader.dss_api import DssApi, DssFileCache, InvalidSwaggerSpec, SwaggerSpecCache
+
+SWAGGER_URL = 'https://dss.example.org/v1/swagger.json'
+
+SPEC = {'swagger': '2.0',
+        'schemes': ['https'],
+        'host': 'dss.example.org',
+        'basePath': '/v1',
+        'paths': {'/files/{uuid}': {'put': {'security': [{'dcpAuth': []}]}, 'head': {}},
+                  '/bundles/{uuid}': {'put': {}}}}
+
+
+def _response(status_code, content=b'', headers=None):
+    response = mock.MagicMock(status_code=status_code, content=content, headers=headers or {})
+    response.json.side_effect = lambda: json.loads(content)
+    return response
+
+
+class TestSwaggerSpecCache(unittest.TestCase):
+    """Unittests for the swagger spec cache in dss_api.py."""
+
+    def setUp(self):
+        self.cache = SwaggerSpecCache(tempfile.mkdtemp(), revalidate_after=3600)
+        patcher = mock.patch('loader.dss_api.requests.get')
+        self.addCleanup(patcher.stop)
+        self.get = patcher.start()
+        self.get.return_value = _response(200, json.dumps(SPEC).encode(), {'ETag': '"v1"'})
+
+    def test_spec_fetched_once(self):
+        spec_path = self.cache.get(SWAGGER_URL)
+        self.assertEqual(self.cache.get(SWAGGER_URL), spec_path)
+        self.assertEqual(self.get.call_count, 1)
+        with open(spec_path) as fh:
+            self.assertEqual(json.load(fh), SPEC)
+
+    def test_stale_spec_revalidated_with_etag(self):
+        spec_path = self.cache.get(SWAGGER_URL)
+        self.cache.revalidate_after = 0
+        self.get.return_value = _response(304)
+        self.assertEqual(self.cache.get(SWAGGER_URL), spec_path)
+        self.assertEqual(self.get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+
+    def test_changed_spec_stored_under_new_etag(self):
+        spec_path = self.cache.get(SWAGGER_URL)
+        self.cache.revalidate_after = 0
+        self.get.return_value = _response(200, json.dumps(dict(SPEC, basePath='/v2')).encode(), {'ETag': '"v2"'})
+        new_spec_path = self.cache.get(SWAGGER_URL)
+        self.assertNotEqual(new_spec_path, spec_path)
+        self.assertTrue(os.path.exists(new_spec_path))
+
+    def test_invalid_spec_rejected(self):
+        for content in (b'<html>Service Unavailable</html>', b'{"error": "not found"}', b'"swagger"'):
+            with self.subTest(content=content):
+                self.get.return_value = _response(200, content)
+                with self.assertRaisesRegex(InvalidSwaggerSpec, SWAGGER_URL):
+                    self.cache.get(SWAGGER_URL)
+        # Nothing but the lock is left in the cache
+        self.assertEqual([name for name in os.listdir(self.cache.cache_dir) if not name.endswith('.lock')], [])
+
+
+class TestDssApi(unittest.TestCase):
+    """Unittests for the prebuilt DSS requests in dss_api.py."""
+
+    def setUp(self):
+        self.dss_client = mock.MagicMock()
+        self.api = DssApi(SPEC, lambda: self.dss_client)
+        self.api._session = mock.MagicMock()
+        self.api._session.request.return_value = _response(201, b'{"version": "v"}')
+        patcher = mock.patch.object(DssApi, '_dss_client_class')
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_put_file_is_authenticated(self):
+        session = self.dss_client.get_authenticated_session.return_value
+        session.request.return_value = _response(201, b'{"version": "v"}')
+        self.api.put_file(uuid='u', version='v', creator_uid=20, source_url='s3://b/k')
+        session.request.assert_called_once_with('PUT', 'https://dss.example.org/v1/files/u', params=dict(version='v'),
+                                                json=dict(creator_uid=20, source_url='s3://b/k'), timeout=mock.ANY)
+        self.api._session.request.assert_not_called()
+
+    def test_scheme_from_spec(self):
+        api = DssApi(dict(SPEC, schemes=['http'], host='localhost:5000'), lambda: self.dss_client)
+        self.assertEqual(api.host, 'http://localhost:5000/v1')
+
+    def test_head_file_omits_missing_parameters(self):
+        self.api.head_file(uuid='u', replica='aws')
+        self.api._session.request.assert_called_once_with('HEAD', 'https://dss.example.org/v1/files/u',
+                                                          params=dict(replica='aws'), json=None, timeout=mock.ANY)
+
+    def test_file_version(self):
+        self.api._session.request.return_value = _response(200, headers={'X-DSS-VERSION': '2018-10-24T000000.000000Z'})
+        self.assertEqual(self.api.file_version(uuid='u', replica='aws', version='2018-10-24T00:00:00Z'),
+                         '2018-10-24T000000.000000Z')
+        self.api._session.request.return_value = _response(404)
+        self.assertIsNone(self.api.file_version(uuid='u', replica='aws', version='2018-10-24T00:00:00Z'))
+
+
+class TestDssFileCache(unittest.TestCase):
+    """Unittests for the cache of files known to be in the DSS in dss_api.py."""
+
+    def test_cache_per_endpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), 'dss_files.sqlite')
+        cache = DssFileCache('https://dss.example.org/v1', path)
+        self.assertIsNone(cache.get('u', 'v'))
+        cache.put('u', 'v', 'dss-v')
+        self.assertEqual(DssFileCache('https://dss.example.org/v1', path).get('u', 'v'), 'dss-v')
+        self.assertIsNone(DssFileCache('https://other-dss.example.org/v1', path).get('u', 'v'))
+
+
+if __name__ == '__main__':
+    unittest.main()
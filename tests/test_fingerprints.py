@@ -0,0 +1,61 @@
+import copy
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.fingerprints import FingerprintIndex
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestIncrementalLoad(unittest.TestCase):
+    """Unittests for loading only the bundles and files changed since a previous load. The DSS is mocked."""
+
+    def setUp(self):
+        logging.getLogger('loader').setLevel(logging.WARNING)
+        self.input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:5]
+
+    def _load(self, input_json, previous_index=None):
+        dss_uploader = mock.MagicMock()
+        dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, f'dss-{file_version}', filename, False)
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader,
+                                                       previous_index=previous_index)
+        self.assertTrue(bundle_uploader.load_all_bundles(input_json))
+        return bundle_uploader, dss_uploader
+
+    def test_only_changed_bundles_loaded(self):
+        first, _ = self._load(self.input_json)
+        index_path = os.path.join(tempfile.mkdtemp(), 'index.json')
+        first.index.save(index_path)
+
+        changed_json = copy.deepcopy(self.input_json)
+        bundle = changed_json[2]
+        file_guids = list(bundle['data_objects'])
+        bundle['data_objects'][file_guids[0]]['size'] = str(int(bundle['data_objects'][file_guids[0]]['size']) + 1)
+
+        second, dss_uploader = self._load(changed_json, FingerprintIndex.load(index_path))
+        self.assertEqual(len(second.bundles_unchanged), 4)
+        self.assertEqual(len(second.bundles_loaded), 1)
+        # Only the changed file is uploaded, the others reuse the DSS versions of the previous load
+        self.assertEqual(dss_uploader.upload_cloud_file_by_reference.call_count, 1)
+        files = dss_uploader.load_bundle.call_args[0][0]
+        self.assertEqual(len(files), len(file_guids) + 1)
+        self.assertTrue(all(file['version'].startswith('dss-') for file in files[1:]))
+        # The new index covers every bundle, so a third load has nothing to do
+        self.assertEqual(set(second.index.bundles), set(first.index.bundles))
+
+    def test_index_from_previous_manifest(self):
+        _, dss_uploader = self._load(self.input_json, FingerprintIndex.from_manifest(self.input_json))
+        dss_uploader.load_bundle.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
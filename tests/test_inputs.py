@@ -0,0 +1,91 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader import inputs
+from loader.inputs import iter_bundles, iter_json_array, read_bundles
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestInputs(unittest.TestCase):
+    """Unittests for streaming input manifests from files and buckets."""
+
+    def setUp(self):
+        self.input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:10]
+        self.content = json.dumps(self.input_json, indent=2).encode('utf-8')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path
+
+    def test_json_array(self):
+        for text in ('[]', ' [ 1 , 12345, "a,]b", {"x": [1, 2]}, null, true ] ', json.dumps(self.input_json)):
+            with self.subTest(text=text[:20]):
+                # Elements are split across reads
+                with mock.patch.object(inputs, 'READ_SIZE', 3):
+                    self.assertEqual(list(iter_json_array(io.StringIO(text))), json.loads(text))
+        for text in ('{"a": 1}', '[1 2]', '[1, '):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(io.StringIO(text)))
+
+    def test_local_files(self):
+        self.assertEqual(read_bundles(self._write('input.json', self.content)), self.input_json)
+        # Concatenated gzip members, as written by e.g. pigz
+        half = len(self.content) // 2
+        path = self._write('input.json.gz', gzip.compress(self.content[:half]) + gzip.compress(self.content[half:]))
+        self.assertEqual(read_bundles(path), self.input_json)
+        with self.assertRaises(FileNotFoundError):
+            read_bundles(os.path.join(self.tmp_dir.name, 'missing.json'))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        path = self._write('input.json.zst', zstandard.ZstdCompressor().compress(self.content))
+        self.assertEqual(read_bundles(path), self.input_json)
+
+    def test_buckets(self):
+        s3_client = mock.MagicMock()
+        s3_client.get_object.return_value = dict(Body=io.BytesIO(gzip.compress(self.content)))
+        self.assertEqual(read_bundles('s3://bucket/input.json.gz', s3_client=s3_client), self.input_json)
+        s3_client.get_object.assert_called_once_with(Bucket='bucket', Key='input.json.gz')
+
+        def download_to_file(fh):
+            for start in range(0, len(self.content), 100):
+                fh.write(self.content[start:start + 100])
+
+        gs_client = mock.MagicMock()
+        gs_client.bucket.return_value.blob.return_value.download_to_file.side_effect = download_to_file
+        self.assertEqual(read_bundles('gs://bucket/input.json', gs_client=gs_client), self.input_json)
+        gs_client.bucket.assert_called_once_with('bucket')
+
+    def test_stop_reading(self):
+        path = self._write('input.json', self.content)
+        with mock.patch.object(inputs, 'READ_SIZE', 10), mock.patch.object(inputs, 'PREFETCH_CHUNKS', 1):
+            bundles = iter_bundles(path)
+            self.assertEqual(next(bundles), self.input_json[0])
+            # Closing the input stops the thread reading it
+            bundles.close()
+        for reader in [thread for thread in threading.enumerate() if thread.name == f'read {path}']:
+            reader.join(timeout=5)
+            self.assertFalse(reader.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+from loader.local_loader import LocalBundleUploader, find_bundles
+
+
+class TestLocalLoader(unittest.TestCase):
+    """Unittests for local_loader.py. The DSS uploader is mocked so no cloud or DSS access is needed."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.bundle_uuid = str(uuid.uuid4())
+        for path in ['run1/a.bam', 'run1/a.bai', 'run2/b.bam', 'run2/nested/b.cram']:
+            self._write(path, path)
+        self._write('run1/bundle.json', json.dumps(dict(uuid=self.bundle_uuid, user_metadata=dict(sample='a'))))
+
+    def _write(self, relative_path, content):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def test_bundles_by_directory(self):
+        bundles = {bundle.name: bundle for bundle in find_bundles(self.root)}
+        self.assertEqual(set(bundles), {'run1', 'run2', os.path.join('run2', 'nested')})
+        self.assertEqual(bundles['run1'].bundle_uuid, self.bundle_uuid)
+        self.assertEqual(bundles['run1'].metadata_dict, dict(sample='a'))
+        self.assertEqual([os.path.basename(path) for path in bundles['run1'].paths], ['a.bai', 'a.bam'])
+        self.assertIsNone(bundles['run2'].metadata_dict)
+        # Bundle UUIDs that aren't given are stable
+        self.assertEqual(bundles['run2'].bundle_uuid,
+                         {bundle.name: bundle for bundle in find_bundles(self.root)}['run2'].bundle_uuid)
+
+    def test_bundles_by_pattern(self):
+        bundles = find_bundles(self.root, pattern=r'/(?P<bundle>[ab])\.(bam|cram)$')
+        self.assertEqual({bundle.name: len(bundle.paths) for bundle in bundles}, {'a': 1, 'b': 2})
+
+    def test_load_all_bundles(self):
+        dss_uploader = mock.MagicMock()
+        dss_uploader.upload_local_file.side_effect = lambda path, file_uuid, file_version: \
+            (file_uuid, file_version, os.path.basename(path), False)
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+        uploader = LocalBundleUploader(dss_uploader, metadata_file_uploader, max_workers=2, max_file_workers=2)
+        self.assertTrue(uploader.load_all_bundles(find_bundles(self.root)))
+        self.assertEqual(dss_uploader.upload_local_file.call_count, 4)
+        self.assertEqual(metadata_file_uploader.load_dict.call_count, 1)
+        files_by_bundle = {call[0][1]: call[0][0] for call in dss_uploader.load_bundle.call_args_list}
+        self.assertEqual([file['name'] for file in files_by_bundle[self.bundle_uuid]],
+                         ['metadata.json', 'a.bai', 'a.bam'])
+
+    def test_failed_file_fails_bundle(self):
+        dss_uploader = mock.MagicMock()
+        dss_uploader.upload_local_file.side_effect = RuntimeError('upload failed')
+        uploader = LocalBundleUploader(dss_uploader, mock.MagicMock())
+        self.assertFalse(uploader.load_all_bundles(find_bundles(self.root)))
+        self.assertEqual(len(uploader.bundles_failed), 3)
+        dss_uploader.load_bundle.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
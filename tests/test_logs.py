@@ -0,0 +1,68 @@
+import io
+import json
+import logging
+import threading
+import unittest
+
+from loader.logs import configure_logging, lazy, log_context
+
+
+class TestLogs(unittest.TestCase):
+    """Unittests for queue-based, structured logging."""
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved_handlers, self.saved_level = list(root.handlers), root.level
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in self.saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(self.saved_level)
+
+    def test_json_lines_with_context(self):
+        stream = io.StringIO()
+        listener = configure_logging(logging.INFO, json_lines=True, stream=stream)
+        logger = logging.getLogger('test_logs')
+        formatted = []
+
+        def _expensive():
+            formatted.append(True)
+            return 'details'
+
+        def _work():
+            with log_context(bundle_uuid='b', bundle_num=3):
+                with log_context(file_uuid='f'):
+                    logger.info('Uploading %s', 'file.bam')
+                logger.debug('Bundle details: %s', lazy(_expensive))
+                try:
+                    raise ValueError('failed')
+                except ValueError:
+                    logger.exception('Bundle %s: Error loading', 3)
+
+        thread = threading.Thread(target=_work)
+        thread.start()
+        thread.join()
+        logger.info('Done')
+        listener.stop()
+
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([entry['message'] for entry in entries],
+                         ['Uploading file.bam', 'Bundle 3: Error loading', 'Done'])
+        self.assertEqual((entries[0]['bundle_uuid'], entries[0]['bundle_num'], entries[0]['file_uuid']), ('b', 3, 'f'))
+        self.assertNotIn('file_uuid', entries[1])
+        self.assertIn('ValueError: failed', entries[1]['exception'])
+        self.assertNotIn('bundle_uuid', entries[2])
+        self.assertEqual(formatted, [])
+
+    def test_text_without_queue(self):
+        stream = io.StringIO()
+        self.assertIsNone(configure_logging(logging.DEBUG, use_queue=False, stream=stream))
+        logging.getLogger('test_logs').debug('Bundle details: %s', lazy(str.upper, 'details'))
+        self.assertIn('test_logs - DEBUG - Bundle details: DETAILS', stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
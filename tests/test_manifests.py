@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.manifests import Manifests, expand_inputs
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestManifests(unittest.TestCase):
+    """Unittests for loading several input manifests in one run. The DSS is mocked."""
+
+    def setUp(self):
+        logging.getLogger('loader').setLevel(logging.CRITICAL)
+        self.input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:5]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        os.mkdir(os.path.join(self.tmp_dir.name, 'release'))
+        # Three bundles in a.json, two in b.json
+        for name, bundles in (('a', self.input_json[:3]), ('b', self.input_json[3:])):
+            with open(self._path('release', f'{name}.json'), 'w') as fh:
+                json.dump(bundles, fh)
+
+    def _path(self, *names):
+        return os.path.join(self.tmp_dir.name, *names)
+
+    def test_expand_inputs(self):
+        a, b = self._path('release', 'a.json'), self._path('release', 'b.json')
+        self.assertEqual(expand_inputs([self._path('release', '*.json')]), [a, b])
+        with open(self._path('inputs.txt'), 'w') as fh:
+            fh.write('# The release\n\nrelease/b.json\nrelease/*.json\n')
+        self.assertEqual(expand_inputs(['@' + self._path('inputs.txt'), a]), [b, a])
+        with self.assertRaises(FileNotFoundError):
+            expand_inputs([self._path('other', '*.json')])
+
+    def test_load_manifests(self):
+        manifests = Manifests.load([self._path('release', '*.json')])
+        self.assertEqual(len(manifests), 2)
+        input_json = manifests.interleaved()
+        bundle_uuids = [bundle['data_bundle']['id'] for bundle in input_json]
+        self.assertEqual(bundle_uuids, [self.input_json[i]['data_bundle']['id'] for i in (0, 3, 1, 4, 2)])
+
+        failing_bundle = self.input_json[1]['data_bundle']['id']
+        dss_uploader = mock.MagicMock(dry_run=False)
+        dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, file_version, filename, False)
+
+        def _load_bundle(file_info_list, bundle_uuid):
+            if bundle_uuid == failing_bundle:
+                raise RuntimeError('DSS unavailable')
+            return f'{bundle_uuid}.v'
+
+        dss_uploader.load_bundle.side_effect = _load_bundle
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader, precheck_files=False)
+        self.assertFalse(bundle_uploader.load_all_bundles(input_json, concurrently=True))
+        success = manifests.report(input_json, bundle_uploader.bundle_results)
+        self.assertEqual(success, {self._path('release', 'a.json'): False, self._path('release', 'b.json'): True})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from loader.metadata_loader import MetadataBulkLoader, list_documents
+
+
+class TestMetadataLoader(unittest.TestCase):
+    """Unittests for loading metadata documents in bulk. The DSS is mocked."""
+
+    def setUp(self):
+        logging.getLogger('loader').setLevel(logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = self.tmp_dir.name
+        os.makedirs(os.path.join(self.root, 'b'))
+        for i in range(20):
+            with open(os.path.join(self.root, f'{i:02}.json'), 'w') as fh:
+                json.dump(dict(id=i), fh)
+        with open(os.path.join(self.root, 'b', 'described.json.gz'), 'wb') as fh:
+            fh.write(gzip.compress(json.dumps(dict(id=20, describedBy='https://schema')).encode('utf-8')))
+        with open(os.path.join(self.root, 'b', 'broken.json'), 'w') as fh:
+            fh.write('{')
+        with open(os.path.join(self.root, 'b', 'notes.txt'), 'w') as fh:
+            fh.write('not metadata')
+
+    def test_list_documents(self):
+        documents = [os.path.relpath(path, self.root) for path in list_documents(self.root)]
+        self.assertEqual(documents, [f'{i:02}.json' for i in range(20)] + ['b/broken.json', 'b/described.json.gz'])
+
+        s3_client = mock.MagicMock()
+        s3_client.get_paginator.return_value.paginate.return_value = [
+            dict(Contents=[dict(Key='prefix/a.json'), dict(Key='prefix/readme.md')]),
+            dict(Contents=[dict(Key='prefix/b.json.zst')]),
+            dict()
+        ]
+        self.assertEqual(list(list_documents('s3://bucket/prefix/', s3_client=s3_client)),
+                         ['s3://bucket/prefix/a.json', 's3://bucket/prefix/b.json.zst'])
+        s3_client.get_paginator.return_value.paginate.assert_called_once_with(Bucket='bucket', Prefix='prefix/')
+
+    def test_load_all(self):
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.side_effect = \
+            lambda metadata, filename, schema_url: (str(metadata['id']), 'v', filename, False)
+        bulk_loader = MetadataBulkLoader(metadata_file_uploader, max_workers=4)
+        self.assertFalse(bulk_loader.load_all(bulk_loader.list_documents([self.root])))
+
+        self.assertEqual([os.path.basename(result.source) for result in bulk_loader.documents_failed], ['broken.json'])
+        self.assertEqual(metadata_file_uploader.load_dict.call_count, 21)
+        calls = {call[0][1]: call[0] for call in metadata_file_uploader.load_dict.call_args_list}
+        self.assertEqual(calls['described.json'], (dict(id=20, describedBy='https://schema'), 'described.json',
+                                                   'https://schema'))
+        self.assertEqual(bulk_loader.throughput.documents, 22)
+        self.assertEqual(bulk_loader.throughput.failed, 1)
+        self.assertGreater(bulk_loader.throughput.bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
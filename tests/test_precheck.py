@@ -0,0 +1,37 @@
+import logging
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestPrecheck(unittest.TestCase):
+    """Unittests for skipping data files that are already in the DSS. The DSS is mocked."""
+
+    def test_files_in_dss_not_uploaded(self):
+        logging.getLogger('loader').setLevel(logging.WARNING)
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:3]
+        present = {file_guid for file_guid in input_json[0]['data_objects']}
+        dss_uploader = mock.MagicMock(dry_run=False)
+        dss_uploader.get_dss_file_version.side_effect = lambda file_uuid, file_version: \
+            f'dss-{file_version}' if any(file_uuid in guid for guid in present) else None
+        dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, file_version, filename, False)
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader)
+        self.assertTrue(bundle_uploader.load_all_bundles(input_json))
+        files = sum(len(bundle['data_objects']) for bundle in input_json)
+        self.assertEqual(dss_uploader.get_dss_file_version.call_count, files)
+        self.assertEqual(dss_uploader.upload_cloud_file_by_reference.call_count, files - len(present))
+        loaded_versions = [file['version'] for call in dss_uploader.load_bundle.call_args_list for file in call[0][0]]
+        self.assertEqual(len([version for version in loaded_versions if version.startswith('dss-')]), len(present))
+
+
+if __name__ == '__main__':
+    unittest.main()
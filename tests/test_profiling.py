@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from loader.profiling import Profiler
+
+
+def _spin(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _block(stop: threading.Event):
+    stop.wait()
+
+
+def _load(stop: threading.Event):
+    _spin(stop)
+
+
+class TestProfiling(unittest.TestCase):
+    """Unittests for the sampling profiler, grouping by the functions of this module."""
+
+    def test_profile(self):
+        stop = threading.Event()
+        threads = [threading.Thread(target=_load, args=(stop,), name='spinner_1'),
+                   threading.Thread(target=_block, args=(stop,), name='blocker_1')]
+        with Profiler(interval=0.002, memory_interval=0.05, modules=[__name__]) as profiler:
+            for thread in threads:
+                thread.start()
+            time.sleep(0.3)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertGreater(profiler.samples, 10)
+        stage_times = {stage_time.function: stage_time for stage_time in profiler.stage_times()}
+        spin, block, load = (stage_times[f'{__name__}.{name}'] for name in ('_spin', '_block', '_load'))
+        self.assertGreater(spin.wall, 0.1)
+        self.assertEqual(spin.waiting, 0.0)
+        # The time in _spin is included in that of its caller, but not attributed to it
+        self.assertEqual(load.wall, 0.0)
+        self.assertGreaterEqual(load.inclusive, spin.wall)
+        self.assertGreater(block.waiting, 0.1)
+        if spin.cpu is not None:
+            self.assertGreater(spin.cpu, block.cpu)
+
+        collapsed = list(profiler.collapsed())
+        self.assertTrue(any(line.startswith('spinner;threading.') and f'{__name__}._load;{__name__}._spin ' in line
+                            for line in collapsed))
+        for line in collapsed:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        self.assertIn(f'{__name__}._block', profiler.summary())
+        self.assertGreaterEqual(len(profiler.memory_reports), 2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = profiler.save(os.path.join(tmp_dir, 'profile'))
+            self.assertEqual([os.path.basename(path) for path in paths], ['profile.collapsed', 'profile.txt'])
+            with open(paths[1]) as fh:
+                self.assertIn('tracemalloc', fh.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading
+import unittest
+from unittest import mock
+
+import botocore
+
+from loader.s3_clients import S3ClientRouter
+
+
+class TestS3ClientRouter(unittest.TestCase):
+    """Unittests for s3_clients.py. The S3 clients are mocked so no AWS access is needed."""
+
+    regions = {'west-bucket': 'us-west-2', 'east-bucket': 'us-east-1'}
+
+    def setUp(self):
+        self.created_regions = []
+        patcher = mock.patch('loader.s3_clients.boto3.client', side_effect=self._create_client)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def _create_client(self, service_name, config):
+        self.created_regions.append(config.region_name)
+        client = mock.MagicMock()
+        client.meta.region_name = config.region_name
+        client.head_bucket.side_effect = self._head_bucket
+        client.get_bucket_request_payment.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'GetBucketRequestPayment')
+        return client
+
+    def _head_bucket(self, Bucket):
+        headers = {'x-amz-bucket-region': self.regions[Bucket]}
+        if Bucket == 'west-bucket':
+            raise botocore.exceptions.ClientError({'Error': {'Code': '403'},
+                                                   'ResponseMetadata': {'HTTPHeaders': headers}}, 'HeadBucket')
+        return {'ResponseMetadata': {'HTTPHeaders': headers}}
+
+    def test_region_discovered_even_when_forbidden(self):
+        router = S3ClientRouter()
+        self.assertEqual(router.bucket_info('west-bucket').region, 'us-west-2')
+        self.assertEqual(router.client('west-bucket').meta.region_name, 'us-west-2')
+        self.assertEqual(router.request_payer_args('west-bucket'), dict(RequestPayer='requester'))
+
+    def test_buckets_discovered_once_and_clients_pooled_per_region(self):
+        router = S3ClientRouter()
+        threads = [threading.Thread(target=router.client, args=(bucket,))
+                   for bucket in ['west-bucket', 'east-bucket'] * 10]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(router._client_for_region(None, 'default').head_bucket.call_count, 2)
+        self.assertCountEqual(self.created_regions, [None, 'us-west-2', 'us-east-1'])
+
+    def test_metadata_credentials_required(self):
+        with self.assertRaises(ValueError):
+            S3ClientRouter().client('east-bucket', 'metadata')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import concurrent.futures
+import logging
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.scheduling import (INPUT_ORDER, INTERLEAVE_BUCKETS, LARGEST_FIRST, MOST_FILES_FIRST, map_stealable,
+                               schedule_bundles)
+from loader.standard_loader import ParsedBundle, ParsedDataFile, StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+def _bundle(name, bucket, sizes):
+    data_files = [ParsedDataFile(f'{name}-{i}', f'{name}-{i}', [f'{bucket}/{name}-{i}'], size, f'{name}-{i}', 'v')
+                  for i, size in enumerate(sizes)]
+    return ParsedBundle(name, {}, data_files)
+
+
+class TestScheduling(unittest.TestCase):
+    """Unittests for the order in which bundles are loaded and the sharing of their files."""
+
+    bundles = [_bundle('a', 's3://one', [1]),
+               _bundle('b', 's3://one', [1, 1, 1]),
+               _bundle('c', 'gs://two', [100]),
+               _bundle('d', 'gs://two', [1, 2])]
+
+    def _order(self, policy):
+        return [bundle.bundle_uuid for _, bundle in schedule_bundles(self.bundles, policy)]
+
+    def test_policies(self):
+        self.assertEqual(self._order(INPUT_ORDER), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self._order(MOST_FILES_FIRST), ['b', 'd', 'a', 'c'])
+        self.assertEqual(self._order(LARGEST_FIRST), ['c', 'b', 'd', 'a'])
+        self.assertEqual(self._order(INTERLEAVE_BUCKETS), ['a', 'c', 'b', 'd'])
+        self.assertEqual([count for count, _ in schedule_bundles(self.bundles, LARGEST_FIRST)], [2, 1, 3, 0])
+        with self.assertRaises(ValueError):
+            schedule_bundles(self.bundles, 'random')
+
+    def test_map_stealable(self):
+        threads = set()
+
+        def _work(i):
+            threads.add(threading.current_thread())
+            time.sleep(0.01)
+            return i * 2
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(map_stealable(executor, _work, range(10)), list(range(0, 20, 2)))
+        # The calling thread takes part
+        self.assertIn(threading.current_thread(), threads)
+
+        # A busy executor doesn't hold up the caller
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            blocker = threading.Event()
+            executor.submit(blocker.wait)
+            try:
+                self.assertEqual(map_stealable(executor, lambda i: i + 1, range(3)), [1, 2, 3])
+            finally:
+                blocker.set()
+
+    def test_map_stealable_failure(self):
+        calls = []
+
+        def _work(i):
+            calls.append(i)
+            if i == 1:
+                raise RuntimeError('failed')
+            return i
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            blocker = threading.Event()
+            executor.submit(blocker.wait)
+            try:
+                with self.assertRaises(RuntimeError):
+                    map_stealable(executor, _work, range(5))
+            finally:
+                blocker.set()
+        # The calls after the failure were canceled
+        self.assertEqual(calls, [0, 1])
+
+    def test_load_with_file_workers(self):
+        logging.getLogger('loader').setLevel(logging.WARNING)
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:4]
+        dss_uploader = mock.MagicMock(dry_run=False)
+        dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, file_version, filename, False)
+        metadata_file_uploader = mock.MagicMock()
+        metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, metadata_file_uploader, precheck_files=False,
+                                                       max_workers=2, max_file_workers=3, schedule=LARGEST_FIRST)
+        self.assertTrue(bundle_uploader.load_all_bundles(input_json, concurrently=True))
+        self.assertEqual(len(bundle_uploader.bundles_loaded), len(input_json))
+        for call in dss_uploader.load_bundle.call_args_list:
+            file_info_list, bundle_uuid = call[0]
+            bundle = next(bundle for bundle in input_json if bundle['data_bundle']['id'] == bundle_uuid)
+            # The files are listed in the order of the input, after the metadata file
+            self.assertEqual([file_info['uuid'] for file_info in file_info_list[1:]],
+                             [StandardFormatBundleUploader._get_file_uuid(file_guid)
+                              for file_guid in bundle['data_objects']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import random
+import unittest
+from pathlib import Path
+
+from loader.fingerprints import fingerprint
+from util import serialization
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_canonical(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class TestSerialization(unittest.TestCase):
+    """Unittests for the JSON backends and the canonical encoding."""
+
+    def setUp(self):
+        self.addCleanup(serialization.use_backend, serialization.backend())
+        with open(str(TEST_DATA_PATH / 'topmed-public.json'), 'rb') as fh:
+            self.content = fh.read()
+        random.seed(49)
+        self.values = [
+            json.loads(self.content)['data_objects'][:20],
+            dict(b=1, a=[1.5, 1e16, 1e-05, 1.5e-07, 0.0001, 123456789.123, -0.0, 2 ** 63 - 1], c=None),
+            {'ünïcödé': 'snowman ☃   "quoted" \\ \x00 \x1f \U0001F600', 'a': True},
+            [random.uniform(-1e20, 1e20) for _ in range(100)] + [random.random() / 1e6 for _ in range(100)],
+            # Not supported by orjson
+            dict(big=2 ** 64, negative=-2 ** 70),
+            {2: 'integer keys', 1: False},
+            1e16,
+        ]
+
+    def test_backends(self):
+        self.assertEqual(serialization.use_backend(serialization.STDLIB), serialization.STDLIB)
+        with self.assertRaises(ValueError):
+            serialization.use_backend('simdjson')
+        if orjson is None:
+            with self.assertRaises(ImportError):
+                serialization.use_backend(serialization.ORJSON)
+        else:
+            self.assertEqual(serialization.use_backend(), serialization.ORJSON)
+
+    def test_round_trip(self):
+        for name in serialization.BACKENDS if orjson else (serialization.STDLIB,):
+            serialization.use_backend(name)
+            for value in self.values[:5]:
+                with self.subTest(backend=name, value=str(value)[:20]):
+                    self.assertEqual(serialization.loads(serialization.dumps(value)), value)
+                    self.assertEqual(serialization.loads(serialization.canonical_dumps(value)), value)
+            self.assertEqual(serialization.loads(self.content), json.loads(self.content))
+            self.assertEqual(serialization.dumps(dict(a=object()), default=lambda _: 'x'), b'{"a":"x"}')
+
+    def test_canonical(self):
+        """The canonical encoding, and so the fingerprints, are the same with either backend"""
+        for name in serialization.BACKENDS if orjson else (serialization.STDLIB,):
+            serialization.use_backend(name)
+            for value in self.values:
+                with self.subTest(backend=name, value=str(value)[:20]):
+                    self.assertEqual(serialization.canonical_dumps(value), _stdlib_canonical(value))
+        self.assertEqual(fingerprint(dict(b=1, a='x')), fingerprint(dict(a='x', b=1)))
+
+    def test_indented(self):
+        value = self.values[0][0]
+        self.assertEqual(serialization.indented_dumps(value), json.dumps(value, indent=4).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import logging
+import os
+import signal
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from loader.deadlines import Deadline, current_deadline
+from loader.shutdown import Checkpoint, GracefulShutdown
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestShutdown(unittest.TestCase):
+    """Unittests for stopping a load gracefully and resuming it. The DSS is mocked."""
+
+    def setUp(self):
+        logging.getLogger('loader').setLevel(logging.CRITICAL)
+        self.input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:6]
+        self.dss_uploader = mock.MagicMock(dry_run=False, pending_copies={})
+        self.metadata_file_uploader = mock.MagicMock()
+        self.metadata_file_uploader.load_dict.return_value = ('m', 'v', 'metadata.json', False)
+
+    def test_checkpoint(self):
+        checkpoint = Checkpoint.of(self.input_json, {self.input_json[0]['data_bundle']['id']},
+                                   [dict(uuid='u', version='v', dss_version='d', source_url='s3://b/k')])
+        self.assertEqual(len(checkpoint.unfinished_bundles), len(self.input_json) - 1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'checkpoint.json')
+            self.assertIsNone(Checkpoint.load(path))
+            checkpoint.save(path)
+            self.assertEqual(Checkpoint.load(path), checkpoint)
+            self.assertEqual(checkpoint.unfinished(self.input_json), self.input_json[1:])
+            Checkpoint([], []).save(path)
+            self.assertFalse(os.path.exists(path))
+
+    def test_signals(self):
+        shutdown = GracefulShutdown(grace_period=60)
+        deadline = Deadline()
+        with shutdown.signals_handled(), shutdown.track(deadline):
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(shutdown.requested.is_set())
+            self.assertFalse(deadline.canceled)
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(deadline.canceled)
+        self.assertIs(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+
+    def test_drain(self):
+        shutdown = GracefulShutdown(grace_period=0.1)
+        started = threading.Event()
+
+        def _upload(filename, file_uuid, *args, file_version):
+            started.set()
+            # Like waiting for an asynchronous copy that never finishes
+            current_deadline().sleep(60)
+
+        self.dss_uploader.upload_cloud_file_by_reference.side_effect = _upload
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       precheck_files=False, max_workers=2, shutdown=shutdown)
+        threading.Thread(target=lambda: started.wait() and shutdown.request()).start()
+        self.assertFalse(bundle_uploader.load_all_bundles(self.input_json, concurrently=True))
+        # The bundles in flight were canceled, the others never started
+        self.assertLessEqual(self.metadata_file_uploader.load_dict.call_count, 3)
+        self.assertEqual(bundle_uploader.bundles_timed_out, [])
+        self.assertEqual(bundle_uploader.bundles_failed_parsed, [])
+        checkpoint = bundle_uploader.checkpoint(self.input_json)
+        self.assertEqual(checkpoint.unfinished_bundles, [bundle['data_bundle']['id'] for bundle in self.input_json])
+
+    def test_shutdown_during_precheck(self):
+        shutdown = GracefulShutdown(grace_period=60)
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))
+
+        def _get_dss_file_version(file_uuid, file_version):
+            shutdown.request()
+            return None
+
+        self.dss_uploader.get_dss_file_version.side_effect = _get_dss_file_version
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       max_workers=2, shutdown=shutdown)
+        self.assertFalse(bundle_uploader.load_all_bundles(input_json, concurrently=True))
+        # The checks that hadn't started were canceled, and no bundle was started
+        files = sum(len(bundle['data_objects']) for bundle in input_json)
+        self.assertLess(self.dss_uploader.get_dss_file_version.call_count, files)
+        self.dss_uploader.upload_cloud_file_by_reference.assert_not_called()
+        self.metadata_file_uploader.load_dict.assert_not_called()
+        checkpoint = bundle_uploader.checkpoint(input_json)
+        self.assertEqual(checkpoint.unfinished_bundles, [bundle['data_bundle']['id'] for bundle in input_json])
+
+        # Once the shutdown is requested, the rest of the input isn't even parsed
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       shutdown=shutdown)
+        self.assertFalse(bundle_uploader.load_all_bundles(input_json))
+        self.assertEqual(bundle_uploader.bundles_parsed, [])
+
+    def test_resume(self):
+        self.dss_uploader.upload_cloud_file_by_reference.side_effect = \
+            lambda filename, file_uuid, *args, file_version: (file_uuid, file_version, filename, False)
+        bundle = self.input_json[2]
+        file_guid, file_info = next(iter(bundle['data_objects'].items()))
+        file_uuid = StandardFormatBundleUploader._get_file_uuid(file_guid)
+        file_version = StandardFormatBundleUploader._get_file_version(file_info)
+        self.dss_uploader.get_dss_file_version.side_effect = \
+            lambda uuid, version: 'copied' if (uuid, version) == (file_uuid, file_version) else None
+        checkpoint = Checkpoint([bundle['data_bundle']['id']],
+                                [dict(uuid=file_uuid, version=file_version, dss_version='copied', source_url='')])
+
+        bundle_uploader = StandardFormatBundleUploader(self.dss_uploader, self.metadata_file_uploader,
+                                                       precheck_files=False)
+        input_json = bundle_uploader.resume(checkpoint, self.input_json)
+        self.assertEqual(input_json, [bundle])
+        self.assertTrue(bundle_uploader.load_all_bundles(input_json))
+        self.assertEqual(self.dss_uploader.get_dss_file_version.call_count, 1)
+        self.assertEqual(self.dss_uploader.upload_cloud_file_by_reference.call_count, len(bundle['data_objects']) - 1)
+        self.assertTrue(bundle_uploader.checkpoint(input_json).is_empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
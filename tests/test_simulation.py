@@ -0,0 +1,76 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+from loader.base_loader import MetadataFileUploader
+from loader.simulation import LatencyModel, LoadSimulator, OperationModel, SimulatedDssUploader
+from loader.standard_loader import StandardFormatBundleUploader
+from util import load_json_from_file
+
+TEST_DATA_PATH = Path(__file__).parents[1] / 'tests' / 'test_data'
+
+
+class TestSimulation(unittest.TestCase):
+    """Unittests for simulation.py. Nothing is accessed in the cloud or the DSS."""
+
+    def _simulator(self, latency_model, **kwargs):
+        dss_uploader = SimulatedDssUploader(latency_model, 'https://dss.example.org/v1', 'staging-bucket',
+                                            'google-project', True)
+        bundle_uploader = StandardFormatBundleUploader(dss_uploader, MetadataFileUploader(dss_uploader), **kwargs)
+        return LoadSimulator(dss_uploader, bundle_uploader)
+
+    def test_record_traces_every_bundle(self):
+        logging.getLogger('loader').setLevel(logging.WARNING)
+        simulator = self._simulator(LatencyModel())
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))
+        simulator.record(input_json)
+        self.assertEqual(len(simulator.traces), len(input_json))
+        self.assertEqual(len(simulator.bundle_uploader.bundles_loaded), len(input_json))
+        # every bundle puts at least its metadata file and the bundle itself
+        for trace in simulator.traces:
+            self.assertGreaterEqual(len([service for service, _ in trace if service == 'dss']), 2)
+
+    def test_load_by_value(self):
+        logging.getLogger('loader').setLevel(logging.WARNING)
+        simulator = self._simulator(LatencyModel(), load_by_value=True)
+        input_json = load_json_from_file(str(TEST_DATA_PATH / 'multiple_bundles.json'))[:5]
+        simulator.record(input_json)
+        self.assertEqual(len(simulator.bundle_uploader.bundles_loaded), len(input_json))
+        self.assertEqual(simulator.bundle_uploader.bundles_failed_parsed, [])
+
+    def test_local_file(self):
+        simulator = self._simulator(LatencyModel())
+        with tempfile.NamedTemporaryFile() as fh:
+            fh.write(b'reads')
+            fh.flush()
+            file_uuid, _, _, _ = simulator.dss_uploader.upload_local_file(fh.name, 'uuid')
+        self.assertEqual(file_uuid, 'uuid')
+        self.assertEqual([service for service, _ in simulator.dss_uploader.trace], ['s3', 's3', 'dss'])
+
+    def test_report_current_settings(self):
+        simulator = self._simulator(LatencyModel(), max_workers=7)
+        simulator.traces = [[('dss', 1.0)] for _ in range(4)]
+        self.assertIn('current settings (7 workers, 64 connections)', simulator.report())
+        self.assertIn('current settings (7 workers, 10 connections)', simulator.report(connections=10))
+
+    def test_runtime(self):
+        simulator = self._simulator(LatencyModel(capacity={'dss': 2}))
+        simulator.traces = [[('dss', 1.0)] for _ in range(4)]
+        self.assertAlmostEqual(simulator.runtime(workers=1, connections=10), 4.0)
+        self.assertAlmostEqual(simulator.runtime(workers=4, connections=1), 4.0)
+        # limited by the capacity of the service rather than the number of workers or connections
+        self.assertAlmostEqual(simulator.runtime(workers=4, connections=10), 2.0)
+        recommended = simulator.recommend(simulator.evaluate(worker_options=(1, 2, 4), connection_options=(1, 2, 4)))
+        self.assertEqual((recommended.workers, recommended.connections), (2, 2))
+
+    def test_failed_attempts_are_retried(self):
+        model = LatencyModel({'dss_put_file': OperationModel('dss', latency=1.0, jitter=0, error_rate=0.5)},
+                             retry_backoff=10.0)
+        durations = [model.sample('dss_put_file')[1] for _ in range(100)]
+        self.assertEqual(min(durations), 1.0)
+        self.assertTrue(any(duration >= 12.0 for duration in durations))
+
+
+if __name__ == '__main__':
+    unittest.main()
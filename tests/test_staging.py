@@ -0,0 +1,115 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from loader.base_loader import DssUploader
+from loader.checksumming import ChecksumCache
+from loader.staging import MappedFile, MemoryviewReader, checksum_mapped_file, upload_mapped_file
+
+KiB = 1024
+
+
+class TestStaging(unittest.TestCase):
+    """Unittests for staging.py. The S3 client is mocked so no AWS access is needed."""
+
+    chunk_size = 64 * KiB
+
+    def setUp(self):
+        self.objects = {}
+        self.parts = {}
+        self.s3 = mock.MagicMock()
+        self.s3.put_object.side_effect = self._put_object
+        self.s3.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        self.s3.upload_part.side_effect = self._upload_part
+        self.s3.complete_multipart_upload.side_effect = self._complete_multipart_upload
+
+    def _put_object(self, Bucket, Key, Body, **kwargs):
+        data = bytes(Body.read())
+        self.objects[Key] = data, hashlib.md5(data).hexdigest()
+
+    def _upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = bytes(Body.read())
+        return {'ETag': hashlib.md5(self.parts[PartNumber]).hexdigest()}
+
+    def _complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = [self.parts[part['PartNumber']] for part in MultipartUpload['Parts']]
+        digests = b''.join(hashlib.md5(part).digest() for part in parts)
+        self.objects[Key] = b''.join(parts), f'{hashlib.md5(digests).hexdigest()}-{len(parts)}'
+
+    def _upload(self, size: int) -> dict:
+        data = os.urandom(size)
+        with tempfile.NamedTemporaryFile() as fh:
+            fh.write(data)
+            fh.flush()
+            with MappedFile(fh.name) as mapped_file:
+                upload_mapped_file(self.s3, mapped_file, 'staging', 'key', chunk_size=self.chunk_size,
+                                   multipart_threshold=self.chunk_size + 1, max_concurrency=2)
+                checksums = checksum_mapped_file(mapped_file, self.chunk_size)
+        self.assertEqual(self.objects['key'], (data, checksums['s3_etag']))
+        return checksums
+
+    def test_single_part_upload(self):
+        self.assertNotIn('-', self._upload(KiB + 1)['s3_etag'])
+
+    def test_multipart_upload(self):
+        self.assertTrue(self._upload(2 * self.chunk_size + 17)['s3_etag'].endswith('-3'))
+
+    def test_empty_file(self):
+        self._upload(0)
+
+    def test_failed_multipart_upload_aborted(self):
+        self.s3.upload_part.side_effect = RuntimeError('upload failed')
+        with self.assertRaises(RuntimeError):
+            self._upload(3 * self.chunk_size)
+        self.s3.abort_multipart_upload.assert_called_once_with(Bucket='staging', Key='key', UploadId='upload')
+
+    def test_memoryview_reader(self):
+        reader = MemoryviewReader(memoryview(b'0123456789'))
+        self.assertEqual(bytes(reader.read(4)), b'0123')
+        self.assertEqual(len(reader), 6)
+        reader.seek(-2, os.SEEK_END)
+        self.assertEqual(bytes(reader.read()), b'89')
+        self.assertEqual(reader.tell(), 10)
+
+
+class TestContentAddressedStaging(unittest.TestCase):
+    """Unittests for staging local files under content-addressed keys. S3 is mocked."""
+
+    def setUp(self):
+        self.uploader = DssUploader('https://dss.example.org/v1', 'staging', 'project', dry_run=False,
+                                    content_addressed_staging=True)
+        self.uploader.checksum_cache = ChecksumCache(os.path.join(tempfile.mkdtemp(), 'checksums.sqlite'))
+        self.uploader.s3_router = mock.MagicMock()
+        self.s3 = self.uploader.s3_router.client.return_value
+        fh = tempfile.NamedTemporaryFile(suffix='.bam')
+        self.addCleanup(fh.close)
+        fh.write(b'reads')
+        fh.flush()
+        self.path = fh.name
+
+    def test_identical_content_not_uploaded_again(self):
+        self.uploader._upload_local_file_to_staging(self.path, 'uuid-1', None)
+        self.s3.put_object.assert_called_once()
+        key = self.s3.put_object.call_args[1]['Key']
+        self.assertEqual(key, f'sha256/{hashlib.sha256(b"reads").hexdigest()}/{os.path.basename(self.path)}')
+        tags = self.s3.put_object_tagging.call_args[1]['Tagging']['TagSet']
+        self.s3.head_object.return_value = {'ETag': '"{}"'.format(hashlib.md5(b'reads').hexdigest())}
+        self.s3.get_object_tagging.return_value = {'TagSet': tags}
+
+        self.assertEqual(self.uploader._upload_local_file_to_staging(self.path, 'uuid-2', None), ('uuid-2', key))
+        self.s3.put_object.assert_called_once()
+
+    def test_dry_run_not_staged(self):
+        self.uploader.dry_run = True
+        key = f'sha256/{hashlib.sha256(b"reads").hexdigest()}/{os.path.basename(self.path)}'
+        self.assertEqual(self.uploader._upload_local_file_to_staging(self.path, 'uuid-1', None), ('uuid-1', key))
+        self.uploader.content_addressed_staging = False
+        self.assertEqual(self.uploader._upload_local_file_to_staging(self.path, 'uuid-2', None),
+                         ('uuid-2', f'uuid-2/{os.path.basename(self.path)}'))
+        self.assertEqual(self.uploader.s3_router.mock_calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
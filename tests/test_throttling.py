@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from loader.throttling import AdaptiveTokenBucket, RateLimiter, TokenBucket, TransferBudget, install_s3_rate_limiter
+
+
+class TestThrottling(unittest.TestCase):
+    """Unittests for throttling.py."""
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(rate=1000, capacity=10)
+        start = time.monotonic()
+        for _ in range(30):
+            bucket.acquire(10)
+        # The initial burst is free, the remaining 290 tokens take 0.29s
+        self.assertAlmostEqual(time.monotonic() - start, 0.29, delta=0.1)
+
+    def test_requests_larger_than_capacity_admitted(self):
+        bucket = TokenBucket(rate=1000, capacity=10)
+        self.assertAlmostEqual(bucket.acquire(60), 0.05, delta=0.01)
+
+    def test_budget_limits_concurrency(self):
+        budget = TransferBudget(max_concurrency=2)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def transfer():
+            with budget.transfer(1):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=transfer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_adaptive_rate(self):
+        bucket = AdaptiveTokenBucket(rate=100)
+        bucket.decrease()
+        self.assertEqual(bucket.rate, 50)
+        # A burst of throttled requests halves the rate once
+        bucket.decrease()
+        self.assertEqual(bucket.rate, 50)
+        time.sleep(0.1)
+        bucket.increase()
+        self.assertAlmostEqual(bucket.rate, 50 + 0.1 * 5, delta=0.2)
+        for _ in range(20):
+            bucket._decreased -= 1
+            bucket.decrease()
+        self.assertEqual(bucket.rate, bucket.min_rate)
+
+    def test_adaptive_rate_sustained_throttling(self):
+        """Successes between throttled requests don't keep the rate from being lowered"""
+        clock = [1000.0]
+        with mock.patch('loader.throttling.time') as time_mock:
+            time_mock.monotonic.side_effect = lambda: clock[0]
+            bucket = AdaptiveTokenBucket(rate=100)
+            rates = []
+            for _ in range(30):
+                clock[0] += 0.1
+                bucket.increase()
+                bucket.decrease()
+                rates.append(bucket.rate)
+        # Halved once per second, and grown back by 5 per second in between
+        for rate, expected in zip(rates[::10], [50, 27.5, 16.25]):
+            self.assertAlmostEqual(rate, expected)
+        self.assertLess(max(rates[20:]), 25)
+
+    def test_rate_limiter_scopes(self):
+        limiter = RateLimiter.parse(['s3=1000', 's3:bucket=100', 's3:bucket/a/=10', 's3:bucket/a/b/=1', 'dss:put_file=5'])
+        scoped = limiter._scoped
+        self.assertEqual([bucket.rate for bucket in scoped('s3', 'bucket', 'a/b/c')], [1, 100, 1000])
+        self.assertEqual([bucket.rate for bucket in scoped('s3', 'bucket', 'a/c')], [10, 100, 1000])
+        self.assertEqual([bucket.rate for bucket in scoped('s3', 'other', 'a/c')], [1000])
+        self.assertEqual([bucket.rate for bucket in scoped('dss', 'put_file')], [5])
+        self.assertEqual(scoped('gs', 'bucket', 'key'), [])
+        # Only the most specific limit is lowered
+        limiter.throttled('s3', 'bucket', 'a/c')
+        self.assertEqual([bucket.rate for bucket in scoped('s3', 'bucket', 'a/c')], [5, 100, 1000])
+        for spec in ('s3', '=5', 's3=fast', 's3=0'):
+            with self.assertRaises(ValueError):
+                RateLimiter.parse([spec])
+        self.assertEqual(RateLimiter().acquire('s3', 'bucket', 'key'), 0)
+
+    def test_s3_rate_limiter(self):
+        limiter = mock.MagicMock(limits={'s3': 1})
+        client = mock.MagicMock()
+        install_s3_rate_limiter(client, limiter)
+        handlers = {call[0][0]: call[0][1] for call in client.meta.events.register.call_args_list}
+        context = dict()
+        handlers['provide-client-params.s3'](params=dict(Bucket='bucket', Key='key'), context=context)
+        limiter.acquire.assert_called_once_with('s3', 'bucket', 'key')
+
+        slow_down = (mock.MagicMock(status_code=503), dict(Error=dict(Code='SlowDown')))
+        self.assertIsNone(handlers['needs-retry.s3'](response=slow_down, request_dict=dict(context=context)))
+        limiter.throttled.assert_called_once_with('s3', 'bucket', 'key')
+        ok = (mock.MagicMock(status_code=200), dict())
+        handlers['needs-retry.s3'](response=ok, request_dict=dict(context=context))
+        limiter.succeeded.assert_called_once_with('s3', 'bucket', 'key')
+
+
+if __name__ == '__main__':
+    unittest.main()
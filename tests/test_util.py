@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+
+from util import StepTimer, lazy_property, single_flight
+
+
+class TestUtil(unittest.TestCase):
+    """Unittests for the util module."""
+
+    def test_lazy_property_computed_once(self):
+        class Uploader:
+            calls = 0
+
+            @lazy_property
+            def client(self):
+                Uploader.calls += 1
+                time.sleep(0.01)
+                return object()
+
+        uploader = Uploader()
+        self.assertEqual(Uploader.calls, 0)
+        threads = [threading.Thread(target=lambda: uploader.client) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Uploader.calls, 1)
+        self.assertIs(uploader.client, uploader.client)
+        uploader.client = 'replaced'
+        self.assertEqual(uploader.client, 'replaced')
+
+    def test_step_timer_report(self):
+        timer = StepTimer()
+        with timer.step('first step'):
+            pass
+        report = timer.report()
+        self.assertIn('first step', report)
+        self.assertIn('total', report)
+
+    def test_single_flight(self):
+        class Uploader:
+            def __init__(self, endpoint='dss'):
+                self.endpoint = endpoint
+                self.calls = []
+
+            @single_flight(lambda uploader, file_uuid, urls: (uploader.endpoint, file_uuid, frozenset(urls)),
+                           shared_result=str.lower, max_results=2)
+            def upload(self, file_uuid, urls):
+                self.calls.append(file_uuid)
+                time.sleep(0.01)
+                if file_uuid == 'bad' and self.calls.count('bad') == 1:
+                    raise RuntimeError('first attempt fails')
+                return file_uuid.upper()
+
+        uploader = Uploader()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(uploader.upload('a', ['s3://x', 'gs://x'])))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The caller that made the call gets its result, the others the shared result
+        self.assertEqual(sorted(results), ['A'] + ['a'] * 9)
+        self.assertEqual(uploader.upload('a', ['gs://x', 's3://x']), 'a')
+        self.assertEqual(uploader.calls, ['a'])
+
+        # Failures are not remembered
+        with self.assertRaises(RuntimeError):
+            uploader.upload('bad', [])
+        self.assertEqual(uploader.upload('bad', []), 'BAD')
+        self.assertEqual(uploader.calls, ['a', 'bad', 'bad'])
+
+        # Results are shared by the instances in the process, as far as the key allows
+        self.assertEqual(Uploader().upload('bad', []), 'bad')
+        other = Uploader('other dss')
+        self.assertEqual(other.upload('a', []), 'A')
+        self.assertEqual(other.calls, ['a'])
+
+        # Only the most recently used results are remembered
+        self.assertEqual(uploader.upload('a', ['s3://x', 'gs://x']), 'A')
+        self.assertEqual(uploader.calls, ['a', 'bad', 'bad', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,42 @@
+import collections
 import datetime
-import json
+import fcntl
+import functools
 import logging
-from hca import HCAConfig
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from util import serialization
+
+# Where the loader keeps data that is shared between runs, such as the DSS swagger spec
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'cgp-dss-data-loader')
 
 
 def load_json_from_file(input_file_path: str):
-    with open(input_file_path) as fh:
-        return json.load(fh)
+    return serialization.load_file(input_file_path)
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock, shared between processes, for the duration of the context"""
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(path: str, content: bytes, mode: int = 0o644):
+    """Write a file such that readers see either the previous or the complete new content"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
 
 
 def suppress_verbose_logging():
@@ -45,4 +75,140 @@ def utc_now():
 
 
 def monkey_patch_hca_config():
+    from hca import HCAConfig
     HCAConfig.__init__ = HCAConfig.__bases__[0].__init__
+
+
+class lazy_property:
+    """
+    A property that is computed on first access, at most once per instance, and then cached
+    on the instance. Assigning to the attribute replaces the cached value.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self.lock = threading.RLock()
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with self.lock:
+            try:
+                return instance.__dict__[self.name]
+            except KeyError:
+                value = instance.__dict__[self.name] = self.func(instance)
+                return value
+
+
+class SingleFlight:
+    # The longest a waiter waits before checking its deadline again, in seconds
+    poll_interval = 1.0
+
+    def __init__(self, private_errors: tuple = (), deadline_func=None, shared_result=None,
+                 max_results: int = 100000):
+        """
+        Calls a function at most once per key, concurrently with other keys. Callers that ask for a key
+        while its call is in flight wait for, and share, its outcome. Results are remembered, failures
+        are not, so that a later caller tries again.
+
+        :param private_errors: Exceptions that concern the caller that raised them rather than the key, such
+                               as that caller's deadline passing. Callers waiting for the key don't share them,
+                               but try again, one of them making the call in its place.
+        :param deadline_func: Returns the deadline of the calling thread, an object with `remaining()` and
+                              `check()` methods like `loader.deadlines.Deadline`, which bounds how long it waits.
+        :param shared_result: Turns the result into the one returned to callers other than the one that made
+                              the call, e.g. to report that the call was already made.
+        :param max_results: How many results are remembered. The least recently used ones are forgotten,
+                            so that a later caller for their key makes the call again.
+        """
+        self.private_errors = private_errors
+        self.deadline_func = deadline_func
+        self.shared_result = shared_result
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._futures = dict()
+        self._results = collections.OrderedDict()
+
+    def call(self, key, func, *args, **kwargs):
+        while True:
+            with self._lock:
+                if key in self._results:
+                    self._results.move_to_end(key)
+                    return self._share(self._results[key])
+                future = self._futures.get(key)
+                owner = future is None
+                if owner:
+                    future = self._futures[key] = Future()
+            if owner:
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    with self._lock:
+                        del self._futures[key]
+                    future.set_exception(e)
+                    raise
+                with self._lock:
+                    del self._futures[key]
+                    self._results[key] = result
+                    while len(self._results) > self.max_results:
+                        self._results.popitem(last=False)
+                future.set_result(result)
+                return result
+            try:
+                return self._share(self._wait(future))
+            except self.private_errors:
+                if future.done() and future.exception() is not None:
+                    continue  # the owner's own failure, so try again
+                raise
+
+    def _share(self, result):
+        return result if self.shared_result is None else self.shared_result(result)
+
+    def _wait(self, future: Future):
+        if self.deadline_func is None:
+            return future.result()
+        deadline = self.deadline_func()
+        while True:
+            deadline.check()
+            remaining = deadline.remaining()
+            try:
+                return future.result(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+            except FutureTimeoutError:
+                pass
+
+
+def single_flight(key_func, **kwargs):
+    """
+    Decorate a method such that concurrent and repeated calls with the same key, as computed by
+    `key_func` from the method's arguments (including self), share one call in the process. See
+    `SingleFlight` for the other arguments.
+    """
+    def decorator(method):
+        group = SingleFlight(**kwargs)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return group.call(key_func(self, *args, **kwargs), method, self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StepTimer:
+    """Records the wall clock time taken by named steps, e.g. during startup"""
+    def __init__(self, start: float = None) -> None:
+        self.start = time.perf_counter() if start is None else start
+        self.steps = []
+
+    @contextmanager
+    def step(self, name: str):
+        step_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - step_start))
+
+    def report(self) -> str:
+        lines = [f'{name:<40} {seconds * 1000:>10.1f} ms' for name, seconds in self.steps]
+        lines.append(f'{"total":<40} {(time.perf_counter() - self.start) * 1000:>10.1f} ms')
+        return '\n'.join(lines)
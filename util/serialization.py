@@ -0,0 +1,111 @@
+"""
+JSON encoding and decoding, with a fast backend when one is installed.
+
+orjson is used if it can be imported, and the json module of the standard library otherwise. The
+backend can be chosen with the CGP_DSS_LOADER_JSON environment variable, set to "orjson" or "json",
+or with `use_backend`, e.g. to compare them.
+
+`canonical_dumps` is the encoding for hashing and comparing content: compact, with sorted keys and
+non-ASCII characters unescaped. It produces the same bytes with either backend, so that hashes, like
+the fingerprints in an index written by one installation, match those computed by another.
+"""
+import json
+import logging
+import os
+import re
+import typing
+
+logger = logging.getLogger(__name__)
+
+ORJSON = 'orjson'
+STDLIB = 'json'
+BACKENDS = (ORJSON, STDLIB)
+
+# Floats that orjson formats differently from the json module, which writes e.g. 1e+16, 1.5e-07 and 1e-05,
+# rather than 1e16, 1.5e-7 and 0.00001. Matches in strings merely cause the json module to be used for that
+# value. The exponents are found by the end of their number, as hexadecimal strings like checksums are common.
+_exponent = re.compile(rb'e-?[0-9]+(?:[,\]}]|\Z)')
+_small_float = b'0.0000'
+
+_orjson: typing.Any = None
+
+
+def use_backend(name: str = None) -> str:
+    """
+    Use the given backend, or the fastest one installed if None, returning the name of the backend used.
+
+    :raises ImportError: If the given backend is not installed.
+    """
+    global _orjson
+    if name not in (None,) + BACKENDS:
+        raise ValueError(f'Unknown JSON backend {name}. Expected one of {", ".join(BACKENDS)}')
+    _orjson = None
+    if name in (None, ORJSON):
+        try:
+            import orjson
+        except ImportError:
+            if name == ORJSON:
+                raise
+            logger.debug('orjson is not installed, using the json module')
+        else:
+            _orjson = orjson
+    return backend()
+
+
+def backend() -> str:
+    """The name of the backend in use"""
+    return STDLIB if _orjson is None else ORJSON
+
+
+def loads(data: typing.Union[bytes, bytearray, memoryview, str]) -> typing.Any:
+    """Decode a JSON document"""
+    if _orjson is not None:
+        return _orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def load_file(path: str) -> typing.Any:
+    """Decode the JSON document in the given file"""
+    with open(path, 'rb') as fh:
+        return loads(fh.read())
+
+
+def dumps(value, default: typing.Callable = None) -> bytes:
+    """
+    Encode a value as compact JSON, with keys in the order of their dicts.
+
+    :param default: Returns a serializable version of values that aren't.
+    """
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(value, default=default)
+        except TypeError:
+            # e.g. integers beyond 64 bits, or keys that aren't strings
+            pass
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=default).encode('utf-8')
+
+
+def canonical_dumps(value) -> bytes:
+    """Encode a value as the canonical JSON for hashing and comparing it, see the module's documentation"""
+    if _orjson is not None:
+        try:
+            encoded = _orjson.dumps(value, option=_orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+        else:
+            if _small_float not in encoded and _exponent.search(encoded) is None:
+                return encoded
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def indented_dumps(value) -> bytes:
+    """
+    Encode a value as indented JSON, as the loader has always written the metadata and fileref files it uploads.
+    Uploading the same content as before, byte for byte, lets the DSS and the staging bucket recognize it.
+    """
+    return json.dumps(value, indent=4).encode('utf-8')
+
+
+use_backend(os.environ.get('CGP_DSS_LOADER_JSON') or None)